@@ -1,4 +1,3 @@
-import sys
 import customtkinter as ctk
 from modules.console_frame import ConsoleFrame
 from modules.login_frame import LoginFrame
@@ -6,9 +5,13 @@ from modules.upload_frame import UploadFrame
 from modules.path_frame import PathFrame
 from modules.checkbox_frame import CheckboxFrame
 from modules.api_client import ImmichClient
+from modules.async_client import AsyncBridge, AsyncImmichClient
 from modules.download_frame import DownloadFrame
 from modules.add_asset_frame import AddAssetFrame
 from modules.smart_frame import SmartAssetFrame
+from modules.stats_frame import StatsFrame
+from modules.thumbnail_cache import ThumbnailCache
+from modules.ui_dispatcher import UiDispatcher
 
 
 class GimmichApp(ctk.CTk):
@@ -18,7 +21,12 @@ class GimmichApp(ctk.CTk):
         self.title("gimmich")  # Set a default size and name for the window
         self.geometry("1200x600")
 
-        self.client = ImmichClient()  # Create the API client.
+        self.client = ImmichClient(load_credentials=False)  # Create the API client, the login frame loads the login
+        self.async_bridge = AsyncBridge()  # Background event loop for concurrent API work
+        self.async_client = AsyncImmichClient(self.client, self.async_bridge)
+        self.thumbnail_cache = ThumbnailCache(self.client)  # Shared by every frame showing thumbnails
+        self.dispatcher = UiDispatcher(self)  # Worker threads update widgets only through this
+        self.dispatcher.start()
 
         self.grid_rowconfigure(0, weight=1)  # Configure row and column weights for resizing
         self.grid_columnconfigure(0, weight=1)
@@ -26,7 +34,12 @@ class GimmichApp(ctk.CTk):
         self.tab_view = ctk.CTkTabview(self)  # Create Tabview
         self.tab_view.grid(row=0, column=0, padx=2, pady=2, sticky="nsew")
 
+        self.console_frame = None
         self.login_frame = None
+        self.upload_frame = None
+        self.download_frame = None
+        self.add_asset_frame = None
+        self.resume_offered = False
         self.login_tab = self.tab_view.add("Login")  # Create Login Tab
         self.init_login_tab(self.login_tab)
 
@@ -36,18 +49,23 @@ class GimmichApp(ctk.CTk):
         self.download_tab = self.tab_view.add("Download")  # Create Download Tab
         self.init_download_tab(self.download_tab)
 
+        self.stats_tab = self.tab_view.add("Stats")  # Create Stats Tab
+        self.init_stats_tab(self.stats_tab)
+
+        self.login_frame.login_listeners.append(self.on_login_changed)  # Load packs once the login is known
+
     def init_login_tab(self, tab: ctk.CTkFrame):
         """Initialize the login tab."""
         tab.grid_rowconfigure(0, weight=1)  # Configure row and column weights for resizing
         tab.grid_columnconfigure(0, weight=1)
         tab.grid_columnconfigure(1, weight=100)
 
-        console_text = ConsoleFrame(tab)  # Create Console Frame
-        console_text.grid(row=0, column=1, padx=2, pady=2, sticky="nsew")
-        console_text.grid_rowconfigure(1, weight=1)
-        console_text.grid_columnconfigure(0, weight=1)
+        self.console_frame = ConsoleFrame(tab, self.dispatcher)  # Create Console Frame
+        self.console_frame.grid(row=0, column=1, padx=2, pady=2, sticky="nsew")
+        self.console_frame.grid_rowconfigure(1, weight=1)
+        self.console_frame.grid_columnconfigure(0, weight=1)
 
-        self.login_frame = LoginFrame(tab, self.client)  # Create Login Frame
+        self.login_frame = LoginFrame(tab, self.client, self.dispatcher)  # Create Login Frame
         self.login_frame.grid(row=0, column=0, padx=2, pady=2, sticky="nsew")
 
     def init_upload_tab(self, tab: ctk.CTkFrame):
@@ -63,8 +81,9 @@ class GimmichApp(ctk.CTk):
         checkbox_frame = CheckboxFrame(tab)  # Create Checkbox Frame
         checkbox_frame.grid(row=0, column=1, padx=10, pady=2, sticky="nsew")
 
-        upload_frame = UploadFrame(tab, path_frame, checkbox_frame, self.login_frame, self.client)  # Make Upload Frame
-        upload_frame.grid(row=1, column=1, padx=10, pady=2, sticky="sew")
+        self.upload_frame = UploadFrame(tab, path_frame, checkbox_frame, self.login_frame, self.client,
+                                        self.dispatcher)  # Create Upload Frame
+        self.upload_frame.grid(row=1, column=1, padx=10, pady=2, sticky="sew")
 
     def init_download_tab(self, tab: ctk.CTkFrame):
         """Initialize the Download tab."""
@@ -76,18 +95,40 @@ class GimmichApp(ctk.CTk):
         tab.grid_columnconfigure(1, weight=1)
         tab.grid_columnconfigure(2, weight=1)
 
-        download_frame = DownloadFrame(tab, self.login_frame, self.client)  # Create Download Frame
-        download_frame.grid(row=0, column=2, padx=2, pady=2, sticky="nsew")
+        self.download_frame = DownloadFrame(tab, self.login_frame, self.client, self.dispatcher)  # Download Frame
+        self.download_frame.grid(row=0, column=2, padx=2, pady=2, sticky="nsew")
 
-        smart_search_frame = SmartAssetFrame(tab, self.client, download_frame)
+        smart_search_frame = SmartAssetFrame(tab, self.client, self.download_frame, self.thumbnail_cache,
+                                             self.dispatcher)
         smart_search_frame.grid(row=0, column=1, padx=2, pady=2, sticky="nsew")
 
-        add_asset_frame = AddAssetFrame(tab, self.client, download_frame)  # Create Add Asset Frame
-        add_asset_frame.grid(row=0, column=0, padx=2, pady=2, sticky="nsew")
+        self.add_asset_frame = AddAssetFrame(tab, self.client, self.async_client, self.download_frame,
+                                             self.thumbnail_cache, self.dispatcher)
+        self.add_asset_frame.grid(row=0, column=0, padx=2, pady=2, sticky="nsew")
+
+    def init_stats_tab(self, tab: ctk.CTkFrame):
+        """Initialize the Stats tab."""
+        tab.grid_rowconfigure(0, weight=1)  # Configure row and column weights for resizing
+        tab.grid_columnconfigure(0, weight=1)
+
+        stats_frame = StatsFrame(tab, self.client.metrics)  # Create Stats Frame
+        stats_frame.grid(row=0, column=0, padx=2, pady=2, sticky="nsew")
+
+    def on_login_changed(self):
+        """Reloads the download packs for the new login and, the first time a login succeeds, offers to resume
+        uploads and downloads that were interrupted last time"""
+        self.add_asset_frame.refresh_packs()
+        if self.client.logged_in and not self.resume_offered:
+            self.resume_offered = True
+            self.upload_frame.offer_resume()
+            self.download_frame.offer_resume()
 
     def on_closing(self):
         """Restore sys.stdout before closing"""
-        sys.stdout = sys.__stdout__
+        self.console_frame.close()
+        self.dispatcher.stop()
+        self.async_bridge.stop()
+        self.client.close()  # Release pooled keep-alive connections
         self.destroy()
 
 
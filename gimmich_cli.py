@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+from modules.api_client import ImmichClient
+from modules.async_client import AsyncBridge, AsyncImmichClient
+from modules.console_log import APP_LOGGER
+from modules.download_engine import DownloadEngine
+from modules.job_journal import JobJournal
+from modules.upload_engine import UploadEngine, list_files
+
+EXIT_OK = 0
+EXIT_FAILURES = 1  # The job finished but some files failed
+EXIT_USAGE = 2  # Bad arguments, also what argparse exits with
+EXIT_AUTH = 3  # No server or the api key was rejected
+EXIT_ERROR = 4  # The job aborted with an unexpected error
+EXIT_INTERRUPTED = 130  # Stopped by SIGINT/SIGTERM, the journal is kept for --resume
+
+DIRECTORY_TYPES = {'none': 0, 'pack': 1, 'user': 2}  # Pack directory_type option values
+CAPTION_TYPES = {'none': 0, 'descriptions': 1, 'tags': 2}  # Pack caption_type option values
+
+
+class LoginInterrupted(BaseException):
+    """Raised by the signal handler to abandon the login check, which may be waiting on retries. A BaseException so
+    the clients error handling doesn't swallow it."""
+
+
+class JsonEvents:
+    """Writes one JSON object per line to the real stdout. Everything the client prints goes to stderr instead so
+    stdout stays machine readable. Progress events are throttled to one per interval seconds per stage."""
+    def __init__(self, stream, interval: float = 1.0):
+        self.stream = stream
+        self.interval = interval
+        self._last_progress: Dict[str, float] = {}
+        self._last_phase = None
+        self._last_status = 0.0
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        """Writes an event line"""
+        with self._lock:
+            self.stream.write(json.dumps(dict(event=event, time=round(time.time(), 3), **fields)) + "\n")
+            self.stream.flush()
+
+    def status(self, text: str):
+        """Status lines from the engines. Counters within one phase, like "Uploading... 5/10 files", are
+        throttled like progress while a new phase is always written."""
+        phase = text.split("...")[0]
+        now = time.monotonic()
+        if phase == self._last_phase and now - self._last_status < self.interval:
+            return
+        self._last_phase = phase
+        self._last_status = now
+        self.emit("status", message=text)
+
+    def progress(self, stage: str, done: int, total: int):
+        """Progress from the engines, always emitting the last step of a stage"""
+        now = time.monotonic()
+        if done < total and now - self._last_progress.get(stage, 0) < self.interval:
+            return
+        self._last_progress[stage] = now
+        self.emit("progress", stage=stage, done=done, total=total)
+
+
+def checkbox_states_from_args(args) -> Dict:
+    """Builds the same dict CheckboxFrame.get_states() returns from the upload arguments"""
+    return {
+        "recursive": args.recursive,
+        "directory_names_as_albums": args.directory_names_as_albums,
+        "album_input_enabled": args.album_input is not None,
+        "album_input": args.album_input or "",
+        "directory_names_as_tags": args.directory_names_as_tags,
+        "tag_input_enabled": args.tag_input is not None,
+        "tag_input": args.tag_input or "",
+        "import_captions": args.import_captions,
+        "captions_as_tags": args.captions_as_tags,
+        "caption_delimiters": args.caption_delimiters
+    }
+
+
+def pack_options(args, name: str, asset_ids: List[str]) -> Dict:
+    """Builds the same dict AddPackDownloadFrame.get_options() returns for one pack"""
+    return {
+        'name': name,
+        'asset_ids': asset_ids,
+        'directory_type': DIRECTORY_TYPES[args.directory_type],
+        'user_directory': args.user_directory,
+        'caption_type': CAPTION_TYPES[args.caption_type]
+    }
+
+
+def resolve_packs(args, client: ImmichClient, async_client: AsyncImmichClient,
+                  events: JsonEvents) -> Tuple[List[Dict], int]:
+    """Turns the --album, --tag, --person and --search arguments into download packs, resolving the albums, tags
+    and people concurrently. Returns the packs and EXIT_OK, or the exit code of the first pack that could not be
+    resolved: EXIT_USAGE for an unknown name, EXIT_ERROR for a failed search."""
+    queries = []  # (name, kind, id) of every album, tag and person pack
+    status = EXIT_OK
+    albums = client.get_all_albums() if args.album else {}
+    for album_name in args.album:
+        if album_name not in albums:
+            events.emit("error", message=f"No album named {album_name}")
+            status = status or EXIT_USAGE
+            continue
+        queries.append((album_name, "album", albums[album_name]))
+    tags = client.get_all_tags() if args.tag else {}
+    for tag_name in args.tag:
+        if tag_name not in tags:
+            events.emit("error", message=f"No tag named {tag_name}")
+            status = status or EXIT_USAGE
+            continue
+        queries.append((tag_name, "tag", tags[tag_name]))
+    queries.extend((person_id, "person", person_id) for person_id in args.person)
+
+    async def resolve_all():
+        return await asyncio.gather(*(async_client.get_pack_asset_ids(kind, pack_id) for _, kind, pack_id in queries))
+
+    resolved = async_client.submit(resolve_all()).result() if queries else []
+    packs = [pack_options(args, name, asset_ids) for (name, _, _), asset_ids in zip(queries, resolved)]
+    for query in args.search:
+        asset_ids = client.search_smart(query, args.num_results)
+        if asset_ids is None:
+            events.emit("error", message=f"Search failed: {query}")
+            status = status or EXIT_ERROR
+            continue
+        packs.append(pack_options(args, query, asset_ids))
+    return packs, status
+
+
+def run_upload(args, client: ImmichClient, events: JsonEvents, stop_flag: threading.Event) -> int:
+    """upload subcommand"""
+    journal = JobJournal("upload")
+    resume = load_resume(journal, client, events) if args.resume else None
+    if args.resume and resume is None:
+        return EXIT_USAGE
+    if not args.resume and not args.paths:
+        events.emit("error", message="Give at least one path to upload")
+        return EXIT_USAGE
+    checkbox_states = resume.options['checkbox_states'] if resume else checkbox_states_from_args(args)
+    workers = resume.options['worker_count'] if resume else args.workers
+    engine = UploadEngine(client, checkbox_states, workers, stop_flag, journal,
+                          on_status=events.status, on_progress=events.progress)
+    files = []
+    if not resume:
+        with engine.scanning():
+            files = list_files(args.paths, checkbox_states['recursive'])
+    finished = engine.run(files, resume)
+    events.emit("summary", command="upload", total=engine.total, uploaded=engine.uploaded,
+                duplicates=engine.duplicates, failed=engine.failed, stopped=stop_flag.is_set(), metrics=engine.summary)
+    return exit_code(finished, engine.failed, stop_flag)
+
+
+def run_download(args, client: ImmichClient, async_client: AsyncImmichClient, events: JsonEvents,
+                 stop_flag: threading.Event) -> int:
+    """download subcommand"""
+    journal = JobJournal("download")
+    resume = load_resume(journal, client, events) if args.resume else None
+    if args.resume and resume is None:
+        return EXIT_USAGE
+    if resume:
+        engine = DownloadEngine(client, resume.options['save_path'], resume.options['worker_count'],
+                                resume.options['durable_writes'], resume.options['archive_mode'], stop_flag, journal,
+                                on_status=events.status, on_progress=events.progress)
+        packs = []
+    else:
+        if not args.save_path:
+            events.emit("error", message="--save-path is required")
+            return EXIT_USAGE
+        packs, status = resolve_packs(args, client, async_client, events)
+        if status != EXIT_OK:
+            return status
+        if not packs:
+            events.emit("error", message="Nothing to download, give at least one --album, --tag, --person or "
+                                         "--search")
+            return EXIT_USAGE
+        os.makedirs(args.save_path, exist_ok=True)
+        engine = DownloadEngine(client, args.save_path, args.workers, args.durable_writes, args.archive_mode,
+                                stop_flag, journal, on_status=events.status, on_progress=events.progress)
+    finished = engine.run(packs, resume)
+    events.emit("summary", command="download", total=engine.total, downloaded=engine.downloaded,
+                failed=engine.failed, stopped=stop_flag.is_set(), metrics=engine.summary)
+    return exit_code(finished, engine.failed, stop_flag)
+
+
+def run_search(args, client: ImmichClient, events: JsonEvents) -> int:
+    """search subcommand"""
+    asset_ids = client.search_smart(args.query, args.num_results)
+    if asset_ids is None:
+        events.emit("error", message=f"Search failed: {args.query}")
+        return EXIT_ERROR
+    events.emit("search", query=args.query, asset_ids=asset_ids)
+    return EXIT_OK
+
+
+def run_packs(args, client: ImmichClient, async_client: AsyncImmichClient, events: JsonEvents) -> int:
+    """packs subcommand, lists the albums, tags and people that can be downloaded as packs"""
+    if args.kind in ("all", "album"):
+        for album in client.get_album_summaries() or []:  # The album list already carries the counts
+            events.emit("pack", kind="album", name=album['name'], id=album['id'], count=album['count'])
+    if args.kind in ("all", "tag"):
+        tags = client.get_all_tags()
+
+        async def count_tags():
+            return await asyncio.gather(*(async_client.get_tag_bucket_counts(tag_id) for tag_id in tags.values()))
+        tag_buckets = async_client.submit(count_tags()).result()
+        for (tag_name, tag_id), bucket_counts in zip(tags.items(), tag_buckets):
+            events.emit("pack", kind="tag", name=tag_name, id=tag_id, count=sum(count for _, count in bucket_counts))
+    if args.kind in ("all", "person"):
+        people = [person for person in client.iter_people() if 'id' in person]
+
+        async def count_people():
+            return await asyncio.gather(*(async_client.get_person_asset_count(person['id']) for person in people))
+        person_counts = async_client.submit(count_people()).result()
+        for person, count in zip(people, person_counts):
+            events.emit("pack", kind="person", name=person.get('name') or person['id'], id=person['id'], count=count)
+    return EXIT_OK
+
+
+def load_resume(journal: JobJournal, client: ImmichClient, events: JsonEvents):
+    """Returns the interrupted job in journal if it belongs to the current server"""
+    state = journal.load()
+    if state is None or state.server != client.base_url:
+        events.emit("error", message=f"No interrupted {journal.kind} job to resume on {client.base_url}")
+        return None
+    events.emit("resume", kind=journal.kind, items=len(state.items), done=len(state.done))
+    return state
+
+
+def exit_code(finished: bool, failed: int, stop_flag: threading.Event) -> int:
+    """Maps how a job ended to the process exit code"""
+    if stop_flag.is_set():
+        return EXIT_INTERRUPTED
+    if failed or not finished:
+        return EXIT_FAILURES
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Defines the command line. Upload flags mirror CheckboxFrame.get_states(), download flags the pack options."""
+    parser = argparse.ArgumentParser(prog="gimmich", description="Headless bulk uploads and downloads for immich. "
+                                                                 "Writes JSON lines to stdout and logs to stderr.")
+    parser.add_argument("--url", default=os.environ.get("IMMICH_URL"),
+                        help="Server url, defaults to $IMMICH_URL or the credentials saved by the GUI")
+    parser.add_argument("--api-key", default=os.environ.get("IMMICH_API_KEY"),
+                        help="API key, defaults to $IMMICH_API_KEY or the credentials saved by the GUI")
+    parser.add_argument("--workers", type=int, default=16, help="Most concurrent transfers (default 16)")
+    parser.add_argument("--verbose", action="store_true", help="Also log per file statuses and connection stats")
+    parser.add_argument("--prometheus-file", default=os.environ.get("GIMMICH_PROMETHEUS_FILE"),
+                        help="Also export metrics to this file in the Prometheus text format, for the node exporter "
+                             "textfile collector. Defaults to $GIMMICH_PROMETHEUS_FILE")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    upload = subparsers.add_parser("upload", help="Upload files and directories")
+    upload.add_argument("paths", nargs="*", help="Files and directories to upload")
+    upload.add_argument("--recursive", action="store_true", help="Walk directories recursively")
+    upload.add_argument("--directory-names-as-albums", action="store_true",
+                        help="Add files to an album named after their directory")
+    upload.add_argument("--album-input", metavar="NAME", help="Add every file to this album")
+    upload.add_argument("--directory-names-as-tags", action="store_true",
+                        help="Tag files with the name of their directory")
+    upload.add_argument("--tag-input", metavar="NAME", help="Tag every file with this tag")
+    upload.add_argument("--import-captions", action="store_true",
+                        help="Import .txt files beside the images as descriptions")
+    upload.add_argument("--captions-as-tags", action="store_true", help="Import .txt files as tags")
+    upload.add_argument("--caption-delimiters", default=",", help="Characters splitting caption tags (default ,)")
+    upload.add_argument("--resume", action="store_true", help="Resume the interrupted upload instead")
+
+    download = subparsers.add_parser("download", help="Download albums, tags, people or search results as packs")
+    download.add_argument("--save-path", help="Directory to download into")
+    download.add_argument("--album", action="append", default=[], metavar="NAME", help="Album pack, repeatable")
+    download.add_argument("--tag", action="append", default=[], metavar="NAME", help="Tag pack, repeatable")
+    download.add_argument("--person", action="append", default=[], metavar="ID", help="Person pack, repeatable")
+    download.add_argument("--search", action="append", default=[], metavar="QUERY",
+                          help="Smart search pack, repeatable")
+    download.add_argument("--num-results", type=int, default=20, help="Results per --search (default 20)")
+    download.add_argument("--directory-type", choices=DIRECTORY_TYPES, default="none",
+                          help="Put each pack in the save path, a directory named after it, or --user-directory")
+    download.add_argument("--user-directory", default="", help="Directory used with --directory-type user")
+    download.add_argument("--caption-type", choices=CAPTION_TYPES, default="none",
+                          help="Write .txt captions from descriptions or tags")
+    download.add_argument("--archive-mode", action="store_true", help="Download packs as server side archives")
+    download.add_argument("--durable-writes", action="store_true", help="Fsync downloaded files")
+    download.add_argument("--resume", action="store_true", help="Resume the interrupted download instead")
+
+    search = subparsers.add_parser("search", help="Smart search, printing the matching asset ids")
+    search.add_argument("query")
+    search.add_argument("--num-results", type=int, default=20)
+
+    packs = subparsers.add_parser("packs", help="List the albums, tags and people available as packs")
+    packs.add_argument("--kind", choices=["all", "album", "tag", "person"], default="all")
+    return parser
+
+
+def main(argv=None) -> int:
+    """Entry point, returns the exit code"""
+    args = build_parser().parse_args(argv)
+    events = JsonEvents(sys.stdout)
+    sys.stdout = sys.stderr  # Keep the clients console output out of the JSON stream
+    app_logger = logging.getLogger(APP_LOGGER)
+    app_logger.addHandler(logging.StreamHandler(sys.stderr))
+    app_logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    stop_flag = threading.Event()
+    logging_in = [True]
+
+    def request_stop(signum, frame):
+        """First signal stops the job cleanly, a second one kills it. During the login check nothing has started
+        yet, so it is abandoned straight away."""
+        events.emit("stopping", signal=signum)
+        stop_flag.set()
+        signal.signal(signum, signal.SIG_DFL)
+        if logging_in[0]:
+            raise LoginInterrupted()
+
+    signal.signal(signal.SIGINT, request_stop)  # Before the login check, which can retry for a while
+    signal.signal(signal.SIGTERM, request_stop)
+
+    client = ImmichClient()
+    client.metrics.prometheus_path = args.prometheus_file
+    if args.url and args.api_key:
+        client.base_url = args.url.rstrip("/")
+        client.token = args.api_key
+    try:
+        client.get_my_user(save_credentials=False)
+    except LoginInterrupted:
+        client.close()
+        return EXIT_INTERRUPTED
+    finally:
+        logging_in[0] = False
+    if not client.logged_in:
+        events.emit("error", message="Not logged in, pass --url and --api-key or log in with the GUI first")
+        return EXIT_AUTH
+    events.emit("login", user=client.user, server=client.base_url)
+
+    bridge = AsyncBridge()
+    async_client = AsyncImmichClient(client, bridge)
+    try:
+        if args.command == "upload":
+            return run_upload(args, client, events, stop_flag)
+        if args.command == "download":
+            return run_download(args, client, async_client, events, stop_flag)
+        if args.command == "search":
+            return run_search(args, client, events)
+        return run_packs(args, client, async_client, events)
+    except Exception as e:
+        events.emit("error", message=f"Unexpected error: {e}")
+        return EXIT_ERROR
+    finally:
+        bridge.stop()
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
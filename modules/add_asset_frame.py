@@ -1,44 +1,198 @@
+import logging
 import threading
-from typing import List
+from concurrent.futures import Future
+from typing import Callable, Iterable, List, Optional
 import customtkinter as ctk
-from PIL import Image, ImageDraw
 from modules.download_frame import DownloadFrame
 from modules.api_client import ImmichClient
+from modules.async_client import AsyncImmichClient
+from modules.thumbnail_cache import ThumbnailCache, person_thumb_id
+from modules.ui_dispatcher import UiDispatcher
+from modules.virtual_grid import VirtualGrid
+
+logger = logging.getLogger(__name__)
+
+
+class PackEntry:
+    """An available download pack, described by the album, tag or person it selects rather than by its assets.
+    count and thumb_id are filled in cheaply when the list loads or when the row first comes into view, the asset
+    ids are only resolved once the pack is queued."""
+    __slots__ = ('name', 'kind', 'pack_id', 'color', 'count', 'thumb_id', 'described')
+
+    def __init__(self, name: str, kind: str, pack_id: str, color: str, count: Optional[int] = None,
+                 thumb_id: Optional[str] = None, described: bool = True):
+        self.name = name
+        self.kind = kind  # album, tag or person
+        self.pack_id = pack_id
+        self.color = color
+        self.count = count
+        self.thumb_id = thumb_id
+        self.described = described  # False until count and thumb_id are known
 
 
 class AddDownloadPackFrame(ctk.CTkFrame):
-    """This frame displays an available download pack to be chosen and contains the relevant info needed to add it"""
-    def __init__(self, parent: ctk.CTkScrollableFrame, download_frame: DownloadFrame, name: str, thumb: ctk.CTkImage,
-                 asset_ids: List, color: str):
-        super().__init__(parent, border_width=2, border_color="gray", fg_color=color)
+    """This frame displays an available download pack to be chosen and contains the relevant info needed to add it.
+    Pack lists recycle it for whichever pack scrolls into its row."""
+    def __init__(self, parent: ctk.CTkCanvas, on_add: Callable[[PackEntry, ctk.CTkImage], None]):
+        super().__init__(parent, border_width=2, border_color="gray")
         for row in range(1):
             self.rowconfigure(row, weight=1)
         self.columnconfigure(1, weight=1)
         self.parent = parent
-        self.download_frame = download_frame
-        self.color = color
-        self.name = name
-        self.thumb = thumb
-        self.asset_ids = asset_ids
-        self.thumbnail_label = ctk.CTkLabel(self, image=self.thumb, text="")
+        self.on_add = on_add
+        self.entry: Optional[PackEntry] = None
+        self.thumb: Optional[ctk.CTkImage] = None
+        self.thumbnail_label = ctk.CTkLabel(self, text="")
         self.thumbnail_label.grid(row=0, column=0, padx=2, pady=0)
-        self.name_label = ctk.CTkLabel(self, text=self.name)
+        self.name_label = ctk.CTkLabel(self, text="", anchor="w")
         self.name_label.grid(row=0, column=1, padx=2, pady=0, sticky="ew")
         self.add_pack_button = ctk.CTkButton(self, text="Add to download", command=self.add_asset_pack, corner_radius=0)
         self.add_pack_button.grid(row=0, column=2, padx=2, pady=0, sticky="ew")
 
+    def show(self, entry: PackEntry, thumb: ctk.CTkImage):
+        """Rebinds the row to a pack"""
+        if entry is not self.entry:
+            self.entry = entry
+            self.configure(fg_color=entry.color)
+        self.name_label.configure(text=entry.name if entry.count is None else f"{entry.name} ({entry.count})")
+        if thumb is not self.thumb:
+            self.thumb = thumb
+            self.thumbnail_label.configure(image=self.thumb)
+
     def add_asset_pack(self):
         """This adds the pack to the download frame."""
-        self.download_frame.add_pack(self.name, self.thumb, self.asset_ids, self.color)
+        if self.entry is not None:
+            self.on_add(self.entry, self.thumb)
+
+
+class PackListFrame(ctk.CTkFrame):
+    """A titled, filterable list of download packs. Only the visible rows exist as widgets and their thumbnails are
+    fetched as they scroll into view, as are the counts of packs that are not yet described, through
+    describe(entry), which returns a Future of (count, thumb_id) with thumb_id None to keep the current one.
+    Entries may be added from any thread while the list loads."""
+    def __init__(self, parent: ctk.CTkFrame, title: str, thumbnail_cache: ThumbnailCache, dispatcher: UiDispatcher,
+                 on_add: Callable[[PackEntry, ctk.CTkImage], None],
+                 describe: Optional[Callable[[PackEntry], Future]] = None):
+        super().__init__(parent)
+        self.title = title
+        self.thumbnail_cache = thumbnail_cache
+        self.dispatcher = dispatcher
+        self.on_add = on_add
+        self.describe = describe
+        self.entries: List[PackEntry] = []
+        self.filter_text = ""
+        self.generation = 0  # Bumped on every clear so entries from an earlier load are dropped
+        self.thumb_requested = set()  # Thumbnail ids of the current load that were asked for
+        self.describe_requested = set()  # Entries of the current load whose count and thumbnail were asked for
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        self.title_label = ctk.CTkLabel(self, text=title)
+        self.title_label.grid(row=0, column=0, padx=5, pady=(5, 0), sticky="w")
+        self.filter_entry = ctk.CTkEntry(self, placeholder_text="Filter by name")
+        self.filter_entry.grid(row=0, column=1, padx=5, pady=(5, 0), sticky="e")
+        self.filter_entry.bind("<KeyRelease>", lambda event: self.apply_filter(self.filter_entry.get()))
+        self.pack_grid = VirtualGrid(self, self.create_row, self.bind_row, tile_width=None, tile_height=44,
+                                     padding=2)
+        self.pack_grid.grid(row=1, column=0, columnspan=2, sticky="nsew")
+
+    def clear(self) -> int:
+        """Empties the list and shows it as loading, returning the generation to add the new entries under"""
+        self.generation += 1
+        self.entries = []
+        self.thumb_requested = set()
+        self.describe_requested = set()
+        self.pack_grid.set_items([])
+        self.title_label.configure(text=f"{self.title} (loading...)")
+        return self.generation
+
+    def add_entries(self, generation: int, entries: Iterable[PackEntry]):
+        """Adds entries from a loader, from any thread"""
+        self.dispatcher.post(self._add_entries, generation, list(entries))
+
+    def finish_loading(self, generation: int, failed: bool = False):
+        """Shows how many packs the load found or that it failed, from any thread"""
+        self.dispatcher.post(self._finish_loading, generation, failed)
+
+    def apply_filter(self, text: str):
+        """Shows only the packs whose name contains text, narrowing the current matches when text extends the
+        previous filter"""
+        text = text.strip().lower()
+        if text == self.filter_text:
+            return
+        candidates = self.pack_grid.items() if self.filter_text and text.startswith(self.filter_text) else self.entries
+        self.filter_text = text
+        self.pack_grid.set_items([entry for entry in candidates if self.matches(entry)])
+
+    def matches(self, entry: PackEntry) -> bool:
+        """Returns whether a pack passes the filter"""
+        return not self.filter_text or self.filter_text in entry.name.lower()
+
+    def create_row(self, parent: ctk.CTkCanvas) -> AddDownloadPackFrame:
+        """Builds an empty pack row for the list to recycle"""
+        return AddDownloadPackFrame(parent, self.on_add)
+
+    def bind_row(self, row: AddDownloadPackFrame, entry: PackEntry):
+        """Shows a pack in a row, with its thumbnail if already decoded or a placeholder while it and, for packs
+        that are not described yet, the count are fetched"""
+        if not entry.described and self.describe is not None and entry not in self.describe_requested:
+            self.describe_requested.add(entry)
+            generation = self.generation
+            future = self.describe(entry)
+            future.add_done_callback(lambda done: self.dispatcher.post(self._show_description, generation, entry,
+                                                                       done))
+        thumb = self.thumbnail_cache.peek(entry.thumb_id) if entry.thumb_id else None
+        if thumb is None:
+            thumb = self.thumbnail_cache.blank()
+            if entry.thumb_id and entry.thumb_id not in self.thumb_requested:
+                self.thumb_requested.add(entry.thumb_id)
+                generation = self.generation
+                future = self.thumbnail_cache.get_async(entry.thumb_id)
+                future.add_done_callback(lambda done: self.dispatcher.post(self._show_thumb, generation, entry, done))
+        row.show(entry, thumb)
+
+    def _show_thumb(self, generation: int, entry: PackEntry, future: Future):
+        """Puts a fetched thumbnail in the row showing its pack, if it is still in view"""
+        thumb = future.result() if not future.exception() else None
+        row = self.pack_grid.tile_for(entry)
+        if generation == self.generation and thumb is not None and row is not None:
+            row.show(entry, thumb)
+
+    def _show_description(self, generation: int, entry: PackEntry, future: Future):
+        """Fills in the count and thumbnail of a pack, then refreshes its row if it is still in view"""
+        if generation != self.generation or future.exception():
+            return
+        entry.count, thumb_id = future.result()
+        entry.thumb_id = thumb_id or entry.thumb_id
+        entry.described = True
+        row = self.pack_grid.tile_for(entry)
+        if row is not None:
+            self.bind_row(row, entry)
+
+    def _add_entries(self, generation: int, entries: List[PackEntry]):
+        """Adds entries on the UI thread, unless the list was cleared since their load started"""
+        if generation != self.generation:
+            return
+        self.entries.extend(entries)
+        self.pack_grid.extend(entry for entry in entries if self.matches(entry))
+        self.title_label.configure(text=f"{self.title} (loading... {len(self.entries)})")
+
+    def _finish_loading(self, generation: int, failed: bool):
+        """Shows the final count on the UI thread"""
+        if generation == self.generation:
+            self.title_label.configure(text=f"{self.title} ({'failed' if failed else len(self.entries)})")
 
 
 class AddAssetFrame(ctk.CTkFrame):
     """This frame displays the album/tag/person/all packs which can be added to the download queue"""
-    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient, download_frame: DownloadFrame):
+    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient, async_client: AsyncImmichClient,
+                 download_frame: DownloadFrame, thumbnail_cache: ThumbnailCache, dispatcher: UiDispatcher):
         super().__init__(parent)
         self.client = client
+        self.async_client = async_client
+        self.thumbnail_cache = thumbnail_cache
+        self.dispatcher = dispatcher
         self.download_frame = download_frame
-        self.albums = self.client.get_all_albums()
 
         for col in range(1):  # Adjust rows and columns for stretching to fit
             self.columnconfigure(col, weight=1)
@@ -46,92 +200,96 @@ class AddAssetFrame(ctk.CTkFrame):
         self.rowconfigure(3, weight=1)
         self.rowconfigure(5, weight=1)
 
-        self.scrollable_album_frame = ctk.CTkScrollableFrame(self, label_text="Album List")  # Frame for album packs
-        self.scrollable_album_frame.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
-        self.scrollable_album_frame.columnconfigure(0, weight=1)
+        self.album_list = PackListFrame(self, "Album List", thumbnail_cache, dispatcher, self.queue_pack)  # Album packs
+        self.album_list.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
 
-        self.scrollable_tag_frame = ctk.CTkScrollableFrame(self, label_text="Tag List")  # Frame for tag packs
-        self.scrollable_tag_frame.grid(row=3, column=0, padx=5, pady=5, sticky="nsew")
-        self.scrollable_tag_frame.columnconfigure(0, weight=1)
+        self.tag_list = PackListFrame(self, "Tag List", thumbnail_cache, dispatcher, self.queue_pack,
+                                      describe=self.describe_tag)  # Tag packs
+        self.tag_list.grid(row=3, column=0, padx=5, pady=5, sticky="nsew")
 
-        self.scrollable_people_frame = ctk.CTkScrollableFrame(self, label_text="People List")  # Frame for person packs
-        self.scrollable_people_frame.grid(row=5, column=0, padx=5, pady=5, sticky="nsew")
-        self.scrollable_people_frame.columnconfigure(0, weight=1)
+        self.people_list = PackListFrame(self, "People List", thumbnail_cache, dispatcher, self.queue_pack,
+                                         describe=self.describe_person)  # Person packs
+        self.people_list.grid(row=5, column=0, padx=5, pady=5, sticky="nsew")
 
         self.add_all_assets_button = ctk.CTkButton(self, text="Add All Assets", command=self.add_all_assets)
         self.add_all_assets_button.grid(row=6, column=0, padx=5, pady=5, sticky="w")
         self.refresh_albums_tags_button = ctk.CTkButton(self, text="Refresh Albums and Tags",
                                                         command=self.refresh_packs)
         self.refresh_albums_tags_button.grid(row=6, column=0, padx=5, pady=5, sticky="e")
-
-        if self.client.logged_in:
-            self.refresh_packs()
+        # Packs are loaded by refresh_packs once the login has been checked, keeping startup off the network
 
     def add_all_assets(self):
         """This function adds a download pack containing all assets on the server"""
-        if self.client.logged_in:
-            asset_ids = self.client.get_all_assets()
-            print(asset_ids)
-            thumb_data = self.client.view_asset(asset_ids[0])  # Get image and load thumbnail for pack
-            thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(32, 32))
-            people_pack = AddDownloadPackFrame(self.scrollable_people_frame, self.download_frame,
-                                               "ALL ASSETS", thumb, asset_ids, "#212121")
-            people_pack.add_asset_pack()
+        if self.client.logged_in:  # Enumerating a large library takes a while so keep it off the UI thread
+            threading.Thread(target=self.add_all_assets_task, daemon=True).start()
+
+    def add_all_assets_task(self):
+        """Pages through every asset on the server and queues them as one download pack"""
+        try:
+            asset_ids = [asset['id'] for asset in self.client.iter_assets() if 'id' in asset]
+            print(f"Found {len(asset_ids)} assets on the server")
+            if not asset_ids:
+                print("Not adding the all assets pack, the server has no assets")
+                return
+            thumb = self.thumbnail_cache.get_or_blank(asset_ids[0])  # Thumbnail for pack
+            self.dispatcher.post(self.download_frame.add_pack, "ALL ASSETS", thumb, asset_ids, "#212121")
+        except Exception as e:
+            logger.error(f"Unexpected error adding all assets: {e}")
 
     def refresh_packs(self):
         """This refreshes the available download packs in case you just logged in or things have changed serverside"""
-        if self.client.logged_in:  # Run jobs in threads so as to not lock up UI
-            threading.Thread(target=self.get_album_info, daemon=True).start()
-            threading.Thread(target=self.get_tag_info, daemon=True).start()
-            threading.Thread(target=self.get_people_info, daemon=True).start()
-
-    def get_people_info(self):
-        """Populates the available people download packs"""
-        people_ids = self.client.get_all_people()
-        row = 0
-        for people_id in people_ids:
-            asset_ids = self.client.get_person(people_id)
-            thumb_data = self.client.view_asset(asset_ids[0])  # Get image and load thumbnail for pack
-            thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(32, 32))
-            people_pack = AddDownloadPackFrame(self.scrollable_people_frame, self.download_frame,
-                                               f"{people_id}", thumb, asset_ids, "#3E2121")
-            people_pack.grid(row=row, column=0, padx=5, pady=1, sticky="ew")
-            row += 1
-
-    def get_tag_info(self):
-        """Populates the available tag download packs"""
+        for pack_list, task in ((self.album_list, self.get_album_info), (self.tag_list, self.get_tag_info),
+                                (self.people_list, self.get_people_info)):
+            generation = pack_list.clear()
+            if self.client.logged_in:  # Run jobs in threads so as to not lock up UI
+                threading.Thread(target=self.load_packs_task, args=(pack_list, task, generation), daemon=True).start()
+            else:
+                pack_list.finish_loading(generation)
+
+    def load_packs_task(self, pack_list: PackListFrame, task, generation: int):
+        """Runs one of the pack loaders, showing how many packs it found or that it failed when done"""
+        try:
+            task(pack_list, generation)
+            pack_list.finish_loading(generation)
+        except Exception as e:
+            logger.error(f"Unexpected error loading {pack_list.title}: {e}")
+            pack_list.finish_loading(generation, failed=True)
+
+    def queue_pack(self, entry: PackEntry, thumb: ctk.CTkImage):
+        """Adds a pack to the download queue, resolving its asset ids in the background"""
+        asset_ids = self.async_client.submit(self.async_client.get_pack_asset_ids(entry.kind, entry.pack_id))
+        self.download_frame.add_pack(entry.name, thumb, asset_ids, entry.color)
+
+    def describe_tag(self, entry: PackEntry) -> Future:
+        """Looks up the asset count and newest asset of a tag pack"""
+        return self.async_client.submit(self.async_client.get_tag_summary(entry.pack_id))
+
+    def describe_person(self, entry: PackEntry) -> Future:
+        """Looks up the asset count of a person pack, whose thumbnail is already known to be their face"""
+        async def describe():
+            return await self.async_client.get_person_asset_count(entry.pack_id), None
+        return self.async_client.submit(describe())
+
+    def get_people_info(self, pack_list: PackListFrame, generation: int):
+        """Populates the available people download packs, adding each page of people as soon as it is fetched"""
+        people = []
+        for person in self.client.iter_people():
+            people.append(PackEntry(person.get('name') or person['id'], "person", person['id'], "#3E2121",
+                                    thumb_id=person_thumb_id(person['id']), described=False))
+            if len(people) >= 500:
+                pack_list.add_entries(generation, people)
+                people = []
+        if people:
+            pack_list.add_entries(generation, people)
+
+    def get_tag_info(self, pack_list: PackListFrame, generation: int):
+        """Populates the available tag download packs, their counts and thumbnails are looked up once in view"""
         tag_ids = self.client.get_all_tags()
-        row = 0
-        for tag_name, tag_id in tag_ids.items():  # Iterate over tag timebuckets to collect all tag packs and assets
-            tag_time_buckets = self.client.get_tag_time_buckets(tag_id)
-            if tag_time_buckets:
-                asset_ids = []
-                for time_bucket in tag_time_buckets:
-                    ids = self.client.get_time_bucket_assets_by_tag(time_bucket, tag_id)
-                    asset_ids = asset_ids + ids
-                thumb_data = self.client.view_asset(asset_ids[0])  # Get image and load thumbnail for pack
-                thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(32, 32))
-                tag_pack = AddDownloadPackFrame(self.scrollable_tag_frame, self.download_frame, f"{tag_name}",
-                                                thumb, asset_ids, "#213421")
-                tag_pack.grid(row=row, column=0, padx=5, pady=1, sticky="ew")
-                row += 1
-
-    def get_album_info(self):
-        """Populates the available album download packs"""
-        album_ids = self.client.get_all_albums()
-        row = 0
-        for album_name, album_id in album_ids.items():
-            asset_ids, thumb_id = self.client.get_album_info(album_id)
-            thumb_data = self.client.view_asset(thumb_id)  # Get thumbnail for album pack or blank image if no thumb
-            try:
-                thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(32, 32))
-            except Exception as e:
-                print(f"No thumb found: {album_name} : {e}")
-                blank_image = Image.new("RGBA", (32, 32), (255, 255, 255, 0))
-                draw = ImageDraw.Draw(blank_image)
-                draw.rectangle((0, 0, 31, 31), outline="gray")  # Optional: Add a border
-                thumb = ctk.CTkImage(light_image=blank_image, size=(32, 32))
-            album_pack = AddDownloadPackFrame(self.scrollable_album_frame, self.download_frame,
-                                              f"{album_name}", thumb, asset_ids, "#212150")
-            album_pack.grid(row=row, column=0, padx=5, pady=1, sticky="ew")
-            row += 1
+        pack_list.add_entries(generation, (PackEntry(f"{tag_name}", "tag", tag_id, "#213421", described=False)
+                                           for tag_name, tag_id in tag_ids.items()))
+
+    def get_album_info(self, pack_list: PackListFrame, generation: int):
+        """Populates the available album download packs from the album list alone"""
+        albums = self.client.get_album_summaries()
+        pack_list.add_entries(generation, (PackEntry(f"{album['name']}", "album", album['id'], "#212150",
+                                                     album['count'], album['thumb_id']) for album in albums))
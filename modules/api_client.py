@@ -1,111 +1,291 @@
 import requests
+from requests.adapters import HTTPAdapter
 import mimetypes
 import uuid
 import hashlib
+import logging
 import os
-import json
+import threading
 import time
 import random
-from typing import Optional, Dict, List
+from typing import Optional, Dict, Iterator, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
 from io import BytesIO
 from datetime import datetime
-import keyring
+from modules.asset_cache import AssetInfo, AssetInfoCache
+from modules.concurrency import AdaptiveLimiter
+from modules.file_writer import AtomicFileWriter
+from modules.metrics import TransferMetrics, endpoint_name
+from modules.multipart import MultipartFileEncoder
+from modules.retry import IDEMPOTENT_METHODS, OVERLOAD_STATUSES, CircuitBreaker, RetryPolicy
+from modules.zip_stream import StreamingZipExtractor
+
+logger = logging.getLogger(__name__)
 
 
 class ImmichClient:
     """This is the API client for the Immich server"""
-    def __init__(self):
+    def __init__(self, pool_size: int = 32, timeout: Union[float, Tuple[float, float]] = (10, 120),
+                 load_credentials: bool = True):
         self.device_id: str = self.get_device_id()
         self.base_url: str = "Unknown"
+        self.timeout = timeout  # Default (connect, read) timeout applied to every request
+        self.session: requests.Session = self._create_session(pool_size)
+        self._stats_lock = threading.Lock()
+        self.asset_cache = AssetInfoCache()  # Metadata of recently looked up assets
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()  # Shared by every thread so workers pause together
+        self.retry_count = 0
+        self.metrics = TransferMetrics()  # Per endpoint latency, bytes and retries, plus the engines job stages
+        self.request_limiter = AdaptiveLimiter("Requests", initial=8, max_limit=pool_size)  # Tuned from latency
+        self.search_limiter = AdaptiveLimiter("Smart search", initial=2, max_limit=4)  # Kept apart from cheap GETs
         self.token: Optional[str] = None
         self.user: str = "Unknown"
         self.user_id: Optional[str] = None
         self.asset_count: Dict = {'total': 0, 'images': 0, 'videos': 0}
         self.logged_in: bool = False
-        self._load_credentials()
+        if load_credentials:  # The GUI loads them off the UI thread instead
+            self.load_credentials()
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._token
+
+    @token.setter
+    def token(self, value: Optional[str]):
+        """Keep the sessions default api key header in step with the token"""
+        self._token = value
+        if value:
+            self.session.headers['x-api-key'] = value
+        else:
+            self.session.headers.pop('x-api-key', None)
 
-    def _load_credentials(self):
-        """Load credentials from the system's keyring."""
-        saved_base_url = keyring.get_password("ImmichClient", "base_url")
-        saved_token = keyring.get_password("ImmichClient", "token")
-        if saved_base_url and saved_token:
-            self.base_url = saved_base_url
-            self.token = saved_token
-            self.logged_in = True
+    @staticmethod
+    def _create_session(pool_size: int):
+        """Creates a keep-alive session whose connection pool is shared by every thread using the client."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({'Accept': 'application/json'})
+        return session
+
+    @staticmethod
+    def _iter_pages(fetch_page) -> Iterator:
+        """Yields the items of successive pages. fetch_page takes a page number and returns the items on it and the
+        next page number, or None on the last page. The next page is fetched in the background while the caller
+        works through the current one."""
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="immich-prefetch") as executor:
+            future = executor.submit(fetch_page, 1)
+            while future is not None:
+                items, next_page = future.result()
+                future = executor.submit(fetch_page, next_page) if next_page else None
+                yield from items
+
+    @staticmethod
+    def _release_on_close(response: requests.Response, limiter: AdaptiveLimiter, metrics: TransferMetrics,
+                          endpoint: str):
+        """Keeps a streamed responses limiter slot until the caller closes it, so transfers count against the limit
+        for as long as their body is being read. The body bytes read by then are added to the metrics."""
+        close = response.close
+        released = []
+
+        def close_and_release():
+            first = not released
+            if first:
+                released.append(True)
+                try:
+                    metrics.record_received(endpoint, response.raw.tell())  # Measured before closing drops the stream
+                except Exception:
+                    pass  # No raw stream to measure
+            close()
+            if first:
+                limiter.release()
+
+        response.close = close_and_release
+
+    def _request(self, method: str, url: str, idempotent: Optional[bool] = None,
+                 limiter: Optional[AdaptiveLimiter] = None, **kwargs):
+        """Sends a request over the pooled session, applying the default timeout, the concurrency limit and the retry
+        policy. idempotent marks whether the call is safe to repeat, by default only GET, PUT, DELETE and friends
+        are. limiter defaults to the shared request limiter. Returns the last response or raises the last error once
+        the retries run out."""
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        limiter = limiter or self.request_limiter
+        timed = not hasattr(kwargs.get('data'), 'read')  # Upload times follow file size rather than server load
+        endpoint = endpoint_name(method, url)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.circuit_breaker.before_request()
+            limiter.acquire()
+            response = None
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.record_request(endpoint, time.monotonic() - start, error=True)
+                limiter.release()
+                limiter.observe(None, True)
+                self.circuit_breaker.record_failure()
+                if not self.retry_policy.should_retry(attempt, idempotent, error=e):
+                    raise
+                error = e
+            except Exception:
+                self.metrics.record_request(endpoint, time.monotonic() - start, error=True)
+                limiter.release()
+                self.circuit_breaker.record_success()  # Not the servers fault, don't hold up other callers
+                raise
+            else:
+                elapsed = time.monotonic() - start
+                body = response.request.body
+                self.metrics.record_request(endpoint, elapsed, len(body) if hasattr(body, '__len__') else 0,
+                                            0 if kwargs.get('stream') else len(response.content),
+                                            error=response.status_code >= 400)
+                overloaded = response.status_code in OVERLOAD_STATUSES  # A 500 is one bad request, not an outage
+                limiter.observe(elapsed if timed else None, overloaded or response.status_code == 408)
+                if overloaded:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if not self.retry_policy.should_retry(attempt, idempotent, response=response):
+                    if kwargs.get('stream'):
+                        self._release_on_close(response, limiter, self.metrics, endpoint)
+                    else:
+                        limiter.release()
+                    return response
+                limiter.release()
+                response.close()  # Hand the connection back to the pool before waiting
+                error = f"HTTP {response.status_code}"
+            delay = self.retry_policy.delay(attempt, response)
+            with self._stats_lock:
+                self.retry_count += 1
+            self.metrics.record_retry(endpoint)
+            logger.warning(f"Retrying {method} {url} in {delay:.1f}s after attempt {attempt} failed: {error}")
+            time.sleep(delay)
+            body = kwargs.get('data')
+            if hasattr(body, 'rewind'):
+                body.rewind()  # Streamed bodies are resent from the start
 
     def _save_credentials(self):
         """Save credentials to the system's keyring."""
+        import keyring
         keyring.set_password("ImmichClient", "base_url", self.base_url)
         keyring.set_password("ImmichClient", "token", self.token)
 
     def add_assets_to_album(self, album_id: str, asset_ids: List):
         """Takes an album id and a list of asset ids then adds them to the album"""
         url = f"{self.base_url}/api/albums/{album_id}/assets"
-        payload = json.dumps({
+        payload = {
             'ids': asset_ids
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("PUT", url, headers=headers, data=payload)
+            response = self._request("PUT", url, json=payload)
             if response.status_code != 200:
-                print(f"Error adding assets to album {album_id}")
+                logger.error(f"Error adding assets to album {album_id}")
         except Exception as e:
-            print(f"Error accessing addAssetsToAlbum API: {e}")
+            logger.error(f"Error accessing addAssetsToAlbum API: {e}")
+
+    def bulk_tag_assets(self, tag_ids: List, asset_ids: List):
+        """Adds every asset in asset_ids to every tag in tag_ids with one request"""
+        url = f"{self.base_url}/api/tags/assets"
+        payload = {
+            'tagIds': tag_ids,
+            'assetIds': asset_ids
+        }
+        try:
+            response = self._request("PUT", url, json=payload)
+            self.asset_cache.invalidate(asset_ids)  # Cached tag lists of these assets are now out of date
+            if response.status_code != 200:
+                logger.error(f"Error bulk tagging assets with tags: {tag_ids}")
+        except Exception as e:
+            logger.error(f"Error accessing bulkTagAssets API: {e}")
+
+    def check_bulk_upload(self, checksums: Dict[str, str]):
+        """Takes a dict of local ids and SHA-1 checksums and asks the server which it already has. Returns a dict of
+        the local ids of duplicates and the existing immich asset ids"""
+        url = f"{self.base_url}/api/assets/bulk-upload-check"
+        payload = {
+            'assets': [{'id': local_id, 'checksum': checksum} for local_id, checksum in checksums.items()]
+        }
+        try:
+            response = self._request("POST", url, json=payload, idempotent=True)  # Read only lookup
+            if response.status_code == 200:
+                results = response.json().get('results', [])
+                return {result['id']: result.get('assetId') for result in results
+                        if result.get('action') == 'reject' and result.get('assetId')}
+            else:
+                logger.error("Error checking for existing assets")
+        except Exception as e:
+            logger.error(f"Error accessing checkBulkUpload API: {e}")
+        return {}
+
+    def close(self):
+        """Closes the pooled connections"""
+        self.session.close()
+
+    def connection_stats(self):
+        """Returns how many requests were sent and how many of them reused a pooled keep-alive connection"""
+        total_requests = 0
+        new_connections = 0
+        with self._stats_lock:
+            for adapter in set(self.session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        total_requests += pool.num_requests
+                        new_connections += pool.num_connections
+        return {
+            'requests': total_requests,
+            'new_connections': new_connections,
+            'reused_connections': max(0, total_requests - new_connections)
+        }
 
     def create_album(self, album_name: str):
         """Creates an album, returning the album id"""
         url = f"{self.base_url}/api/albums"
-        payload = json.dumps({
+        payload = {
             'albumName': album_name,
             'albumUsers': [{'role': 'viewer', 'userId': self.user_id}],
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self._request("POST", url, json=payload)
             if response.status_code == 201:
                 response_data = response.json()
                 album_id = response_data.get('id')  # Extract the 'id' field
                 return album_id
             else:
-                print(f"Error creating album {album_name}")
+                logger.error(f"Error creating album {album_name}")
         except Exception as e:
-            print(f"Error accessing createAlbum API: {e}")
+            logger.error(f"Error accessing createAlbum API: {e}")
 
     def create_tag(self, tag_name: str):
         """Creates a tag, returning the tag id"""
         url = f"{self.base_url}/api/tags"
-        payload = json.dumps({
+        payload = {
             'name': tag_name
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self._request("POST", url, json=payload)
             if response.status_code == 201:
                 response_data = response.json()
                 tag_id = response_data.get('id')  # Extract the 'id' field
                 self.random_tag_color(tag_id)
                 return tag_id
             else:
-                print(f"Error creating tag {tag_name}")
+                logger.error(f"Error creating tag {tag_name}")
         except Exception as e:
-            print(f"Error accessing createTag API: {e}")
+            logger.error(f"Error accessing createTag API: {e}")
 
     @staticmethod
     def delete_credentials():
         """Delete the credentials from the system's keyring."""
         try:
+            import keyring
             keyring.delete_password("ImmichClient", "base_url")
             keyring.delete_password("ImmichClient", "token")
             print("Credentials deleted.")
@@ -113,43 +293,119 @@ class ImmichClient:
             print(f"No credentials found to delete. {e}")
 
     def download_archive(self, asset_ids: List):
-        """Takes a list of assetIds and returns a file like object containing an archive with the assets"""
+        """Takes a list of assetIds and returns a file like object containing an archive with the assets. The archive
+        is spooled to a temporary file once it outgrows memory."""
         url = f"{self.base_url}/api/download/archive"
-        payload = json.dumps({
+        payload = {
             'assetIds': asset_ids
-        })
+        }
         headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/octet-stream',
-            'x-api-key': self.token
+            'Accept': 'application/octet-stream'
         }
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
-            if response.status_code == 200:
-                archive_data = BytesIO(response.content)
-                return archive_data
-            else:
-                print(f"Error downloading archive: {asset_ids}")
+            with self._request("POST", url, headers=headers, json=payload, stream=True,
+                               idempotent=True) as response:
+                if response.status_code == 200:
+                    archive_data = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        archive_data.write(chunk)
+                    archive_data.seek(0)
+                    return archive_data
+                else:
+                    logger.error(f"Error downloading archive: {asset_ids}")
         except Exception as e:
-            print(f"Error accessing downloadArchive API: {e}")
+            logger.error(f"Error accessing downloadArchive API: {e}")
+
+    def download_archive_to_directory(self, asset_ids: List, destination: str, progress_callback=None,
+                                      durable: bool = False, chunk_size: int = 1024 * 1024):
+        """Streams an archive of the assets and extracts each entry into destination as it arrives. Calls
+        progress_callback with the number of bytes received after every chunk and returns the extracted paths."""
+        url = f"{self.base_url}/api/download/archive"
+        payload = {
+            'assetIds': asset_ids
+        }
+        headers = {
+            'Accept': 'application/octet-stream'
+        }
+        extractor = StreamingZipExtractor(destination, durable=durable)
+        try:
+            with self._request("POST", url, headers=headers, json=payload, stream=True,
+                               idempotent=True) as response:
+                if response.status_code != 200:
+                    logger.error(f"Error downloading archive: {len(asset_ids)} assets")
+                    return None
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    extractor.feed(chunk)
+                    if progress_callback:
+                        progress_callback(len(chunk))
+            extractor.close()
+            return extractor.extracted
+        except Exception as e:
+            logger.error(f"Error accessing downloadArchive API: {e}")
+        finally:
+            extractor.abort()  # Removes the part file of an entry cut off by a failure, nothing once closed
 
     def download_asset(self, asset_id: str):
         """Takes an assetId and returns a file like object containing an image"""
         url = f"{self.base_url}/api/assets/{asset_id}/original"
-        payload = {}
         headers = {
-            'Accept': 'application/octet-stream',
-            'x-api-key': self.token
+            'Accept': 'application/octet-stream'
         }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url, headers=headers)
             if response.status_code == 200:
                 image_data = BytesIO(response.content)
                 return image_data
             else:
-                print(f"Error downloading image: {asset_id}")
+                logger.error(f"Error downloading image: {asset_id}")
+        except Exception as e:
+            logger.error(f"Error accessing downloadAsset API: {e}")
+
+    def download_asset_to_file(self, asset_id: str, path: str, durable: bool = False,
+                               chunk_size: int = 1024 * 1024):
+        """Streams an assets original straight to path, returning the number of bytes written"""
+        writer = self.download_asset_to_writer(asset_id, path, durable, chunk_size)
+        if writer is None:
+            return None
+        try:
+            writer.commit()
+            return writer.bytes_written
+        except Exception as e:
+            writer.abort()
+            logger.error(f"Error saving {path}: {e}")
+
+    def download_asset_to_writer(self, asset_id: str, path: str, durable: bool = False,
+                                 chunk_size: int = 1024 * 1024) -> Optional[AtomicFileWriter]:
+        """Streams an assets original into a temp file beside path and returns the uncommitted writer, so the caller
+        decides when the file takes its final name. Returns None if the download failed."""
+        url = f"{self.base_url}/api/assets/{asset_id}/original"
+        headers = {
+            'Accept': 'application/octet-stream'
+        }
+        writer = None
+        try:
+            with self._request("GET", url, headers=headers, stream=True) as response:
+                if response.status_code != 200:
+                    logger.error(f"Error downloading image: {asset_id}")
+                    return None
+                size = int(response.headers.get('Content-Length') or 0)
+                writer = AtomicFileWriter(path, size=size, durable=durable)
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    writer.write(chunk)
+                return writer
         except Exception as e:
-            print(f"Error accessing downloadAsset API: {e}")
+            if writer is not None:
+                writer.abort()
+            logger.error(f"Error accessing downloadAsset API: {e}")
+
+    @staticmethod
+    def file_checksum(file, chunk_size: int = 1024 * 1024):
+        """Returns the SHA-1 hex digest of a file, the checksum immich uses to detect duplicates"""
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                sha1.update(chunk)
+        return sha1.hexdigest()
 
     @staticmethod
     def generate_asset_id(file):
@@ -159,133 +415,102 @@ class ImmichClient:
         return str(hashlib.md5(metadata.encode()).hexdigest())
 
     def get_album_info(self, album_id):
-        """Returns a list of the assetIds in the album as well as the id of the thumbnail."""
+        """Returns a list of the assetIds in the album as well as the id of the thumbnail. The list is empty and
+        the thumbnail None if the album couldn't be fetched."""
         url = f"{self.base_url}/api/albums/{album_id}"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
-            data = response.json()
-            thumbnail_id = data.get('albumThumbnailAssetId', None)
-            assets = data.get('assets', [])
-            asset_ids = [asset.get('id') for asset in assets if 'id' in asset]
-            return asset_ids, thumbnail_id
+            response = self._request("GET", url)
+            if response.status_code == 200:
+                data = response.json()
+                thumbnail_id = data.get('albumThumbnailAssetId', None)
+                assets = data.get('assets', [])
+                asset_ids = [asset.get('id') for asset in assets if 'id' in asset]
+                return asset_ids, thumbnail_id
+            else:
+                logger.error(f"Error getting album {album_id}")
+        except Exception as e:
+            logger.error(f"Error accessing getAlbumInfo API: {e}")
+        return [], None
+
+    def get_album_summaries(self):
+        """Returns the id, name, asset count and thumbnail id of every album from the album list alone, without
+        fetching the contents of any album"""
+        url = f"{self.base_url}/api/albums"
+        try:
+            response = self._request("GET", url)
+            if response.status_code == 200:
+                return [{'id': album['id'], 'name': album['albumName'], 'count': album.get('assetCount'),
+                         'thumb_id': album.get('albumThumbnailAssetId')} for album in response.json()]
+            else:
+                logger.error("Error getting album list")
         except Exception as e:
-            print(f"Error accessing getAlbumInfo API: {e}")
+            logger.error(f"Error accessing getAllAlbums API: {e}")
+        return []
 
     def get_all_albums(self):
         """Returns a dict of all album names and associated ids"""
         url = f"{self.base_url}/api/albums"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
                 albums = response.json()
                 album_dict = {album['albumName']: album['id'] for album in albums}
                 return album_dict
             else:
-                print("Error getting album list")
+                logger.error("Error getting album list")
         except Exception as e:
-            print(f"Error accessing getAllAlbums API: {e}")
+            logger.error(f"Error accessing getAllAlbums API: {e}")
+        return {}
 
     def get_all_assets(self):
         """Returns a list of all assetIds"""
-        url = f"{self.base_url}/api/search/metadata"
-        payload = json.dumps({})
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
-        try:
-            response = requests.request("POST", url, headers=headers, data=payload)
-            if response.status_code == 200:
-                response_data = response.json()
-                assets = response_data.get('assets')
-                items = assets.get('items')
-                asset_ids = [item["id"] for item in items]
-                return asset_ids
-
-            else:
-                print("Error getting all assets")
-        except Exception as e:
-            print(f"Error accessing searchAssets API: {e}")
+        return [asset['id'] for asset in self.iter_assets() if 'id' in asset]
 
     def get_all_people(self):
         """Returns a list of all people ids"""
-        url = f"{self.base_url}/api/people"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
-        try:
-            response = requests.request("GET", url, headers=headers, data=payload)
-            if response.status_code == 200:
-                data = response.json()
-                people = data.get('people', [])
-                ids = [person['id'] for person in people if 'id' in person]
-                return ids
-            else:
-                print("Error getting people list")
-        except Exception as e:
-            print(f"Error accessing getAllPeople API: {e}")
+        return [person['id'] for person in self.iter_people() if 'id' in person]
 
     def get_all_tags(self):
         """Returns a dict of all tag names and associated ids"""
         url = f"{self.base_url}/api/tags"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
                 tags = response.json()
                 tag_dict = {tag['name']: tag['id'] for tag in tags}
                 return tag_dict
             else:
-                print("Error getting tag list")
+                logger.error("Error getting tag list")
         except Exception as e:
-            print(f"Error accessing getAllTags API: {e}")
+            logger.error(f"Error accessing getAllTags API: {e}")
+        return {}
 
     def get_asset_description(self, asset_id):
         """Takes an assetId and returns the description for that assetId"""
+        info = self.get_asset_info(asset_id)
+        if info:
+            return info.description
+
+    def get_asset_info(self, asset_id) -> Optional[AssetInfo]:
+        """Takes an assetId and returns its AssetInfo, from the cache when a fresh copy is held"""
+        info = self.asset_cache.get(asset_id)
+        if info is not None:
+            return info
         url = f"{self.base_url}/api/assets/{asset_id}"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
-                data = response.json()
-                exif_info = data.get('exifInfo')
-                description = exif_info.get('description')
-                return description
+                info = AssetInfo.from_json(response.json())
+                self.asset_cache.put(info)
+                return info
         except Exception as e:
-            print(f"Error accessing getAssetInfo API: {e}")
+            logger.error(f"Error accessing getAssetInfo API: {e}")
 
     def get_asset_statistics(self):
         """Gets total, image and video asset statistics"""
         url = f"{self.base_url}/api/assets/statistics"
-        payload = {}
-        headers = {
-            'Content-Type': 'multipart/form-data',
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
                 data = response.json()
                 self.asset_count['total'] = data.get('total', 0)
@@ -299,24 +524,13 @@ class ImmichClient:
             self.asset_count['total'] = 0
             self.asset_count['images'] = 0
             self.asset_count['videos'] = 0
-            print(f"Error getAssetStatistics API. {e}")
+            logger.error(f"Error getAssetStatistics API. {e}")
 
     def get_asset_tags(self, asset_id):
         """Takes an assetId and returns the tags for that assetId"""
-        url = f"{self.base_url}/api/assets/{asset_id}"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
-        try:
-            response = requests.request("GET", url, headers=headers, data=payload)
-            if response.status_code == 200:
-                data = response.json()
-                tags = data.get('tags')
-                return tags
-        except Exception as e:
-            print(f"Error accessing getAssetInfo API: {e}")
+        info = self.get_asset_info(asset_id)
+        if info:
+            return info.tags
 
     @staticmethod
     def get_device_id():
@@ -330,148 +544,182 @@ class ImmichClient:
         modified_time = file_stat.st_mtime
         return datetime.fromtimestamp(modified_time).strftime("%Y-%m-%d %H:%M:%S")
 
-    def get_my_user(self):
-        """Gets the users login"""
-        url = f"{self.base_url}/api/users/me"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
+    def get_download_info(self, asset_ids: List, archive_size: int = 4 * 1024 ** 3):
+        """Asks the server how to split the assets into archives of at most archive_size bytes. Returns the list of
+        archives, each a dict with the assetIds and size of that archive"""
+        url = f"{self.base_url}/api/download/info"
+        payload = {
+            'assetIds': asset_ids,
+            'archiveSize': archive_size
         }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("POST", url, json=payload, idempotent=True)
+            if response.status_code in [200, 201]:
+                response_data = response.json()
+                return response_data.get('archives', [])
+            else:
+                logger.error("Error getting download info")
+        except Exception as e:
+            logger.error(f"Error accessing getDownloadInfo API: {e}")
+        return []
+
+    def get_my_user(self, save_credentials: bool = True):
+        """Gets the users login, storing the credentials in the keyring on success unless save_credentials is off"""
+        url = f"{self.base_url}/api/users/me"
+        try:
+            response = self._request("GET", url)
             if response.status_code == 200:
                 data = response.json()
                 self.user = data.get('email', "Unknown")
                 self.user_id = data.get('id', "Unknown")
                 self.logged_in = True
-                self._save_credentials()
+                if save_credentials:
+                    self._save_credentials()
             else:
                 self.user = "Unknown"
                 self.logged_in = False
         except Exception as e:
             self.user = "Unknown"
             self.logged_in = False
-            print(f"Error accessing getMyUser API. {e}")
+            logger.error(f"Error accessing getMyUser API. {e}")
 
     def get_original_filename(self, asset_id):
         """Takes an assetId and returns the original filename for that assetId"""
-        url = f"{self.base_url}/api/assets/{asset_id}"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
-        try:
-            response = requests.request("GET", url, headers=headers, data=payload)
-            if response.status_code == 200:
-                data = response.json()
-                filename = data.get('originalFileName')
-                return filename
-        except Exception as e:
-            print(f"Error accessing getAssetInfo API: {e}")
+        info = self.get_asset_info(asset_id)
+        if info:
+            return info.original_filename
 
     def get_person(self, person_id):
         """Takes a person id and returns a list of assetIds"""
-        url = f"{self.base_url}/api/search/metadata"
-        payload = json.dumps({
-            'personIds': [person_id]
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
+        return [asset['id'] for asset in self.iter_assets({'personIds': [person_id]}) if 'id' in asset]
+
+    def get_person_asset_count(self, person_id) -> Optional[int]:
+        """Returns how many assets a person appears in, or None if it couldn't be fetched"""
+        url = f"{self.base_url}/api/people/{person_id}/statistics"
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
-                response_data = response.json()
-                assets = response_data.get('assets', {})
-                items = assets.get('items', [])
-                asset_ids = [item['id'] for item in items if 'id' in item]
-                return asset_ids
+                return response.json().get('assets', 0)
+            else:
+                logger.error(f"Error getting statistics of person {person_id}")
         except Exception as e:
-            print(f"Error accessing searchAssets API: {e}")
+            logger.error(f"Error accessing getPersonStatistics API: {e}")
+        return None
 
-    def get_tag_time_buckets(self, tag_id):
-        """Returns a list of the timeBuckets with the tag."""
+    def get_tag_bucket_counts(self, tag_id) -> List[Tuple[str, int]]:
+        """Returns each timeBucket with the tag along with how many of its assets are in it, newest first"""
         url = f"{self.base_url}/api/timeline/buckets?size=MONTH&tagId={tag_id}&withStacked=false"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
-
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
-                response_data = response.json()
-                time_buckets = []
-                for item in response_data:
-                    if 'timeBucket' in item:
-                        time_buckets.append(item['timeBucket'])
-                if time_buckets:
-                    return time_buckets
-                else:
-                    return None
-
+                return [(item['timeBucket'], item.get('count', 0)) for item in response.json() if 'timeBucket' in item]
             else:
-                print("Error getting time buckets")
+                logger.error("Error getting time buckets")
         except Exception as e:
-            print(f"Error accessing getTimeBuckets API: {e}")
+            logger.error(f"Error accessing getTimeBuckets API: {e}")
+        return []
+
+    def get_tag_time_buckets(self, tag_id):
+        """Returns a list of the timeBuckets with the tag."""
+        return [time_bucket for time_bucket, _ in self.get_tag_bucket_counts(tag_id)]
 
     def get_time_bucket_assets_by_tag(self, time_bucket, tag_id):
         """Takes a timeBucket string and tag, then returns the objects within"""
         url = f"{self.base_url}/api/timeline/bucket?size=MONTH&tagId={tag_id}&timeBucket={time_bucket}"
-        payload = {}
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
-        }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url)
             if response.status_code == 200:
                 response_data = response.json()
                 ids = [item['id'] for item in response_data if 'id' in item]
                 return ids
+            else:
+                logger.error(f"Error getting time bucket {time_bucket}")
         except Exception as e:
-            print(f"Error accessing getTimeBucket API: {e}")
+            logger.error(f"Error accessing getTimeBucket API: {e}")
+        return []
+
+    def iter_assets(self, filters: Optional[Dict] = None, page_size: int = 1000) -> Iterator[Dict]:
+        """Yields every asset matching the search/metadata filters, following nextPage until the last page"""
+        url = f"{self.base_url}/api/search/metadata"
+
+        def fetch_page(page):
+            payload = dict(filters or {}, page=page, size=page_size)
+            try:
+                response = self._request("POST", url, json=payload, idempotent=True)
+                if response.status_code == 200:
+                    assets = response.json().get('assets', {})
+                    next_page = assets.get('nextPage')
+                    return assets.get('items', []), int(next_page) if next_page else None
+                else:
+                    logger.error("Error searching assets")
+            except Exception as e:
+                logger.error(f"Error accessing searchAssets API: {e}")
+            return [], None
+
+        return self._iter_pages(fetch_page)
+
+    def iter_people(self, page_size: int = 500) -> Iterator[Dict]:
+        """Yields every person, following the pages of the people list"""
+        url = f"{self.base_url}/api/people"
+
+        def fetch_page(page):
+            params = {
+                'page': page,
+                'size': page_size
+            }
+            try:
+                response = self._request("GET", url, params=params)
+                if response.status_code == 200:
+                    data = response.json()
+                    return data.get('people', []), page + 1 if data.get('hasNextPage') else None
+                else:
+                    logger.error("Error getting people list")
+            except Exception as e:
+                logger.error(f"Error accessing getAllPeople API: {e}")
+            return [], None
+
+        return self._iter_pages(fetch_page)
+
+    def load_credentials(self):
+        """Load credentials from the system's keyring."""
+        try:
+            import keyring  # Deferred, finding a keyring backend takes a noticeable part of a second
+            saved_base_url = keyring.get_password("ImmichClient", "base_url")
+            saved_token = keyring.get_password("ImmichClient", "token")
+        except Exception as e:  # Headless machines often have no keyring backend at all
+            logger.warning(f"Could not read saved credentials: {e}")
+            return
+        if saved_base_url and saved_token:
+            self.base_url = saved_base_url
+            self.token = saved_token
+            self.logged_in = True
 
     def random_tag_color(self, tag_id):
         """Assigns the supplied tag a random color"""
         url = f"{self.base_url}/api/tags/{tag_id}"
         tag_color = "#{:06x}".format(random.randint(0, 0xFFFFFF))
-        payload = json.dumps({
+        payload = {
             'color': tag_color
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("PUT", url, headers=headers, data=payload)
+            response = self._request("PUT", url, json=payload)
             if response.status_code == 200:
                 return
             else:
-                print(f"Error assigning color:{tag_color} to tag {tag_id}")
+                logger.error(f"Error assigning color:{tag_color} to tag {tag_id}")
         except Exception as e:
-            print(f"Error accessing updateTag API: {e}")
+            logger.error(f"Error accessing updateTag API: {e}")
 
     def search_smart(self, query, num_results=20):
-        """Takes a string query and a max number of results and returns """
+        """Takes a string query and a max number of results and returns the matching assetIds, or None if the search
+        failed"""
         url = f"{self.base_url}/api/search/smart"
-        payload = json.dumps({
+        payload = {
             'query': query,
             'size': num_results
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self._request("POST", url, json=payload, idempotent=True, limiter=self.search_limiter)
             if response.status_code == 200:
                 response_data = response.json()
                 assets = response_data.get('assets')
@@ -479,102 +727,118 @@ class ImmichClient:
                 ids = [item['id'] for item in items if 'id' in item]
                 return ids
             else:
-                print("Error querying smart search")
+                logger.error("Error querying smart search")
 
         except Exception as e:
-            print(f"Error accessing searchSmart API: {e}")
+            logger.error(f"Error accessing searchSmart API: {e}")
+        return None
 
     def tag_assets(self, tag_id, asset_ids):
         """Takes a tag id and a list of asset ids then adds them to the tag"""
         url = f"{self.base_url}/api/tags/{tag_id}/assets"
-        payload = json.dumps({
+        payload = {
             'ids': asset_ids
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("PUT", url, headers=headers, data=payload)
+            response = self._request("PUT", url, json=payload)
+            self.asset_cache.invalidate(asset_ids)  # Cached tag lists of these assets are now out of date
             if response.status_code != 200:
-                print(f"Error tagging assets with tag: {tag_id}")
+                logger.error(f"Error tagging assets with tag: {tag_id}")
         except Exception as e:
-            print(f"Error accessing tagAssets API: {e}")
+            logger.error(f"Error accessing tagAssets API: {e}")
 
     def update_asset_description(self, asset_id, asset_description):
         """Updates an asset with the supplied description"""
         url = f"{self.base_url}/api/assets/{asset_id}"
-        payload = json.dumps({
+        payload = {
             'description': asset_description
-        })
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'x-api-key': self.token
         }
         try:
-            response = requests.request("PUT", url, headers=headers, data=payload)
+            response = self._request("PUT", url, json=payload)
+            self.asset_cache.invalidate([asset_id])
             if response.status_code != 200:
-                print(f"Error adding caption as description. ID:{asset_id} Caption:{asset_description}")
+                logger.error(f"Error adding caption as description. ID:{asset_id} Caption:{asset_description}")
         except Exception as e:
-            print(f"Error accessing updateAsset API: {e}")
+            logger.error(f"Error accessing updateAsset API: {e}")
 
-    def upload_asset(self, file: str):
-        """Uploads a single asset, hashing an AssetId for it. Returning the immich id and upload status"""
+    def upload_asset(self, file: str, checksum: Optional[str] = None):
+        """Uploads a single asset, hashing an AssetId for it. Returning the immich id and upload status. A known
+        SHA-1 checksum lets the server reject a duplicate before the body is sent"""
         url = f"{self.base_url}/api/assets"
         mime_type, _ = mimetypes.guess_type(file)
         if mime_type is None:
             mime_type = 'application/octet-stream'  # Fallback if MIME type cannot be guessed
         asset_id = self.generate_asset_id(file)
         modified_date = self.get_modified_date(file)
-        files = {
-            'deviceAssetId': (None, asset_id),  # None ensures no file-type Content-Disposition
-            'deviceId': (None, self.device_id),
-            'fileCreatedAt': (None, modified_date),
-            'fileModifiedAt': (None, modified_date),
-            'assetData': (file, open(file, 'rb'), mime_type)
-        }
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.token
+        fields = {
+            'deviceAssetId': asset_id,
+            'deviceId': self.device_id,
+            'fileCreatedAt': modified_date,
+            'fileModifiedAt': modified_date
         }
-        attempt = 0
-        while attempt < 3:
-            try:
-                response = requests.request("POST", url, headers=headers, files=files)
-                if response.status_code in [200, 201]:
+        try:  # The server dedupes on deviceAssetId and checksum, so resending an upload is safe to retry
+            with MultipartFileEncoder(fields, 'assetData', file, file, mime_type) as body:
+                headers = {
+                    'Content-Type': body.content_type
+                }
+                if checksum:
+                    headers['x-immich-checksum'] = checksum
+                response = self._request("POST", url, headers=headers, data=body, idempotent=True)
+            if response.status_code in [200, 201]:
+                response_data = response.json()
+                asset_id = response_data.get('id')
+                status = response_data.get('status')
+                return asset_id, status
+            else:
+                logger.error(f'Error uploading {file}')
+        except Exception as e:
+            logger.error(f'Error accessing uploadAsset API: {e}')
 
-                    response_data = response.json()
-                    asset_id = response_data.get('id')
-                    status = response_data.get('status')
-                    return asset_id, status
-                else:
-                    print(f'Error uploading {file}')
-            except Exception as e:
-                print(f'Error accessing uploadAsset API: {e}')
-            # Retry logic: wait before the next attempt
-            attempt += 1
-            if attempt < 3:
-                print(f"Retrying in 2 seconds...")
-                time.sleep(2)
+    def upsert_tags(self, tag_names: List):
+        """Creates any tags that don't exist yet in one request, returning a dict of the tag names and their ids"""
+        url = f"{self.base_url}/api/tags"
+        payload = {
+            'tags': tag_names
+        }
+        try:
+            response = self._request("PUT", url, json=payload)
+            if response.status_code == 200:
+                tags = response.json()
+                tag_dict = {tag.get('value') or tag['name']: tag['id'] for tag in tags}
+                return tag_dict
             else:
-                print(f"Max retries reached for {file}")
+                logger.error(f"Error upserting tags: {tag_names}")
+        except Exception as e:
+            logger.error(f"Error accessing upsertTags API: {e}")
+        return {}
 
     def view_asset(self, asset_id: str):
         """Returns a file-like object of an assets thumbnail."""
         url = f"{self.base_url}/api/assets/{asset_id}/thumbnail"
-        payload = {}
         headers = {
-            'Accept': 'application/octet-stream',
-            'x-api-key': self.token
+            'Accept': 'application/octet-stream'
         }
         try:
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self._request("GET", url, headers=headers)
             if response.status_code == 200:
                 image_data = BytesIO(response.content)
                 return image_data
             else:
-                print(f"Error getting thumb for {asset_id}")
+                logger.error(f"Error getting thumb for {asset_id}")
+        except Exception as e:
+            logger.error(f'Error accessing viewAsset API: {e}')
+
+    def view_person(self, person_id: str):
+        """Returns a file-like object of a persons face thumbnail."""
+        url = f"{self.base_url}/api/people/{person_id}/thumbnail"
+        headers = {
+            'Accept': 'application/octet-stream'
+        }
+        try:
+            response = self._request("GET", url, headers=headers)
+            if response.status_code == 200:
+                return BytesIO(response.content)
+            else:
+                logger.error(f"Error getting thumb for person {person_id}")
         except Exception as e:
-            print(f'Error accessing viewAsset API: {e}')
+            logger.error(f'Error accessing getPersonThumbnail API: {e}')
@@ -0,0 +1,8 @@
+import os
+
+
+def data_dir() -> str:
+    """Returns the per user directory gimmich keeps its local state in, creating it if needed"""
+    path = os.environ.get("GIMMICH_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".gimmich")
+    os.makedirs(path, exist_ok=True)
+    return path
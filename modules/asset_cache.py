@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class AssetInfo:
+    """The parts of an assets metadata gimmich uses, parsed once from GET /api/assets/{id}"""
+    __slots__ = ('id', 'original_filename', 'description', 'tags', 'checksum')
+
+    def __init__(self, asset_id: str, original_filename: Optional[str], description: Optional[str],
+                 tags: List[Dict], checksum: Optional[str]):
+        self.id = asset_id
+        self.original_filename = original_filename
+        self.description = description
+        self.tags = tags
+        self.checksum = checksum
+
+    @classmethod
+    def from_json(cls, data: Dict):
+        """Builds the record from an asset response"""
+        exif_info = data.get('exifInfo') or {}
+        return cls(data.get('id'), data.get('originalFileName'), exif_info.get('description'),
+                   data.get('tags') or [], data.get('checksum'))
+
+
+class AssetInfoCache:
+    """Thread-safe LRU cache of AssetInfo records. Entries expire after ttl seconds and the least recently used
+    entry is dropped once max_entries is reached."""
+    def __init__(self, max_entries: int = 10000, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # asset_id -> (expiry time, AssetInfo)
+        self._lock = threading.Lock()
+
+    def get(self, asset_id: str) -> Optional[AssetInfo]:
+        """Returns the cached record, or None if it is missing or stale"""
+        with self._lock:
+            entry = self._entries.get(asset_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(asset_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[asset_id]
+            self.misses += 1
+            return None
+
+    def put(self, info: AssetInfo):
+        """Stores a record, evicting the least recently used one if the cache is full"""
+        with self._lock:
+            self._entries[info.id] = (time.monotonic() + self.ttl, info)
+            self._entries.move_to_end(info.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, asset_ids: List[str]):
+        """Drops the records of assets that were just changed"""
+        with self._lock:
+            for asset_id in asset_ids:
+                self._entries.pop(asset_id, None)
+
+    def clear(self):
+        """Drops every record"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters along with the current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Coroutine, List, Optional
+from modules.api_client import ImmichClient
+
+
+class AsyncBridge:
+    """Runs a single asyncio event loop in a background thread so Tk frames can submit coroutines to it"""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="gimmich-asyncio", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """Event loop thread body"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedules a coroutine on the background loop, returning a concurrent.futures.Future for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """Stops the background loop"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class AsyncImmichClient:
+    """Coroutine version of ImmichClient. All calls share one semaphore so at most max_in_flight requests run
+    at once, each on the sync clients pooled session."""
+    def __init__(self, client: ImmichClient, bridge: Optional[AsyncBridge] = None, max_in_flight: int = 32):
+        self.client = client
+        self.bridge = bridge
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="immich-async")
+
+    async def _call(self, func, *args, **kwargs):
+        """Runs a blocking client call in the executor once a slot on the semaphore is free"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Submits a coroutine to the bridge loop, usable from Tk callbacks and worker threads"""
+        return self.bridge.submit(coro)
+
+    async def add_assets_to_album(self, album_id: str, asset_ids: List):
+        """Takes an album id and a list of asset ids then adds them to the album"""
+        return await self._call(self.client.add_assets_to_album, album_id, asset_ids)
+
+    async def create_album(self, album_name: str):
+        """Creates an album, returning the album id"""
+        return await self._call(self.client.create_album, album_name)
+
+    async def create_tag(self, tag_name: str):
+        """Creates a tag, returning the tag id"""
+        return await self._call(self.client.create_tag, tag_name)
+
+    async def download_archive(self, asset_ids: List):
+        """Takes a list of assetIds and returns a file like object containing an archive with the assets"""
+        return await self._call(self.client.download_archive, asset_ids)
+
+    async def download_asset(self, asset_id: str):
+        """Takes an assetId and returns a file like object containing an image"""
+        return await self._call(self.client.download_asset, asset_id)
+
+    async def download_asset_to_file(self, asset_id: str, path: str, durable: bool = False):
+        """Streams an assets original straight to path, returning the number of bytes written"""
+        return await self._call(self.client.download_asset_to_file, asset_id, path, durable)
+
+    async def get_album_info(self, album_id):
+        """Returns a list of the assetIds in the album as well as the id of the thumbnail."""
+        return await self._call(self.client.get_album_info, album_id)
+
+    async def get_album_infos(self, album_ids: List):
+        """Fetches the contents of many albums concurrently, in the same order as album_ids"""
+        return await asyncio.gather(*(self.get_album_info(album_id) for album_id in album_ids))
+
+    async def get_all_albums(self):
+        """Returns a dict of all album names and associated ids"""
+        return await self._call(self.client.get_all_albums)
+
+    async def get_all_assets(self):
+        """Returns a list of all assetIds"""
+        return await self._call(self.client.get_all_assets)
+
+    async def get_all_people(self):
+        """Returns a list of all people ids"""
+        return await self._call(self.client.get_all_people)
+
+    async def get_all_tags(self):
+        """Returns a dict of all tag names and associated ids"""
+        return await self._call(self.client.get_all_tags)
+
+    async def get_asset_description(self, asset_id):
+        """Takes an assetId and returns the description for that assetId"""
+        return await self._call(self.client.get_asset_description, asset_id)
+
+    async def get_asset_info(self, asset_id):
+        """Takes an assetId and returns its AssetInfo"""
+        return await self._call(self.client.get_asset_info, asset_id)
+
+    async def get_asset_tags(self, asset_id):
+        """Takes an assetId and returns the tags for that assetId"""
+        return await self._call(self.client.get_asset_tags, asset_id)
+
+    async def get_original_filename(self, asset_id):
+        """Takes an assetId and returns the original filename for that assetId"""
+        return await self._call(self.client.get_original_filename, asset_id)
+
+    async def get_pack_asset_ids(self, kind: str, pack_id: str):
+        """Resolves the assetIds of an album, tag or person pack, fetching tag timebuckets concurrently"""
+        if kind == "album":
+            asset_ids, _ = await self.get_album_info(pack_id)
+            return asset_ids
+        if kind == "tag":
+            return await self.get_tag_asset_ids(pack_id)
+        if kind == "person":
+            return await self.get_person(pack_id)
+        raise ValueError(f"Unknown pack kind {kind}")
+
+    async def get_person(self, person_id):
+        """Takes a person id and returns a list of assetIds"""
+        return await self._call(self.client.get_person, person_id)
+
+    async def get_person_asset_count(self, person_id):
+        """Returns how many assets a person appears in"""
+        return await self._call(self.client.get_person_asset_count, person_id)
+
+    async def get_people(self, person_ids: List):
+        """Fetches the assetIds of many people concurrently, in the same order as person_ids"""
+        return await asyncio.gather(*(self.get_person(person_id) for person_id in person_ids))
+
+    async def get_tag_asset_ids(self, tag_id):
+        """Returns every assetId with the tag, fetching all of its time buckets concurrently"""
+        time_buckets = await self.get_tag_time_buckets(tag_id)
+        if not time_buckets:
+            return []
+        results = await asyncio.gather(*(self.get_time_bucket_assets_by_tag(time_bucket, tag_id)
+                                         for time_bucket in time_buckets))
+        asset_ids = []
+        for ids in results:
+            if ids:
+                asset_ids.extend(ids)
+        return asset_ids
+
+    async def get_tag_bucket_counts(self, tag_id):
+        """Returns each timeBucket with the tag along with how many of its assets are in it, newest first"""
+        return await self._call(self.client.get_tag_bucket_counts, tag_id)
+
+    async def get_tag_summary(self, tag_id):
+        """Returns how many assets have the tag and the id of the newest one, without listing every timebucket"""
+        bucket_counts = await self.get_tag_bucket_counts(tag_id)
+        if not bucket_counts:
+            return 0, None
+        newest = await self.get_time_bucket_assets_by_tag(bucket_counts[0][0], tag_id)
+        return sum(count for _, count in bucket_counts), newest[0] if newest else None
+
+    async def get_tag_time_buckets(self, tag_id):
+        """Returns a list of the timeBuckets with the tag."""
+        return await self._call(self.client.get_tag_time_buckets, tag_id)
+
+    async def get_time_bucket_assets_by_tag(self, time_bucket, tag_id):
+        """Takes a timeBucket string and tag, then returns the objects within"""
+        return await self._call(self.client.get_time_bucket_assets_by_tag, time_bucket, tag_id)
+
+    async def search_smart(self, query, num_results=20):
+        """Takes a string query and a max number of results and returns the matching assetIds, or None if
+        the search failed"""
+        return await self._call(self.client.search_smart, query, num_results)
+
+    async def tag_assets(self, tag_id, asset_ids):
+        """Takes a tag id and a list of asset ids then adds them to the tag"""
+        return await self._call(self.client.tag_assets, tag_id, asset_ids)
+
+    async def update_asset_description(self, asset_id, asset_description):
+        """Updates an asset with the supplied description"""
+        return await self._call(self.client.update_asset_description, asset_id, asset_description)
+
+    async def upload_asset(self, file: str, checksum: Optional[str] = None):
+        """Uploads a single asset, returning the immich id and upload status"""
+        return await self._call(self.client.upload_asset, file, checksum)
+
+    async def view_asset(self, asset_id: str):
+        """Returns a file-like object of an assets thumbnail."""
+        return await self._call(self.client.view_asset, asset_id)
+
+    async def view_assets(self, asset_ids: List):
+        """Fetches many thumbnails concurrently, returning them in the same order as asset_ids"""
+        return await asyncio.gather(*(self.view_asset(asset_id) for asset_id in asset_ids))
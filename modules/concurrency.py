@@ -0,0 +1,112 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """Caps how many requests run at once and tunes the cap with AIMD: while p95 latency stays near its healthy
+    baseline and requests use the whole allowance, the limit grows by one per window of responses. A 429/5xx,
+    network error or latency spike cuts it multiplicatively."""
+    def __init__(self, name: str, initial: int = 4, min_limit: int = 1, max_limit: int = 32, window: int = 20,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0):
+        self.name = name
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window  # Responses judged together before the limit is raised
+        self.backoff = backoff  # Factor the limit is multiplied by on overload
+        self.latency_tolerance = latency_tolerance  # p95 over baseline by this factor counts as a spike
+        self.baseline_latency: Optional[float] = None  # Smoothed p95 of healthy windows
+        self.in_flight = 0
+        self._latencies: List[float] = []
+        self._responses = 0
+        self._since_decrease = initial  # Responses seen since the last cut, so the first overload is acted on
+        self._saturated = False  # Whether callers hit the limit during the current window
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until a slot under the current limit is free"""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._saturated = True
+                self._condition.wait()
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+
+    def release(self):
+        """Frees a slot taken by acquire"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """Holds a slot for the duration of a with block"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def observe(self, latency: Optional[float], overloaded: bool):
+        """Records one finished request. latency is None for requests whose time says nothing about server load,
+        such as large uploads."""
+        with self._condition:
+            self._since_decrease += 1
+            if overloaded:
+                if self._since_decrease >= self.limit:  # Only react once to the requests already in flight
+                    self._decrease("server overloaded")
+                return
+            self._responses += 1
+            if latency is not None:
+                self._latencies.append(latency)
+            if self._responses < self.window:
+                return
+            p95 = self._p95()
+            if p95 is not None and self.baseline_latency and p95 > self.baseline_latency * self.latency_tolerance:
+                self._decrease(f"p95 latency {p95 * 1000:.0f}ms")
+                self.baseline_latency = self.baseline_latency * 0.8 + p95 * 0.2  # Let a lasting shift become normal
+                return
+            if p95 is not None:
+                self.baseline_latency = p95 if self.baseline_latency is None else \
+                    self.baseline_latency * 0.8 + p95 * 0.2
+            if self._saturated and self.limit < self.max_limit:
+                self._set_limit(self.limit + 1, "healthy")
+            self._reset_window()
+
+    def stats(self):
+        """Returns the current limit, requests in flight and latency baseline"""
+        with self._condition:
+            return {'limit': self.limit, 'in_flight': self.in_flight,
+                    'baseline_p95_ms': round(self.baseline_latency * 1000) if self.baseline_latency else None}
+
+    def _p95(self) -> Optional[float]:
+        """Returns the 95th percentile of the windows latencies"""
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _decrease(self, reason: str):
+        """Cuts the limit multiplicatively and starts a new window"""
+        self._set_limit(max(self.min_limit, int(self.limit * self.backoff)), reason)
+        self._since_decrease = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        """Clears the samples of the current window"""
+        self._latencies = []
+        self._responses = 0
+        self._saturated = False
+
+    def _set_limit(self, limit: int, reason: str):
+        """Changes the limit, logging the change and waking waiters if it grew"""
+        if limit != self.limit:
+            logger.debug(f"{self.name} concurrency limit {self.limit} -> {limit} ({reason})")
+            self.limit = limit
+            self._condition.notify_all()
+
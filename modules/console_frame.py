@@ -1,28 +1,57 @@
 import customtkinter as ctk
+import logging
 import sys
 from datetime import datetime
+from modules.console_log import APP_LOGGER, LEVELS, ConsoleLog
+from modules.ui_dispatcher import UiDispatcher
+
+logger = logging.getLogger(__name__)
 
 
 class ConsoleFrame(ctk.CTkFrame):
-    """This displays the terminal output in a nice way, along with a button to save or copy the output"""
-    def __init__(self, master: ctk.CTkFrame, **kwargs):
+    """This displays the terminal output in a nice way, along with a button to save or copy the output. Output is
+    kept in a bounded ConsoleLog and drawn in batches, at most once per dispatcher frame."""
+    def __init__(self, master: ctk.CTkFrame, dispatcher: UiDispatcher, **kwargs):
         super().__init__(master, **kwargs)
+        self.dispatcher = dispatcher
+        self.log = ConsoleLog()  # Ring buffer of the newest lines, written from any thread
+        self.min_level = logging.INFO  # Lines below this level are kept but not shown
+        self.render_sequence = 0  # Last log line drawn in the textbox
+        self.shown_lines = 0  # Lines in the textbox, trimmed to the log capacity
+
         self.main_frame = ctk.CTkTextbox(self, wrap="word")  # Console log
         self.main_frame.grid(row=0, column=0, padx=5, pady=5, sticky="nsew", columnspan=2)
         self.grid_rowconfigure(0, weight=100)  # Ensure it expands properly
-        self.grid_rowconfigure(2, weight=1)  # Ensure it expands properly
+        self.grid_rowconfigure(3, weight=1)  # Ensure it expands properly
         self.grid_columnconfigure(0, weight=1)
         self.save_button = ctk.CTkButton(self, text="Save Log", command=self.save_log)
         self.save_button.grid(row=1, column=0, padx=5, pady=5, sticky="w")
         self.copy_button = ctk.CTkButton(self, text="Copy to Clipboard", command=self.copy_to_clipboard)
         self.copy_button.grid(row=1, column=0, padx=5, pady=5, sticky="e")
+        self.level_menu = ctk.CTkOptionMenu(self, values=list(LEVELS), command=self.set_level)
+        self.level_menu.set("Info")
+        self.level_menu.grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.log_file_var = ctk.BooleanVar(value=False)  # Also write the log to a rotating file when set
+        self.log_file_checkbox = ctk.CTkCheckBox(self, text="Log to file", variable=self.log_file_var,
+                                                 command=self.toggle_log_file)
+        self.log_file_checkbox.grid(row=2, column=0, padx=5, pady=5, sticky="e")
 
-        # Redirect console output to the Text widget
-        sys.stdout = self
+        # Redirect console output to the log, which the Text widget is drawn from
+        self.log.listeners.append(self.schedule_render)
+        logging.getLogger().addHandler(self.log)
+        logging.getLogger(APP_LOGGER).setLevel(logging.DEBUG)  # Keep every line, the level menu decides what shows
+        sys.stdout = self.log
+
+    def close(self):
+        """Stops capturing output and closes the log file"""
+        if sys.stdout is self.log:
+            sys.stdout = sys.__stdout__
+        logging.getLogger().removeHandler(self.log)
+        self.log.close()
 
     def copy_to_clipboard(self):
-        """Copy the contents of the main_frame to the clipboard."""
-        log_text = self.main_frame.get("1.0", "end").strip()  # Get all text
+        """Copy the shown log lines to the clipboard."""
+        log_text = self.log.text(self.min_level)  # Get all text
         if log_text:  # Only copy if there's text
             self.clipboard_clear()  # Clear the clipboard
             self.clipboard_append(log_text)  # Append text to clipboard
@@ -30,19 +59,47 @@ class ConsoleFrame(ctk.CTkFrame):
             print("Log copied to clipboard.")  # Confirm the action in the console
 
     def save_log(self):
-        """Save the contents of the main_frame to a log file."""
-        log_text = self.main_frame.get("1.0", "end").strip()  # Get all text
+        """Save every buffered log line, whatever the shown level, to a log file."""
+        log_text = self.log.text()  # Get all text
         if log_text:  # Only save if there's text
             filename = datetime.now().strftime("log_%Y-%m-%d_%H-%M-%S.txt")
             with open(filename, "w") as log_file:
                 log_file.write(log_text)
             print(f"Log saved to {filename}")  # Confirm the save in the console
 
-    def write(self, message: str):
-        """Write message to the console and scroll to the bottom."""
-        self.main_frame.insert("end", message)
-        self.main_frame.see("end")
+    def set_level(self, level_name: str):
+        """Shows only the lines of at least the chosen level, redrawing the buffered ones"""
+        self.min_level = LEVELS[level_name]
+        self.main_frame.delete("1.0", "end")
+        self.shown_lines = 0
+        self.render_sequence = 0  # Redraw everything still buffered
+        self.render()
 
-    def flush(self):
-        """Required for compatibility with sys.stdout."""
-        pass
+    def toggle_log_file(self):
+        """Starts or stops writing the log to a rotating file in the data directory"""
+        if self.log_file_var.get():
+            try:
+                print(f"Logging to {self.log.enable_file()}")
+            except OSError as e:
+                self.log_file_var.set(False)
+                logger.warning(f"Could not open log file: {e}")
+        else:
+            self.log.disable_file()
+
+    def schedule_render(self):
+        """Asks for a render from any thread, bursts of lines fold into a single render per frame"""
+        self.dispatcher.post(self.render, key=(self, "render"))
+
+    def render(self):
+        """Appends the lines logged since the last render in one insert, trimming the oldest past the log capacity"""
+        self.render_sequence, records = self.log.since(self.render_sequence)
+        lines = [text for _, level, text in records if level >= self.min_level]
+        if not lines:
+            return
+        self.main_frame.insert("end", "\n".join(lines) + "\n")
+        self.shown_lines += len(lines)
+        excess = self.shown_lines - self.log.capacity
+        if excess > 0:
+            self.main_frame.delete("1.0", f"{excess + 1}.0")
+            self.shown_lines -= excess
+        self.main_frame.see("end")
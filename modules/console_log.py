@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, List, Optional, Tuple
+from modules.app_paths import data_dir
+
+LEVELS = {"Debug": logging.DEBUG, "Info": logging.INFO, "Warning": logging.WARNING, "Error": logging.ERROR}
+APP_LOGGER = "modules"  # Parent of every gimmich module logger, whose records are shown without their name
+
+
+class ConsoleLog(logging.Handler):
+    """Thread safe log of the last capacity lines. It is a logging handler for the records gimmich and its
+    libraries log with their level, and it stands in for sys.stdout so plain prints land in it too, at INFO.
+    Writing only appends to the ring buffer, listeners are told something new arrived and the console reads the
+    new lines in batches. Lines can also go to a rotating file."""
+    def __init__(self, capacity: int = 5000):
+        super().__init__(level=logging.DEBUG)
+        self.capacity = capacity
+        self.listeners: List[Callable[[], None]] = []  # Called from the writing thread after new lines arrive
+        self.sequence = 0  # Number of lines ever logged, the last buffered line has this number
+        self._records: deque = deque(maxlen=capacity)  # (time, level, text) of the newest lines
+        self._partial: Dict[int, str] = {}  # Thread id -> start of a line printed without its newline yet
+        self._buffer_lock = threading.Lock()
+        self.file_handler: Optional[RotatingFileHandler] = None
+
+    def write(self, message: str) -> int:
+        """Logs every complete line of printed text at INFO, holding on to an unfinished line until its newline
+        arrives"""
+        thread = threading.get_ident()
+        with self._buffer_lock:
+            lines = (self._partial.pop(thread, "") + message).split("\n")
+            if lines[-1]:
+                self._partial[thread] = lines[-1]
+        for line in lines[:-1]:
+            self.add(logging.INFO, line)
+        return len(message)
+
+    def flush(self):
+        """Required for compatibility with sys.stdout, lines are logged as soon as they are complete"""
+        pass
+
+    def emit(self, record: logging.LogRecord):
+        """Logs a record from the logging module, naming the logger unless it is one of gimmichs own"""
+        try:
+            own = record.name == APP_LOGGER or record.name.startswith(f"{APP_LOGGER}.")
+            self.add(record.levelno, record.getMessage() if own else f"{record.name}: {record.getMessage()}")
+        except Exception:
+            self.handleError(record)
+
+    def add(self, level: int, text: str):
+        """Appends a line to the buffer and the log file, dropping the oldest line once the buffer is full"""
+        now = time.time()
+        with self._buffer_lock:
+            self._records.append((now, level, text))
+            self.sequence += 1
+            file_handler = self.file_handler
+        if file_handler is not None:
+            file_handler.handle(logging.makeLogRecord({'created': now, 'msecs': now % 1 * 1000, 'levelno': level,
+                                                       'levelname': logging.getLevelName(level), 'msg': text}))
+        for listener in self.listeners:
+            listener()
+
+    def since(self, sequence: int) -> Tuple[int, List[Tuple[float, int, str]]]:
+        """Returns the current sequence and the lines logged after sequence, or every buffered line if some of
+        those were already dropped"""
+        with self._buffer_lock:
+            new = min(self.sequence - sequence, len(self._records))
+            return self.sequence, list(self._records)[len(self._records) - new:]
+
+    def text(self, min_level: int = logging.DEBUG) -> str:
+        """Returns the buffered lines of at least min_level with their time and level, for saving or copying"""
+        _, records = self.since(0)
+        return "\n".join(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))} "
+                         f"{logging.getLevelName(level)} {text}"
+                         for created, level, text in records if level >= min_level)
+
+    def enable_file(self, path: Optional[str] = None, max_bytes: int = 1024 ** 2, backups: int = 3) -> str:
+        """Starts writing every line to a log file that rolls over at max_bytes, keeping backups old files.
+        Returns the path of the file."""
+        path = path or os.path.join(data_dir(), "logs", "gimmich.log")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        with self._buffer_lock:
+            previous, self.file_handler = self.file_handler, file_handler
+        if previous is not None:
+            previous.close()
+        return path
+
+    def disable_file(self):
+        """Stops writing to the log file"""
+        with self._buffer_lock:
+            previous, self.file_handler = self.file_handler, None
+        if previous is not None:
+            previous.close()
+
+    def close(self):
+        """Closes the log file along with the handler"""
+        self.disable_file()
+        super().close()
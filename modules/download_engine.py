@@ -0,0 +1,157 @@
+import logging
+from threading import Event
+from typing import Callable, Dict, List, Optional
+from modules.api_client import ImmichClient
+from modules.download_pipeline import DownloadPipeline, pack_directory, write_caption
+from modules.job_journal import JobJournal, JobState
+
+logger = logging.getLogger(__name__)
+
+archive_chunk_size = 1024 ** 3  # Largest archive requested from the server in archive download mode
+
+
+class DownloadEngine:
+    """Runs a download job without any UI: fetches every pack either asset by asset through the download pipeline
+    or as server side archives, journaling each finished file. Packs are the dicts returned by
+    AddPackDownloadFrame.get_options(). Progress is reported through on_status(text) and
+    on_progress(stage, done, total)."""
+    def __init__(self, client: ImmichClient, save_path: str, workers: int = 16, durable_writes: bool = False,
+                 archive_mode: bool = False, stop_flag: Optional[Event] = None,
+                 journal: Optional[JobJournal] = None,
+                 on_status: Optional[Callable[[str], None]] = None,
+                 on_progress: Optional[Callable[[str, int, int], None]] = None):
+        self.client = client
+        self.save_path = save_path
+        self.workers = workers  # Upper bound, the clients adaptive limiter decides how many actually run
+        self.durable_writes = durable_writes
+        self.archive_mode = archive_mode
+        self.stop_flag = stop_flag or Event()
+        self.journal = journal or JobJournal("download")
+        self.on_status = on_status
+        self.on_progress = on_progress
+        self.journal_positions = {}  # (pack index, asset id) -> position of the asset in the journaled plan
+        self.total = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.metrics = client.metrics
+        self.summary: Dict = {}  # Metrics of the last run
+
+    def set_status(self, text: str):
+        """Reports a status line"""
+        if self.on_status:
+            self.on_status(text)
+
+    def set_progress(self, stage: str, done: int, total: int):
+        """Reports progress through a stage of the job"""
+        if self.on_progress:
+            self.on_progress(stage, done, total)
+
+    def run(self, packs: List[Dict], resume: Optional[JobState] = None) -> bool:
+        """Downloads the packs. Continues the journaled job resume instead, skipping the files it already
+        downloaded, when given. Returns True if the job ran to the end, False if it was stopped."""
+        metrics_start = self.metrics.snapshot()
+        try:
+            if resume is not None:
+                packs = resume.items
+            else:  # An asset listed twice in a pack would be downloaded over itself
+                packs = [dict(pack, asset_ids=list(dict.fromkeys(pack['asset_ids']))) for pack in packs]
+            self.journal_positions = {}
+            position = 0  # Follows the order of the journaled plan
+            for pack_index, pack in enumerate(packs):
+                for asset_id in pack['asset_ids']:
+                    self.journal_positions.setdefault((pack_index, asset_id), position)
+                    position += 1
+            if resume is None:
+                self.journal.start(self.client.base_url, {'save_path': self.save_path,
+                                                          'worker_count': self.workers,
+                                                          'durable_writes': self.durable_writes,
+                                                          'archive_mode': self.archive_mode}, packs)
+            else:
+                self.journal.resume()
+                packs = [dict(pack, asset_ids=[asset_id for asset_id in pack['asset_ids']
+                                               if self.journal_positions[(pack_index, asset_id)] not in resume.done])
+                         for pack_index, pack in enumerate(packs)]  # Only what is left, pack indexes unchanged
+                print(f"Resuming download, {len(resume.done)} files already downloaded")
+            total_files = sum(len(pack['asset_ids']) for pack in packs)
+            self.total = total_files
+
+            if total_files == 0:
+                self.journal.complete()
+                self.set_status("No files to download")
+                return True
+
+            if self.archive_mode:  # Fetch each pack as a few archives instead of asset by asset
+                processed_files = 0
+                with self.metrics.stage("download"):
+                    for pack_index, pack in enumerate(packs):
+                        if self.stop_flag.is_set():
+                            break
+                        processed_files = self.download_pack_archives(pack, pack_index, processed_files,
+                                                                      total_files)
+            else:
+                def update_progress(completed: int, total: int):
+                    """Reports progress as files land on disk"""
+                    self.set_progress("download", completed, total)
+                    self.set_status(f"Downloading... {completed}/{total} files "
+                                    f"(limit {self.client.request_limiter.limit})")
+
+                pipeline = DownloadPipeline(self.client, self.save_path, workers=self.workers,
+                                            durable=self.durable_writes, stop_flag=self.stop_flag,
+                                            on_progress=update_progress, on_asset_done=self.record_downloaded)
+                with self.metrics.stage("download"):
+                    pipeline.run(packs)
+                self.failed += pipeline.failed
+
+            if self.stop_flag.is_set():
+                print("Download stopped by user.")
+                self.set_status("Download Stopped")
+                return False
+            if self.failed:  # Keep the journal so the failures are retried when the job is resumed
+                logger.warning(f"{self.failed} files failed to download, resume the job to retry them")
+            else:
+                self.journal.complete()
+            self.set_status("Download Complete")
+            return True
+
+        finally:
+            self.journal.close()
+            self.summary = self.metrics.finish_job("download", metrics_start)
+
+    def record_downloaded(self, pack_index: int, asset_id: str):
+        """Counts and journals an asset that is now on disk"""
+        self.downloaded += 1
+        self.metrics.add_files("download")
+        self.journal.record_done(self.journal_positions[(pack_index, asset_id)])
+
+    def download_pack_archives(self, pack: Dict, pack_index: int, processed_files: int, total_files: int):
+        """Downloads a pack as size bounded server side archives, extracting each one as it streams in"""
+        directory = pack_directory(self.save_path, pack)
+        archives = self.client.get_download_info(pack['asset_ids'], archive_chunk_size) or []
+        total_bytes = sum(archive.get('size', 0) for archive in archives)
+        received_bytes = 0
+        for index, archive in enumerate(archives):
+            if self.stop_flag.is_set():
+                break
+
+            def update_progress(chunk_bytes: int):
+                """Advances the progress by the bytes received"""
+                nonlocal received_bytes
+                received_bytes += chunk_bytes
+                self.set_progress("archive", received_bytes, total_bytes)
+                self.set_status(f"Downloading archive {index + 1}/{len(archives)}... "
+                                f"{received_bytes // 1048576}/{total_bytes // 1048576} MB")
+
+            archive_ids = archive.get('assetIds', [])
+            if self.client.download_archive_to_directory(archive_ids, directory, update_progress,
+                                                         durable=self.durable_writes) is None:
+                self.failed += len(archive_ids)  # Left out of the journal so a resume fetches it again
+                continue
+            for id in archive_ids:
+                if pack['caption_type'] != 0:
+                    info = self.client.get_asset_info(id)
+                    if info is not None:
+                        write_caption(directory, info, pack['caption_type'])
+                self.record_downloaded(pack_index, id)
+            processed_files += len(archive_ids)
+            print(f"Downloaded archive {index + 1}/{len(archives)} ({processed_files}/{total_files} files)")
+        return processed_files
@@ -1,24 +1,34 @@
-import os
+import logging
 import threading
-from typing import List
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Union
 import tkinter
 import customtkinter as ctk
-from tkinter import filedialog
+from tkinter import filedialog, messagebox
 from modules.login_frame import LoginFrame
 from modules.api_client import ImmichClient
+from modules.download_engine import DownloadEngine
+from modules.job_journal import JobJournal, JobState
+from modules.ui_dispatcher import UiDispatcher
+
+logger = logging.getLogger(__name__)
 
 
 class DownloadFrame(ctk.CTkFrame):
     """This contains the packs to download and the logic for downloading them and thier options."""
-    def __init__(self, parent: ctk.CTkFrame, login_frame: LoginFrame, client: ImmichClient):
+    def __init__(self, parent: ctk.CTkFrame, login_frame: LoginFrame, client: ImmichClient, dispatcher: UiDispatcher):
         super().__init__(parent)
         self.columnconfigure(0, weight=1)  # Configure frame for stretching to fit window
         self.rowconfigure(0, weight=1)
         self.client = client
+        self.dispatcher = dispatcher  # The download thread reports through this, never touching widgets
         self.login_frame = login_frame
         self.queued_downloads = []  # List to hold DownloadPackFrame objects
         self.save_path = "No Path Selected"
-        self.composed_save_path = "No Path Selected"
+        self.worker_count = 16  # Most concurrent downloads, the clients adaptive limiter tunes the actual count
+        self.durable_writes = False
+        self.archive_mode = False
+        self.journal = JobJournal("download")  # Lets an interrupted download queue be resumed
 
         self.scrollable_frame = ctk.CTkScrollableFrame(self, label_text="Download Queue")  # Scrollable frame for queued downloads
         self.scrollable_frame.grid(row=0, column=0, padx=5, pady=5, sticky="nsew", columnspan=2)
@@ -41,12 +51,23 @@ class DownloadFrame(ctk.CTkFrame):
         self.download_progressbar.grid(row=5, padx=5, pady=5, sticky="ew", columnspan=2)
         self.download_progressbar.set(0)
 
+        self.durable_writes_var = ctk.BooleanVar(value=False)  # Fsync downloaded files in batches when set
+        self.durable_writes_checkbox = ctk.CTkCheckBox(self, text="Durable writes (fsync)",
+                                                       variable=self.durable_writes_var)
+        self.durable_writes_checkbox.grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.archive_mode_var = ctk.BooleanVar(value=False)  # Download packs as server side zip archives when set
+        self.archive_mode_checkbox = ctk.CTkCheckBox(self, text="Archive mode", variable=self.archive_mode_var)
+        self.archive_mode_checkbox.grid(row=6, column=1, padx=5, pady=5, sticky="e")
+        self.workers_entry = ctk.CTkEntry(self, placeholder_text="Max concurrent downloads (default 16)")
+        self.workers_entry.grid(row=7, padx=5, pady=5, sticky="ew", columnspan=2)
+
         self._stop_flag = threading.Event()   # Internal stop flag for threading
 
-    def add_pack(self, name: str, thumb: ctk.CTkImage, asset_ids: List, color: str):
-        """This creates a download pack and adds it to the frame"""
+    def add_pack(self, name: str, thumb: ctk.CTkImage, asset_ids: Union[List, Future], color: str):
+        """This creates a download pack and adds it to the frame. asset_ids may be a Future of them for packs that
+        are still being resolved."""
         next_row = len(self.scrollable_frame.winfo_children())
-        album_pack = AddPackDownloadFrame(self.scrollable_frame, name, thumb, asset_ids, color)
+        album_pack = AddPackDownloadFrame(self.scrollable_frame, name, thumb, asset_ids, color, self.dispatcher)
         album_pack.grid(row=next_row, column=0, padx=5, pady=1, sticky="ew")
 
     def download_images(self):
@@ -57,82 +78,97 @@ class DownloadFrame(ctk.CTkFrame):
         self.progressbar_status.set("Preparing to download...")
         self.download_button.configure(state="disabled")  # Disable upload button
         self._stop_flag.clear()  # Clear the stop flag before starting
-        threading.Thread(target=self.download_task, daemon=True).start()
+        packs = [child.get_options() for child in self.scrollable_frame.winfo_children()]  # Read tk state here
+        self.worker_count = self.get_worker_count()
+        self.durable_writes = self.durable_writes_var.get()
+        self.archive_mode = self.archive_mode_var.get()
+        threading.Thread(target=self.download_task, args=(packs,), daemon=True).start()
 
-    def download_task(self):
-        """This iterates over the packs in the download frame and downloads them"""
+    def offer_resume(self):
+        """Asks whether to resume a download queue that was interrupted on this server and starts it if so"""
+        state = self.journal.load()
+        if state is None or state.server != self.client.base_url:
+            return
+        total_files = sum(len(pack['asset_ids']) for pack in state.items)
+        if not messagebox.askyesno("Resume download", f"A download of {len(state.items)} packs was interrupted "
+                                                      f"after {len(state.done)} of {total_files} files. Resume it?"):
+            self.journal.discard()
+            return
+        self.save_path = state.options['save_path']
+        self.save_path_label.configure(text=self.save_path)
+        self.worker_count = state.options['worker_count']
+        self.durable_writes = state.options['durable_writes']
+        self.archive_mode = state.options['archive_mode']
+        self.download_progressbar.set(0)
+        self.progressbar_status.set("Resuming download...")
+        self.download_button.configure(state="disabled")
+        self._stop_flag.clear()
+        threading.Thread(target=self.download_task, args=([], state), daemon=True).start()
+
+    def get_worker_count(self):
+        """Returns the most concurrent downloads from the entry, falling back to 16"""
         try:
-            # Iterate over all download packs in the scrollable frame for total number of items
-            total_files = sum(len(child.asset_ids) for child in self.scrollable_frame.winfo_children())
-
-            if total_files == 0:
-                self.progressbar_status.set("No files to download")
-                return
-            processed_files = 0  # Create index for updating progress bar
-
-            for index, child in enumerate(self.scrollable_frame.winfo_children()):
-                if self._stop_flag.is_set():
-                    print("Download stopped by user.")
-                    self.progressbar_status.set("Download Stopped")
-                    return
-                if child.directory_type_var.get() == 0:  # Adjust base path according to pack options
-                    self.composed_save_path = self.save_path
-                if child.directory_type_var.get() == 1:
-                    self.composed_save_path = f"{self.save_path}/{child.name}"
-                    os.makedirs(f"{self.composed_save_path}", exist_ok=True)
-                if child.directory_type_var.get() == 2:
-                    user_path = child.user_directory.get()
-                    self.composed_save_path = f"{self.save_path}/{user_path}"
-                    os.makedirs(f"{self.composed_save_path}", exist_ok=True)
-
-                for id in child.asset_ids:
-                    self.process_options(child, id)  # Process file download options
-                    processed_files += 1
-                    progress = (processed_files + 1) / total_files
-                    self.download_progressbar.set(progress)  # Update progress bar
-                    self.progressbar_status.set(f"Downloading... {processed_files}/{total_files} files")
-            self.progressbar_status.set("Download Complete")
+            return max(1, int(self.workers_entry.get()))
+        except ValueError:
+            return 16
+
+    def download_task(self, packs: List[Dict], resume: Optional[JobState] = None):
+        """This downloads the snapshotted pack options through the download engine. Skips the files the journaled
+        job resume already downloaded when given."""
+        try:
+            unresolved = []  # Names of packs whose asset ids could not be fetched
+            for pack in packs:  # Wait for packs that were queued before their asset ids were resolved
+                if isinstance(pack['asset_ids'], Future):
+                    self.post_status(f"Resolving {pack['name']}...")
+                    future = pack['asset_ids']
+                    error = future.exception()
+                    asset_ids = None if error else future.result()
+                    if asset_ids is None:
+                        logger.error(f"Error resolving {pack['name']}, not downloading it"
+                                     + (f": {error}" if error else ""))
+                        unresolved.append(pack['name'])
+                    else:
+                        pack['asset_ids'] = list(asset_ids)
+            packs = [pack for pack in packs if not isinstance(pack['asset_ids'], Future)]
+            engine = DownloadEngine(self.client, self.save_path, self.worker_count, self.durable_writes,
+                                    self.archive_mode, self._stop_flag, self.journal,
+                                    on_status=self.post_status, on_progress=self.post_progress)
+            finished = engine.run(packs, resume)
+            if engine.failed:
+                logger.warning("Restart gimmich to resume the download and retry the failed files")
+            if unresolved and finished:
+                self.post_status(f"Download finished, {len(unresolved)} packs could not be resolved: "
+                                 f"{', '.join(unresolved)}")
 
         except Exception as e:
-            print(f"Unexpected error Downloading: {e}")
+            logger.error(f"Unexpected error Downloading: {e}")
 
         finally:
-            self.download_progressbar.set(0)  # Reset progress bar
-            self.download_progressbar.stop()
-            self.download_button.configure(state="normal")  # Re-enable upload button
             self._stop_flag.clear()  # Reset the flag for the next upload
-            self.login_frame.update_login_info()
+            self.dispatcher.post(self.finish_download)
+            logger.debug(f"Connection reuse: {self.client.connection_stats()}")
+            logger.debug(f"Asset info cache: {self.client.asset_cache.stats()}")
+            logger.debug(f"Concurrency: {self.client.request_limiter.stats()}")
         print("Download Completed!")
 
-    def process_options(self, child, id: str):
-        """Process download packs and their options"""
-        image = self.client.download_asset(id)
-        filename = self.client.get_original_filename(id)
-
-        with open(f"{self.composed_save_path}/{filename}", "wb") as file:
-            file.write(image.getvalue())
-
-        if child.caption_type_var.get() == 0:  # Write caption files based on pack options
-            pass
-        elif child.caption_type_var.get() == 1:
-            self.write_description_caption(id, filename)
-        elif child.caption_type_var.get() == 2:
-            self.write_tag_caption(id, filename)
-
-    def write_tag_caption(self, id: str, filename: str):
-        """Takes an assetId and filename string and writes a caption file based on the tags"""
-        tags = self.client.get_asset_tags(id)
-        tag_string = ", ".join(tag['value'] for tag in tags if 'value' in tag)
-        base_filename = os.path.splitext(filename)[0]
-        with open(f"{self.composed_save_path}/{base_filename}.txt", "w") as file:
-            file.write(tag_string)
-
-    def write_description_caption(self, id, filename):
-        """Takes an assetId and filename string and writes a caption file based on the description"""
-        description = self.client.get_asset_description(id)
-        base_filename = os.path.splitext(filename)[0]
-        with open(f"{self.composed_save_path}/{base_filename}.txt", "w") as file:
-            file.write(description)
+    def finish_download(self):
+        """Resets the download controls once the download thread is done"""
+        self.download_progressbar.set(0)  # Reset progress bar
+        self.download_progressbar.stop()
+        self.download_button.configure(state="normal")  # Re-enable upload button
+        self.login_frame.update_login_info()
+
+    def post_status(self, text: str):
+        """Queues a status line from the download thread, only the latest one per frame is drawn"""
+        self.dispatcher.post(self.progressbar_status.set, text, key=(self, "status"))
+
+    def post_progress(self, stage: str, done: int, total: int):
+        """Queues a progress update from the download thread, only the latest one per frame is drawn"""
+        self.dispatcher.post(self.update_progress, stage, done, total, key=(self, "progress"))
+
+    def update_progress(self, stage: str, done: int, total: int):
+        """Moves the progressbar for whichever stage the download engine is in"""
+        self.download_progressbar.set(done / total if total else 0)
 
     def select_path(self):
         """Open file dialog to select a path"""
@@ -149,7 +185,8 @@ class DownloadFrame(ctk.CTkFrame):
 
 class AddPackDownloadFrame(ctk.CTkFrame):
     """This contains the download pack and its options"""
-    def __init__(self, parent: ctk.CTkScrollableFrame, name: str, thumb: ctk.CTkImage, asset_ids: List, color: str):
+    def __init__(self, parent: ctk.CTkScrollableFrame, name: str, thumb: ctk.CTkImage, asset_ids: Union[List, Future],
+                 color: str, dispatcher: UiDispatcher):
         super().__init__(parent, border_width=2, border_color="gray", fg_color=color)
         for row in range(1):
             self.rowconfigure(row, weight=1)
@@ -162,6 +199,11 @@ class AddPackDownloadFrame(ctk.CTkFrame):
         self.thumbnail_label.grid(row=0, column=0, padx=2, pady=0)
         self.name_label = ctk.CTkLabel(self, text=self.name)
         self.name_label.grid(row=0, column=1, padx=2, pady=0, sticky="ew")
+        if isinstance(asset_ids, Future):  # Show the count once the asset ids are resolved
+            self.name_label.configure(text=f"{self.name} (resolving...)")
+            asset_ids.add_done_callback(lambda future: dispatcher.post(self.show_resolved, future))
+        else:
+            self.name_label.configure(text=f"{self.name} ({len(asset_ids)})")
         self.options_button = ctk.CTkButton(self, text="...", command=self.options, corner_radius=0, width=10)
         self.options_button.grid(row=0, column=2, padx=2, pady=0)
         self.remove_pack_button = ctk.CTkButton(self, text="Remove", command=self.remove_download_pack, corner_radius=0)
@@ -172,6 +214,27 @@ class AddPackDownloadFrame(ctk.CTkFrame):
         self.caption_type_var = tkinter.IntVar(value=0)
         self.user_directory = tkinter.StringVar(value="")
 
+    def show_resolved(self, future: Future):
+        """Swaps in the resolved asset ids and shows how many there are"""
+        if future.exception():
+            logger.warning(f"Could not resolve {self.name}: {future.exception()}")
+            self.asset_ids = []
+        else:
+            self.asset_ids = list(future.result())
+        if self.winfo_exists():
+            self.name_label.configure(text=f"{self.name} ({len(self.asset_ids)})")
+
+    def get_options(self) -> Dict:
+        """Returns the pack and its options as a plain dict so downloads don't touch tkinter from worker threads.
+        asset_ids is still a Future if the pack hasn't been resolved yet."""
+        return {
+            'name': self.name,
+            'asset_ids': self.asset_ids if isinstance(self.asset_ids, Future) else list(self.asset_ids),
+            'directory_type': self.directory_type_var.get(),
+            'user_directory': self.user_directory.get(),
+            'caption_type': self.caption_type_var.get()
+        }
+
     def options(self):
         """This opens a pop up window to configure the packs options."""
         options_window = ctk.CTkToplevel(self)
@@ -0,0 +1,172 @@
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+from modules.api_client import ImmichClient
+from modules.asset_cache import AssetInfo
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # Queue sentinel marking the end of a stage
+_FAILED = object()  # Passed down in place of an item that failed, so the writer still counts it for progress
+
+
+def pack_directory(save_path: str, pack: Dict) -> str:
+    """Returns the directory a pack downloads into based on its directory option, creating it if needed"""
+    if pack['directory_type'] == 1:
+        directory = f"{save_path}/{pack['name']}"
+    elif pack['directory_type'] == 2:
+        directory = f"{save_path}/{pack['user_directory']}"
+    else:
+        return save_path
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def write_caption(directory: str, info: AssetInfo, caption_type: int):
+    """Writes the caption file for a downloaded asset, from its description (1) or its tags (2)"""
+    if caption_type == 1:
+        caption = info.description or ""
+    elif caption_type == 2:
+        caption = ", ".join(tag['value'] for tag in info.tags if 'value' in tag)
+    else:
+        return
+    base_filename = os.path.splitext(info.original_filename)[0]
+    with open(f"{directory}/{base_filename}.txt", "w") as file:
+        file.write(caption)
+
+
+class DownloadPipeline:
+    """Downloads packs of assets as three overlapping stages joined by bounded queues: metadata lookups, byte
+    transfers streamed into temp files, and a writer that moves finished files into place and writes captions.
+    Each pack is a dict of name, asset_ids, directory_type, user_directory and caption_type."""
+    def __init__(self, client: ImmichClient, save_path: str, workers: int = 4, durable: bool = False,
+                 stop_flag: Optional[threading.Event] = None,
+                 on_progress: Optional[Callable[[int, int], None]] = None,
+                 on_asset_done: Optional[Callable[[int, str], None]] = None):
+        self.client = client
+        self.save_path = save_path
+        self.workers = workers
+        self.durable = durable
+        self.stop_flag = stop_flag or threading.Event()
+        self.on_progress = on_progress  # Called with (files done or failed, total) from the writer thread
+        self.on_asset_done = on_asset_done  # Called with (pack index, asset id) once a file is in place
+        self.completed = 0
+        self.failed = 0
+        self._failed_lock = threading.Lock()
+
+    def run(self, packs: List[Dict]) -> int:
+        """Downloads every asset of every pack, returning the number of files written"""
+        total = sum(len(pack['asset_ids']) for pack in packs)
+        metadata_queue = queue.Queue(maxsize=self.workers * 4)
+        transfer_queue = queue.Queue(maxsize=self.workers * 2)
+        write_queue = queue.Queue(maxsize=self.workers * 2)
+
+        def feed():
+            """Queues every asset along with the directory and caption option of its pack"""
+            try:
+                for pack_index, pack in enumerate(packs):
+                    if self.stop_flag.is_set():
+                        return
+                    directory = pack_directory(self.save_path, pack)
+                    for asset_id in pack['asset_ids']:
+                        if self.stop_flag.is_set():
+                            return
+                        metadata_queue.put((pack_index, directory, pack['caption_type'], asset_id))
+            finally:
+                for _ in range(self.workers):
+                    metadata_queue.put(_DONE)
+
+        def fetch_metadata(item):
+            pack_index, directory, caption_type, asset_id = item
+            info = self.client.get_asset_info(asset_id)
+            if info is None or not info.original_filename:
+                raise ValueError(f"No metadata for asset {asset_id}")
+            return pack_index, directory, caption_type, info
+
+        def transfer(item):
+            pack_index, directory, caption_type, info = item
+            writer = self.client.download_asset_to_writer(info.id, f"{directory}/{info.original_filename}",
+                                                          durable=self.durable)
+            if writer is None:
+                raise ValueError(f"Transfer failed for asset {info.id}")
+            return pack_index, directory, caption_type, info, writer
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += self._stage(fetch_metadata, metadata_queue, transfer_queue, self.workers, self.workers)
+        threads += self._stage(transfer, transfer_queue, write_queue, self.workers, 1)
+        for thread in threads:
+            thread.start()
+        self._write(write_queue, total)
+        for thread in threads:
+            thread.join()
+        return self.completed
+
+    def _stage(self, func: Callable, input_queue: queue.Queue, output_queue: queue.Queue, count: int,
+               downstream_workers: int) -> List[threading.Thread]:
+        """Builds count threads that apply func to items from input_queue. The last thread to finish passes one end
+        marker per downstream worker along."""
+        remaining = [count]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                item = input_queue.get()
+                if item is _DONE:
+                    break
+                if item is _FAILED:
+                    output_queue.put(item)
+                    continue
+                if self.stop_flag.is_set():
+                    self._discard(item)
+                    continue
+                try:
+                    output_queue.put(func(item))
+                except Exception as e:
+                    with self._failed_lock:
+                        self.failed += 1
+                    logger.error(f"Error downloading: {e}")
+                    output_queue.put(_FAILED)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(downstream_workers):
+                    output_queue.put(_DONE)
+
+        return [threading.Thread(target=work, daemon=True) for _ in range(count)]
+
+    def _write(self, write_queue: queue.Queue, total: int):
+        """Final stage, run on the calling thread: commits each file to its final name and writes its caption"""
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                break
+            if item is _FAILED:  # Counted as failed by the stage it failed in
+                if self.on_progress:
+                    self.on_progress(self.completed + self.failed, total)
+                continue
+            if self.stop_flag.is_set():
+                self._discard(item)
+                continue
+            pack_index, directory, caption_type, info, writer = item
+            try:
+                writer.commit()
+                write_caption(directory, info, caption_type)
+                self.completed += 1
+                if self.on_asset_done:
+                    self.on_asset_done(pack_index, info.id)
+            except Exception as e:
+                with self._failed_lock:
+                    self.failed += 1
+                logger.error(f"Error writing {info.original_filename}: {e}")
+            if self.on_progress:
+                self.on_progress(self.completed + self.failed, total)
+
+    @staticmethod
+    def _discard(item):
+        """Drops a queued item after a stop, removing any temp file it holds"""
+        writer = item[-1] if isinstance(item, tuple) else None
+        if hasattr(writer, 'abort'):
+            writer.abort()
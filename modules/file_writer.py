@@ -0,0 +1,87 @@
+import os
+import tempfile
+from typing import Optional
+
+
+def _current_umask() -> int:
+    """Returns the process umask, which can only be read by setting it"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_FILE_MODE = 0o666 & ~_current_umask()  # What open() would give a new file, mkstemp makes it owner only
+
+class AtomicFileWriter:
+    """Writes a file through a temp file in the destination directory and renames it into place on commit, so a
+    partially written file never appears under its final name."""
+    def __init__(self, path: str, size: Optional[int] = None, durable: bool = False,
+                 buffer_size: int = 1024 * 1024, fsync_interval: int = 64 * 1024 * 1024):
+        self.path = path
+        self.durable = durable  # When set, data is fsynced in batches and again before the rename
+        self.fsync_interval = fsync_interval
+        self.bytes_written = 0
+        self._unsynced = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(prefix=".gimmich-", suffix=".part", dir=directory)
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, _FILE_MODE)  # The rename keeps this mode, so the final file respects the umask
+        self._file = os.fdopen(fd, "wb", buffering=buffer_size)
+        if size:
+            self._preallocate(fd, size)
+
+    @staticmethod
+    def _preallocate(fd: int, size: int):
+        """Reserves the full file size up front where the platform supports it to limit fragmentation"""
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                pass  # Not supported by this filesystem, the file simply grows as it is written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def _sync(self):
+        """Flushes buffered data and forces it to disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def write(self, data: bytes):
+        """Writes a chunk, fsyncing once every fsync_interval bytes in durable mode"""
+        self._file.write(data)
+        self.bytes_written += len(data)
+        if self.durable:
+            self._unsynced += len(data)
+            if self._unsynced >= self.fsync_interval:
+                self._sync()
+
+    def commit(self):
+        """Finishes the file and atomically moves it to its final path"""
+        self._file.flush()
+        self._file.truncate(self.bytes_written)  # Drop any preallocated space that was not written
+        if self.durable:
+            self._sync()
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+        if self.durable and hasattr(os, "O_DIRECTORY"):  # Persist the rename itself
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def abort(self):
+        """Discards the partially written temp file"""
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
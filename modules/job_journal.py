@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from modules.app_paths import data_dir
+
+
+class JobState:
+    """What a journal says about an unfinished job: its plan, the items already transferred and the post processing
+    steps already run"""
+    def __init__(self, server: str, options: Dict, items: List, done: Dict[int, Dict], steps: Set[str],
+                 created: float):
+        self.server = server
+        self.options = options
+        self.items = items
+        self.done = done  # item index -> data recorded when it finished
+        self.steps = steps
+        self.created = created
+
+
+class JobJournal:
+    """Append-only JSON lines journal of one kind of job, kept in the data directory. A job writes its plan first,
+    then one line per finished item and per finished post processing step, and the file is removed once the job
+    completes. A journal that still exists at startup belongs to a job that was interrupted."""
+    def __init__(self, kind: str, path: Optional[str] = None, fsync_every: int = 256):
+        self.kind = kind
+        self.path = path or os.path.join(data_dir(), f"{kind}_journal.jsonl")
+        self.fsync_every = fsync_every  # Records between fsyncs, steps and the plan are always synced
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[JobState]:
+        """Returns the state of an interrupted job, or None if there is none. A torn last line from a crash
+        mid-write is ignored."""
+        if not os.path.exists(self.path):
+            return None
+        state = None
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get('type') == "plan":
+                    state = JobState(record['server'], record['options'], record['items'], {}, set(),
+                                     record.get('created', 0))
+                elif state is None:
+                    continue
+                elif record['type'] == "done":
+                    state.done[record['item']] = record.get('data', {})
+                elif record['type'] == "step":
+                    state.steps.add(record['name'])
+        return state
+
+    def start(self, server: str, options: Dict, items: List):
+        """Begins a new job, replacing any previous journal, and records its plan"""
+        self.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._write({'type': "plan", 'server': server, 'created': time.time(), 'options': options, 'items': items},
+                    sync=True)
+
+    def resume(self):
+        """Reopens the journal of an interrupted job for appending, dropping a torn last line first"""
+        self.close()
+        with open(self.path, "rb+") as file:
+            data = file.read()
+            file.truncate(data.rfind(b"\n") + 1)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def record_done(self, item: int, **data: Any):
+        """Records that the item at index item finished, along with anything needed to pick up after it"""
+        self._write({'type': "done", 'item': item, 'data': data})
+
+    def record_step(self, name: str):
+        """Records that a post processing step finished"""
+        self._write({'type': "step", 'name': name}, sync=True)
+
+    def complete(self):
+        """Marks the job finished by removing its journal"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def discard(self):
+        """Forgets an interrupted job"""
+        self.complete()
+
+    def close(self):
+        """Flushes and closes the journal, leaving it on disk"""
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _write(self, record: Dict, sync: bool = False):
+        """Appends a record, flushing it to the OS straight away and to disk every fsync_every records"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if sync or self._unsynced >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        """Forces written records to disk"""
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
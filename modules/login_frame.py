@@ -1,12 +1,19 @@
+import logging
+import threading
+from typing import Callable, List
 import customtkinter as ctk
 from modules.api_client import ImmichClient
+from modules.ui_dispatcher import UiDispatcher
+
+logger = logging.getLogger(__name__)
 
 
 class LoginFrame(ctk.CTkFrame):
     """This frame holds the login info fields and displays the asset information."""
-    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient):
+    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient, dispatcher: UiDispatcher):
         super().__init__(parent)
         self.client = client
+        self.dispatcher = dispatcher
 
         for col in range(1):
             self.columnconfigure(col, weight=1)  # Even column widths
@@ -41,7 +48,9 @@ class LoginFrame(ctk.CTkFrame):
         self.immich_total_asset_label = ctk.CTkLabel(self, textvariable=self.immich_total_asset_status)
         self.immich_total_asset_label.grid(row=7, column=0, padx=5, pady=5, sticky="ew")
 
-        self.update_login_info()  # Update the displayed information.
+        self.login_listeners: List[Callable[[], None]] = []  # Called on the UI thread when the login changes
+        self._shown_login = None  # Login the listeners were last told about
+        self.update_login_info(load_saved=True)  # Check the saved login in the background
 
     def login_action(self):
         """Gets the entered url and token and validates them by grabbing API info"""
@@ -50,7 +59,7 @@ class LoginFrame(ctk.CTkFrame):
             self.client.token = self.login_key.get()
             self.update_login_info()
         except Exception as e:
-            print(f"Unexpected error logging in: {e}")
+            logger.error(f"Unexpected error logging in: {e}")
 
     def logout_action(self):
         """Clears the entered url and token, deletes the securely stored credentials, then validates against the
@@ -60,10 +69,30 @@ class LoginFrame(ctk.CTkFrame):
         self.client.delete_credentials()
         self.update_login_info()
 
-    def update_login_info(self):
-        """Attempts to get the users immich statistics and username"""
-        self.client.get_asset_statistics()
-        self.client.get_my_user()
+    def update_login_info(self, load_saved: bool = False):
+        """Shows a loading state and checks the users immich statistics and username in the background, loading the
+        saved credentials first if load_saved is set"""
+        self.login_button.configure(state="disabled")
+        self.logged_in_status.set("Logged in: Checking...")
+        self.immich_total_asset_status.set("Image:... Video:... Total:...")
+        if load_saved:
+            self.immich_user_status.set("User: Loading...")
+            self.immich_url_status.set("URL: Loading...")
+        threading.Thread(target=self.check_login_task, args=(load_saved,), daemon=True).start()
+
+    def check_login_task(self, load_saved: bool):
+        """Loads the login info off the UI thread, then hands it back to show it"""
+        try:
+            if load_saved:
+                self.client.load_credentials()
+            self.client.get_asset_statistics()
+            self.client.get_my_user()
+        except Exception as e:
+            logger.error(f"Unexpected error checking login: {e}")
+        self.dispatcher.post(self.show_login_info)
+
+    def show_login_info(self):
+        """Displays the users immich statistics and username and tells the listeners if the login changed"""
         if self.client.logged_in:
             self.login_button.configure(state="disabled")
             print(f"Logged in as {self.client.user}")
@@ -78,3 +107,8 @@ class LoginFrame(ctk.CTkFrame):
         self.immich_total_asset_status.set(f"Image:{self.client.asset_count['images']} "
                                            f"Video:{self.client.asset_count['videos']} "
                                            f"Total:{self.client.asset_count['total']}")
+        login = (self.client.logged_in, self.client.base_url, self.client.user)
+        if login != self._shown_login:
+            self._shown_login = login
+            for listener in self.login_listeners:
+                listener()
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from modules.app_paths import data_dir
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = tuple(0.001 * 2 ** (step / 2) for step in range(37))  # 1ms to about 4 minutes, each sqrt(2) wider
+_ID_SEGMENT = re.compile(r"/(?:[0-9a-fA-F-]{16,}|\d+)(?=/|$)")  # Asset, album, tag and person ids in a path
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """Returns the endpoint a request went to with the ids in its path replaced, like GET /api/assets/{id}/original,
+    so requests for different assets add up"""
+    return f"{method.upper()} {_ID_SEGMENT.sub('/{id}', urlsplit(url).path)}"
+
+
+def quantile(buckets: List[int], q: float) -> Optional[float]:
+    """Estimates a latency quantile in seconds from histogram bucket counts, interpolating inside the bucket it falls
+    in. Returns None if nothing was observed."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else lower  # Past the last bucket
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+def _escape(value: str) -> str:
+    """Escapes a Prometheus label value"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class TransferMetrics:
+    """Thread safe instrumentation shared by the client and the engines: request count, errors, retries, body bytes
+    and a latency histogram per endpoint, time spent in each job stage and files finished. Counters only ever grow,
+    a job is summarized from the difference of two snapshots. Set prometheus_path, or GIMMICH_PROMETHEUS_FILE, to
+    also export them in the Prometheus text format for the node exporter textfile collector."""
+    def __init__(self, prometheus_path: Optional[str] = None, export_interval: float = 15.0):
+        self.prometheus_path = prometheus_path or os.environ.get("GIMMICH_PROMETHEUS_FILE")
+        self.export_interval = export_interval  # Fewest seconds between exports while a job runs
+        self._endpoints: Dict[str, Dict] = {}  # endpoint -> counters and latency bucket counts
+        self._stages: Dict[str, List[float]] = {}  # stage -> [runs, seconds]
+        self._files: Dict[str, int] = {}  # job kind -> files finished
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def add_files(self, kind: str, count: int = 1):
+        """Counts files a job finished, exporting now and then so a scrape sees a long job progress"""
+        with self._lock:
+            self._files[kind] = self._files.get(kind, 0) + count
+            due = self.prometheus_path and time.monotonic() - self._last_export >= self.export_interval
+            if due:
+                self._last_export = time.monotonic()
+        if due:
+            self.export_prometheus()
+
+    def export_prometheus(self, path: Optional[str] = None):
+        """Writes every counter to path, or prometheus_path, replacing the file atomically so a scrape never reads
+        half of it"""
+        path = path or self.prometheus_path
+        if not path:
+            return
+        try:
+            temporary_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                file.write(self.prometheus_text())
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.warning(f"Could not export metrics to {path}: {e}")
+
+    def finish_job(self, kind: str, start: Dict) -> Dict:
+        """Summarizes a job from the snapshot taken when it started, writes the summary as JSON to the metrics
+        directory and exports the counters. Returns the summary."""
+        summary = dict(self.summarize(start, self.snapshot()), job=kind, finished=datetime.now().isoformat())
+        path = self.write_summary(kind, summary)
+        self.export_prometheus()
+        print(f"{kind.capitalize()} took {summary['duration']:.1f}s, {summary['files_per_second']:.1f} files/s, "
+              f"{summary['bytes_sent'] / 1048576:.1f} MB sent, {summary['bytes_received'] / 1048576:.1f} MB "
+              f"received, {summary['retries']} retries" + (f", summary in {path}" if path else ""))
+        return summary
+
+    def prometheus_text(self) -> str:
+        """Returns every counter in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name: str, kind: str, help_text: str, samples: List[str]):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples)
+
+        endpoints = sorted(snapshot['endpoints'].items())
+        for field, name, help_text in (("requests", "requests", "Requests sent"),
+                                       ("errors", "request_errors", "Requests that failed or got an error status"),
+                                       ("retries", "request_retries", "Requests sent again after a failure"),
+                                       ("bytes_sent", "request_sent_bytes", "Request body bytes sent"),
+                                       ("bytes_received", "request_received_bytes", "Response body bytes received")):
+            family(f"gimmich_{name}_total", "counter", f"{help_text}, by endpoint",
+                   [f"gimmich_{name}_total{{endpoint=\"{_escape(endpoint)}\"}} {stats[field]}"
+                    for endpoint, stats in endpoints])
+        samples = []
+        for endpoint, stats in endpoints:
+            label = f"endpoint=\"{_escape(endpoint)}\""
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+                cumulative += count
+                samples.append(f"gimmich_request_duration_seconds_bucket{{{label},le=\"{bound:.6g}\"}} {cumulative}")
+            samples.append(f"gimmich_request_duration_seconds_bucket{{{label},le=\"+Inf\"}} {sum(stats['buckets'])}")
+            samples.append(f"gimmich_request_duration_seconds_sum{{{label}}} {stats['seconds']:.6f}")
+            samples.append(f"gimmich_request_duration_seconds_count{{{label}}} {sum(stats['buckets'])}")
+        family("gimmich_request_duration_seconds", "histogram", "Time until the response headers arrived, by endpoint",
+               samples)
+        stages = sorted(snapshot['stages'].items())
+        family("gimmich_stage_seconds_total", "counter", "Time spent in each job stage",
+               [f"gimmich_stage_seconds_total{{stage=\"{_escape(stage)}\"}} {seconds:.6f}"
+                for stage, (_, seconds) in stages])
+        family("gimmich_stage_runs_total", "counter", "Times each job stage ran",
+               [f"gimmich_stage_runs_total{{stage=\"{_escape(stage)}\"}} {runs}" for stage, (runs, _) in stages])
+        family("gimmich_files_total", "counter", "Files finished, by job kind",
+               [f"gimmich_files_total{{kind=\"{_escape(kind)}\"}} {count}"
+                for kind, count in sorted(snapshot['files'].items())])
+        return "\n".join(lines) + "\n"
+
+    def record_received(self, endpoint: str, bytes_received: int):
+        """Adds the body bytes of a streamed response once it has been read"""
+        with self._lock:
+            self._endpoint(endpoint)['bytes_received'] += bytes_received
+
+    def record_request(self, endpoint: str, seconds: float, bytes_sent: int = 0, bytes_received: int = 0,
+                       error: bool = False):
+        """Counts one attempt at a request along with its latency and body sizes"""
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)  # First bucket whose bound is at least seconds
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['requests'] += 1
+            stats['errors'] += error
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['seconds'] += seconds
+            stats['buckets'][bucket] += 1
+
+    def record_retry(self, endpoint: str):
+        """Counts a request that is about to be sent again"""
+        with self._lock:
+            self._endpoint(endpoint)['retries'] += 1
+
+    def snapshot(self) -> Dict:
+        """Returns a copy of every counter along with when it was taken"""
+        with self._lock:
+            return {
+                'time': time.monotonic(),
+                'endpoints': {endpoint: dict(stats, buckets=list(stats['buckets']))
+                              for endpoint, stats in self._endpoints.items()},
+                'stages': {stage: list(totals) for stage, totals in self._stages.items()},
+                'files': dict(self._files)
+            }
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the enclosed block as a run of a job stage"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                totals = self._stages.setdefault(name, [0, 0.0])
+                totals[0] += 1
+                totals[1] += time.monotonic() - start
+
+    @staticmethod
+    def summarize(start: Dict, end: Dict) -> Dict:
+        """Returns what happened between two snapshots as a JSON friendly dict, with latency percentiles per
+        endpoint"""
+        duration = max(end['time'] - start['time'], 1e-9)
+        endpoints = {}
+        for endpoint, stats in end['endpoints'].items():
+            before = start['endpoints'].get(endpoint)
+            if before is not None:
+                stats = {field: [count - earlier for count, earlier in zip(value, before['buckets'])]
+                         if field == 'buckets' else value - before[field] for field, value in stats.items()}
+            if not stats['requests'] and not stats['bytes_received']:
+                continue
+            endpoints[endpoint] = {
+                'requests': stats['requests'], 'errors': stats['errors'], 'retries': stats['retries'],
+                'bytes_sent': stats['bytes_sent'], 'bytes_received': stats['bytes_received'],
+                'mean': round(stats['seconds'] / stats['requests'], 4) if stats['requests'] else None
+            }
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                value = quantile(stats['buckets'], q)
+                endpoints[endpoint][name] = None if value is None else round(value, 4)
+        stages = {}
+        for stage, (runs, seconds) in end['stages'].items():
+            earlier_runs, earlier_seconds = start['stages'].get(stage, (0, 0.0))
+            if runs - earlier_runs:
+                stages[stage] = {'runs': runs - earlier_runs, 'seconds': round(seconds - earlier_seconds, 3)}
+        files = {kind: count - start['files'].get(kind, 0) for kind, count in end['files'].items()
+                 if count - start['files'].get(kind, 0)}
+        return {
+            'duration': round(duration, 3),
+            'files': files,
+            'files_per_second': round(sum(files.values()) / duration, 2),
+            'requests': sum(stats['requests'] for stats in endpoints.values()),
+            'errors': sum(stats['errors'] for stats in endpoints.values()),
+            'retries': sum(stats['retries'] for stats in endpoints.values()),
+            'bytes_sent': sum(stats['bytes_sent'] for stats in endpoints.values()),
+            'bytes_received': sum(stats['bytes_received'] for stats in endpoints.values()),
+            'stages': stages,
+            'endpoints': endpoints
+        }
+
+    @staticmethod
+    def write_summary(kind: str, summary: Dict, keep: int = 100) -> Optional[str]:
+        """Writes a job summary to the metrics directory, keeping the newest keep summaries. Returns its path."""
+        directory = os.path.join(data_dir(), "metrics")
+        path = os.path.join(directory, datetime.now().strftime(f"{kind}_%Y-%m-%d_%H-%M-%S.json"))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=2)
+            summaries = sorted(os.listdir(directory), key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+            for name in summaries[:-keep]:
+                os.remove(os.path.join(directory, name))
+        except OSError as e:
+            logger.warning(f"Could not write metrics summary: {e}")
+            return None
+        return path
+
+    def _endpoint(self, endpoint: str) -> Dict:
+        """Returns the counters of an endpoint, creating them on first use. Call with the lock held."""
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = {'requests': 0, 'errors': 0, 'retries': 0, 'bytes_sent': 0, 'bytes_received': 0, 'seconds': 0.0,
+                     'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            self._endpoints[endpoint] = stats
+        return stats
@@ -0,0 +1,71 @@
+import os
+import uuid
+from typing import Dict
+
+
+def _quote(value: str) -> str:
+    """Escapes a form-data header parameter the same way urllib3 does"""
+    return value.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartFileEncoder:
+    """A read-only file-like multipart/form-data body. The form fields are encoded up front, the file part is
+    read from disk in chunks as the connection asks for it, so memory use is constant whatever the file size."""
+    def __init__(self, fields: Dict[str, str], file_field: str, file_path: str, filename: str, mime_type: str):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        preamble = b""
+        for name, value in fields.items():
+            preamble += (f"--{self.boundary}\r\n"
+                         f"Content-Disposition: form-data; name=\"{_quote(name)}\"\r\n\r\n"
+                         f"{value}\r\n").encode()
+        preamble += (f"--{self.boundary}\r\n"
+                     f"Content-Disposition: form-data; name=\"{_quote(file_field)}\"; "
+                     f"filename=\"{_quote(filename)}\"\r\n"
+                     f"Content-Type: {mime_type}\r\n\r\n").encode()
+        epilogue = f"\r\n--{self.boundary}--\r\n".encode()
+        self._file = open(file_path, "rb")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self._parts = [preamble, self._file, epilogue]
+        self._part_index = 0
+        self._part_offset = 0
+        self.len = len(preamble) + self._file_size + len(epilogue)  # Precomputed Content-Length
+
+    def __len__(self):
+        return self.len
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the underlying file handle"""
+        self._file.close()
+
+    def read(self, size: int = -1) -> bytes:
+        """Returns up to size bytes of the encoded body, or the rest of it when size is negative"""
+        output = bytearray()
+        while self._part_index < len(self._parts) and (size < 0 or len(output) < size):
+            remaining = -1 if size < 0 else size - len(output)
+            part = self._parts[self._part_index]
+            if isinstance(part, bytes):
+                end = len(part) if remaining < 0 else self._part_offset + remaining
+                chunk = part[self._part_offset:end]
+                self._part_offset += len(chunk)
+                exhausted = self._part_offset >= len(part)
+            else:
+                chunk = part.read(remaining)
+                exhausted = not chunk or (remaining < 0)
+            output += chunk
+            if exhausted:
+                self._part_index += 1
+                self._part_offset = 0
+        return bytes(output)
+
+    def rewind(self):
+        """Restarts the body from the beginning so the same encoder can be sent again"""
+        self._file.seek(0)
+        self._part_index = 0
+        self._part_offset = 0
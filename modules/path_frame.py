@@ -1,13 +1,6 @@
-import os
 import customtkinter as ctk
 from tkinter import filedialog
-
-allowed_extensions = ['.3fr', '.ari', '.arw', '.cap', '.cin', '.cr2', '.cr3', '.crw', '.dcr', '.dng', '.erf', '.fff',
-                      '.iiq', '.k25', '.kdc', '.mrw', '.nef', '.nrw', '.orf', '.ori', '.pef', '.psd', '.raf', '.raw',
-                      '.rw2', '.rwl', '.sr2', '.srf', '.srw', '.x3f', '.avif', '.bmp', '.gif', '.heic', '.heif', '.hif',
-                      '.insp', '.jpe', '.jpeg', '.jpg', '.jxl', '.png', '.svg', '.tif', '.tiff', '.webp', '.3gp',
-                      '.3gpp', '.avi', '.flv', '.insv', '.m2ts', '.m4v', '.mkv', '.mov', '.mp4', '.mpe', '.mpeg',
-                      '.mpg', '.mts', '.vob', '.webm', '.wmv']
+from modules.upload_engine import list_files
 
 
 class PathFrame(ctk.CTkFrame):
@@ -46,35 +39,10 @@ class PathFrame(ctk.CTkFrame):
         self.path_list = [path for path in self.path_list if path != name]
 
     def get_files_from_paths(self, recursive=False):
-        """Return a list of the files from the paths, optionally recursively."""
-        self.file_list = []
-        for path in self.path_list:
-            if os.path.isdir(path):  # Check if the path is a directory
-                if recursive:  # If recursive, traverse directories using os.walk
-                    for root, _, filenames in os.walk(path):
-                        for filename in filenames:
-                            file_path = os.path.join(root, filename)
-                            if os.path.isfile(file_path):  # Only add files
-                                self.file_list.append(file_path)
-                else:  # Non-recursive: only list files in the current directory
-                    for filename in os.listdir(path):
-                        file_path = os.path.join(path, filename)
-                        if os.path.isfile(file_path):  # Only add files
-                            self.file_list.append(file_path)
-            elif os.path.isfile(path):  # If it's a file, add it directly
-                self.file_list.append(path)
-
-        self.filter_files_by_extension()
+        """Return a list of the uploadable files from the paths, optionally recursively."""
+        self.filtered_file_list = list_files(self.path_list, recursive)
         return self.filtered_file_list
 
-    def filter_files_by_extension(self):
-        """Remove any files from the list that don't match the allowed extension types."""
-        filtered_files = []
-        for file in self.file_list:
-            if any(file.lower().endswith(ext.lower()) for ext in allowed_extensions):
-                filtered_files.append(file)
-        self.filtered_file_list = filtered_files
-
 
 class AddPackUploadFrame(ctk.CTkFrame):
     """This frame contains the upload pack"""
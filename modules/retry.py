@@ -0,0 +1,115 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import requests
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}  # Safe to send twice unless a call says otherwise
+RETRY_STATUSES = {408, 429, 502, 503, 504}  # Responses worth another attempt, a plain 500 is likely to repeat
+OVERLOAD_STATUSES = {429, 502, 503, 504}  # The server or its proxy is overloaded or down, counted by the breaker
+REJECTED_STATUSES = {429, 503}  # The server turned the request away unprocessed, so even a POST can be resent
+
+
+class RetryPolicy:
+    """Decides whether a failed attempt is retried and how long to wait first. Delays grow exponentially with full
+    jitter so concurrent workers spread their retries out instead of hitting the server in lockstep."""
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay  # Longest wait between attempts, Retry-After included
+
+    def should_retry(self, attempt: int, idempotent: bool, response: Optional[requests.Response] = None,
+                     error: Optional[Exception] = None) -> bool:
+        """Returns True if the attempt numbered attempt (from 1) failed in a way that is safe to try again"""
+        if attempt >= self.max_attempts:
+            return False
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True  # Never reached the server
+            return idempotent and isinstance(error, (requests.ConnectionError, requests.Timeout))
+        if response is None or response.status_code not in RETRY_STATUSES:
+            return False
+        return idempotent or response.status_code in REJECTED_STATUSES
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Returns the wait before the next attempt, using the servers Retry-After header when it sent one"""
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def retry_after(response: Optional[requests.Response]) -> Optional[float]:
+        """Parses a Retry-After header given either as seconds or as an HTTP date"""
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """Shared by every thread using the client. After failure_threshold consecutive failed attempts the circuit
+    opens and callers wait in before_request instead of adding load. Once the cooldown passes a single probe
+    request is let through: success closes the circuit and releases everyone, failure reopens it with a longer
+    cooldown."""
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 5, max_cooldown: float = 60):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"  # closed, open or half-open
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._condition = threading.Condition()
+
+    def before_request(self):
+        """Blocks while the circuit is open, letting one probe through when the cooldown is over"""
+        with self._condition:
+            while True:
+                if self.state == "closed":
+                    return
+                remaining = self._opened_at + self._cooldown - time.monotonic()
+                if remaining <= 0 and not self._probing:
+                    self.state = "half-open"
+                    self._probing = True
+                    return
+                self._condition.wait(timeout=remaining if remaining > 0 else None)
+
+    def record_success(self):
+        """Closes the circuit and wakes every waiting caller"""
+        with self._condition:
+            if self.state != "closed":
+                print("Server recovered, resuming requests")
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+            self._cooldown = self.base_cooldown
+            self._condition.notify_all()
+
+    def record_failure(self):
+        """Counts a failed attempt, opening the circuit at the threshold or reopening it after a failed probe"""
+        with self._condition:
+            self._failures += 1
+            if self.state == "half-open":
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+            elif self.state == "open" or self._failures < self.failure_threshold:
+                return
+            self.state = "open"
+            self._probing = False
+            self._opened_at = time.monotonic()
+            logger.warning(f"Server failing, pausing requests for {self._cooldown:.1f}s")
+            self._condition.notify_all()
@@ -1,17 +1,27 @@
 import threading
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Set
 import customtkinter as ctk
-from PIL import Image
 from modules.download_frame import DownloadFrame
 from modules.api_client import ImmichClient
+from modules.thumbnail_cache import ThumbnailCache
+from modules.ui_dispatcher import UiDispatcher
+from modules.virtual_grid import VirtualGrid
 
 
 class SmartAssetFrame(ctk.CTkFrame):
     """This frame displays the smart search results which can be added to the download queue"""
-    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient, download_frame: DownloadFrame):
+    def __init__(self, parent: ctk.CTkFrame, client: ImmichClient, download_frame: DownloadFrame,
+                 thumbnail_cache: ThumbnailCache, dispatcher: UiDispatcher):
         super().__init__(parent)
         self.parent = parent
         self.client = client
+        self.dispatcher = dispatcher
+        self.thumbnail_cache = thumbnail_cache
+        self.thumb_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="smart-thumbs")  # Bounded fetches
+        self.thumb_futures: List[Future] = []  # Outstanding thumbnail fetches of the current search
+        self.thumb_requested: Set[str] = set()  # Results of the current search whose thumbnails were asked for
+        self.search_generation = 0  # Bumped by every search so stale results and thumbnails are dropped
         self.download_frame = download_frame
 
         for col in range(1):  # Adjust rows and columns for stretching to fit
@@ -27,7 +37,8 @@ class SmartAssetFrame(ctk.CTkFrame):
         self.num_results_entry = ctk.CTkEntry(self, placeholder_text="20")
         self.num_results_entry.grid(row=1, column=1, padx=5, pady=5, sticky="e")
 
-        self.smart_results_frame = ctk.CTkScrollableFrame(self, label_text="Search results")  # Frame for search
+        self.smart_results_frame = VirtualGrid(self, self.create_result_tile, self.bind_result_tile, tile_width=120,
+                                               tile_height=130, label_text="Search results")  # Only visible tiles
         self.smart_results_frame.grid(row=2, column=0, padx=5, pady=5, sticky="nsew", columnspan=2)
 
         self.add_smart_pack_button = ctk.CTkButton(self, text="Add to download", command=self.add_smart_pack)
@@ -35,81 +46,95 @@ class SmartAssetFrame(ctk.CTkFrame):
         # self.scrollable_album_frame.columnconfigure(0, weight=1)
 
     def add_smart_pack(self):
-        asset_ids = []  # List to store asset IDs
-
-        # Iterate over all children in the smart_results_frame
-        for child in self.smart_results_frame.winfo_children():
-            if isinstance(child, SmartResultFrame):  # Ensure the child is a SmartResultFrame
-                asset_ids.append(child.asset_id)  # Collect the asset_id
-
+        asset_ids = self.smart_results_frame.items()  # Every result still in the grid, in order
+        if not asset_ids:
+            return
         name = self.search_entry.get()
-        thumb_data = self.client.view_asset(asset_ids[0])  # Get thumbnail data
-        thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(32, 32))
+        thumb = self.thumbnail_cache.get_or_blank(asset_ids[0])  # Get thumbnail
         self.download_frame.add_pack(name, thumb, asset_ids, "#565116")
 
     def start_search_thread(self):
-        threading.Thread(target=self.smart_search, daemon=True).start()
-
-    def smart_search(self):
-        query = self.search_entry.get()
+        """Starts a search, cancelling the thumbnail fetches still queued for the previous one"""
+        self.search_generation += 1
+        for future in self.thumb_futures:
+            future.cancel()
+        self.thumb_futures = []
+        self.thumb_requested = set()
+        query = self.search_entry.get()  # Read here, the search thread doesn't touch widgets
         num_results = self.num_results_entry.get()
+        threading.Thread(target=self.smart_search, args=(self.search_generation, query, num_results),
+                         daemon=True).start()
+
+    def smart_search(self, generation: int, query: str, num_results: str):
+        """Runs the search off the UI thread and hands the results back to be shown"""
         if num_results:
             asset_ids = self.client.search_smart(query, int(num_results))
         else:
             asset_ids = self.client.search_smart(query, 20)
-
-        # Clear previous results
-        for child in self.smart_results_frame.winfo_children():
-            child.destroy()
-
-        # Dynamically calculate the number of columns
-        tile_width = 120
-        available_width = self.smart_results_frame.winfo_width()
-        num_columns = max(1, available_width // tile_width)  # Ensure at least 1 column
-
-        for index, asset_id in enumerate(asset_ids):
-            thumb_data = self.client.view_asset(asset_id)  # Get thumbnail data
-            thumb = ctk.CTkImage(light_image=Image.open(thumb_data), size=(64, 64))  # Adjust thumbnail size as needed
-
-            # Create SmartResultFrame
-            result = SmartResultFrame(self.smart_results_frame, asset_id, thumb)
-
-            # Grid the result frame
-            row = index // num_columns
-            col = index % num_columns
-            result.grid(row=row, column=col, padx=5, pady=5)
-
-        # Adjust column configurations
-        for col in range(num_columns):
-            self.smart_results_frame.columnconfigure(col, weight=1)
+        self.dispatcher.post(self.show_results, generation, asset_ids or [])
+
+    def show_results(self, generation: int, asset_ids: List):
+        """Shows the results straight away, each tile fetching its thumbnail once it scrolls into view"""
+        if generation != self.search_generation:  # A newer search has started
+            return
+        self.smart_results_frame.set_items(asset_ids)
+        self.smart_results_frame.label.configure(text=f"Search results ({len(asset_ids)})")
+
+    def create_result_tile(self, parent: ctk.CTkCanvas) -> "SmartResultFrame":
+        """Builds an empty result tile for the grid to recycle"""
+        return SmartResultFrame(parent, self.smart_results_frame.remove)
+
+    def bind_result_tile(self, tile: "SmartResultFrame", asset_id: str):
+        """Shows a result in a tile, with its thumbnail if already decoded or a placeholder until it arrives"""
+        thumb = self.thumbnail_cache.peek(asset_id, 64)
+        if thumb is None:
+            thumb = self.thumbnail_cache.blank(64)
+            if asset_id not in self.thumb_requested:
+                self.thumb_requested.add(asset_id)
+                self.thumb_futures.append(self.thumb_executor.submit(self.load_thumb, self.search_generation,
+                                                                     asset_id))
+        tile.show(asset_id, thumb)
+
+    def load_thumb(self, generation: int, asset_id: str):
+        """Fetches and decodes the thumbnail of a result on a worker thread, unless its search was superseded"""
+        if generation != self.search_generation:
+            return
+        thumb = self.thumbnail_cache.get(asset_id, 64)  # Adjust thumbnail size as needed
+        if thumb is not None and generation == self.search_generation:
+            self.dispatcher.post(self.show_thumb, generation, asset_id, thumb)
+
+    def show_thumb(self, generation: int, asset_id: str, thumb: ctk.CTkImage):
+        """Puts a fetched thumbnail in the tile showing its result, if it is still in view"""
+        if generation != self.search_generation:
+            return
+        tile = self.smart_results_frame.tile_for(asset_id)
+        if tile is not None:
+            tile.show(asset_id, thumb)
 
 
 class SmartResultFrame(ctk.CTkFrame):
-    def __init__(self, parent: ctk.CTkScrollableFrame, asset_id: List, thumb: ctk.CTkImage):
+    """A recyclable search result tile showing a thumbnail and a button to drop the result"""
+    def __init__(self, parent: ctk.CTkCanvas, on_remove: Callable[[str], None]):
         super().__init__(parent, border_color="gray", border_width=2, fg_color="#565116")
         self.parent = parent
-        self.asset_id = asset_id
-        self.thumb = thumb
+        self.on_remove = on_remove
+        self.asset_id: Optional[str] = None
+        self.thumb: Optional[ctk.CTkImage] = None
+        self.columnconfigure(0, weight=1)
 
-        self.thumbnail_label = ctk.CTkLabel(self, image=self.thumb, text="", width=0, height=0)
+        self.thumbnail_label = ctk.CTkLabel(self, text="", width=0, height=0)
         self.thumbnail_label.grid(row=0, column=0, padx=5, pady=5)
         self.remove_button = ctk.CTkButton(self, text="Remove", command=self.remove_pack, width=0, corner_radius=0)
         self.remove_button.grid(row=1, column=0, padx=5, pady=5, sticky="ew")
 
+    def show(self, asset_id: str, thumb: ctk.CTkImage):
+        """Rebinds the tile to a result"""
+        self.asset_id = asset_id
+        if thumb is not self.thumb:
+            self.thumb = thumb
+            self.thumbnail_label.configure(image=self.thumb)
+
     def remove_pack(self):
-        self.destroy()  # Remove the current frame from the UI
-
-        # Re-grid remaining children
-        children = self.parent.winfo_children()
-        tile_width = 100
-        available_width = self.parent.winfo_width()
-        num_columns = max(1, available_width // tile_width)  # Ensure at least 1 column
-
-        for index, child in enumerate(children):
-            row = index // num_columns
-            col = index % num_columns
-            child.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-
-        # Adjust column configurations
-        for col in range(num_columns):
-            self.parent.columnconfigure(col, weight=1)
+        """Drops the result this tile is showing, the grid then moves the following tiles up"""
+        if self.asset_id is not None:
+            self.on_remove(self.asset_id)
@@ -0,0 +1,57 @@
+import customtkinter as ctk
+from modules.metrics import TransferMetrics
+
+
+class StatsFrame(ctk.CTkFrame):
+    """This shows the live transfer metrics: totals since gimmich started, rates over the last refresh, the time
+    spent in each job stage and request latency per endpoint"""
+    def __init__(self, parent: ctk.CTkFrame, metrics: TransferMetrics, interval_ms: int = 1000):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.interval_ms = interval_ms
+        self.start = metrics.snapshot()  # Totals are counted from here
+        self.previous = self.start  # Rates are counted from the last refresh
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.stats_text = ctk.CTkTextbox(self, wrap="none", font=ctk.CTkFont(family="Courier", size=12))
+        self.stats_text.grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
+        self.stats_text.configure(state="disabled")
+        self.after(self.interval_ms, self.refresh)
+
+    def refresh(self):
+        """Redraws the stats once a second, skipping the work while the tab is hidden"""
+        if self.winfo_ismapped():
+            current = self.metrics.snapshot()
+            self.show(TransferMetrics.summarize(self.start, current), TransferMetrics.summarize(self.previous,
+                                                                                                current))
+            self.previous = current
+        self.after(self.interval_ms, self.refresh)
+
+    def show(self, totals, rates):
+        """Formats the totals and the rates into the textbox"""
+        megabyte = 1048576
+        lines = [
+            f"Requests {totals['requests']}  errors {totals['errors']}  retries {totals['retries']}  "
+            f"({rates['requests'] / rates['duration']:.1f} requests/s)",
+            f"Sent {totals['bytes_sent'] / megabyte:.1f} MB ({rates['bytes_sent'] / megabyte / rates['duration']:.2f} "
+            f"MB/s)  received {totals['bytes_received'] / megabyte:.1f} MB "
+            f"({rates['bytes_received'] / megabyte / rates['duration']:.2f} MB/s)",
+            "Files " + ("  ".join(f"{kind} {count}" for kind, count in sorted(totals['files'].items())) or "none") +
+            f"  ({rates['files_per_second']:.1f} files/s)",
+            "",
+            f"{'Stage':<12}{'Runs':>6}{'Seconds':>12}"
+        ]
+        for stage, stats in sorted(totals['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"{stage:<12}{stats['runs']:>6}{stats['seconds']:>12.2f}")
+        lines.extend(["", f"{'Endpoint':<44}{'Requests':>9}{'Errors':>7}{'Retries':>8}{'p50':>8}{'p95':>8}"
+                          f"{'p99':>8}{'Sent MB':>9}{'Recv MB':>9}"])
+        for endpoint, stats in sorted(totals['endpoints'].items(), key=lambda item: -item[1]['requests']):
+            percentiles = "".join(f"{stats[name]:>8.3f}" if stats[name] is not None else f"{'-':>8}"
+                                  for name in ("p50", "p95", "p99"))
+            lines.append(f"{endpoint[:43]:<44}{stats['requests']:>9}{stats['errors']:>7}{stats['retries']:>8}"
+                         f"{percentiles}{stats['bytes_sent'] / megabyte:>9.1f}"
+                         f"{stats['bytes_received'] / megabyte:>9.1f}")
+        self.stats_text.configure(state="normal")
+        self.stats_text.delete("1.0", "end")
+        self.stats_text.insert("end", "\n".join(lines))
+        self.stats_text.configure(state="disabled")
@@ -0,0 +1,45 @@
+import logging
+from typing import Dict, List
+from modules.api_client import ImmichClient
+
+logger = logging.getLogger(__name__)
+
+
+class TagRegistry:
+    """Resolves tag names to ids from a single load of the servers tag list and collects which assets each tag
+    should be applied to, so a whole import can be tagged with a handful of bulk requests."""
+    def __init__(self, client: ImmichClient, batch_size: int = 1000):
+        self.client = client
+        self.batch_size = batch_size  # Most asset ids sent in one tagging request
+        self.tag_ids: Dict[str, str] = client.get_all_tags() or {}
+        self._pending: Dict[str, Dict[str, None]] = {}  # tag name -> ordered set of asset ids
+
+    def add(self, tag_name: str, asset_ids: List[str]):
+        """Queues assets to be tagged with tag_name on the next flush"""
+        self._pending.setdefault(tag_name, {}).update(dict.fromkeys(asset_ids))
+
+    def ensure(self, tag_names: List[str]) -> Dict[str, str]:
+        """Creates any of the tags that don't exist yet in one upsert and returns the name to id mapping"""
+        missing = [tag_name for tag_name in dict.fromkeys(tag_names) if tag_name not in self.tag_ids]
+        if missing:
+            created = self.client.upsert_tags(missing) or {}
+            for tag_name, tag_id in created.items():
+                self.tag_ids[tag_name] = tag_id
+                self.client.random_tag_color(tag_id)
+                print(f"Created tag {tag_name}, id:{tag_id}")
+        return {tag_name: self.tag_ids[tag_name] for tag_name in tag_names if tag_name in self.tag_ids}
+
+    def flush(self):
+        """Creates missing tags and applies every queued tag. Tags queued for exactly the same assets share
+        a single bulk request."""
+        tag_ids = self.ensure(list(self._pending))
+        groups: Dict[tuple, List[str]] = {}
+        for tag_name, asset_ids in self._pending.items():
+            if tag_name in tag_ids:
+                groups.setdefault(tuple(asset_ids), []).append(tag_ids[tag_name])
+            else:
+                logger.error(f"Error creating tag {tag_name}")
+        for asset_ids, group_tag_ids in groups.items():
+            for start in range(0, len(asset_ids), self.batch_size):
+                self.client.bulk_tag_assets(group_tag_ids, list(asset_ids[start:start + self.batch_size]))
+        self._pending.clear()
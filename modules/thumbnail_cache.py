@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+import customtkinter as ctk
+from PIL import Image, ImageDraw
+from modules.api_client import ImmichClient
+from modules.app_paths import data_dir
+
+logger = logging.getLogger(__name__)
+
+PERSON_PREFIX = "person-"  # Marks ids of person face thumbnails rather than asset thumbnails
+STALE_TEMP_SECONDS = 3600  # Temp files older than this were left behind by a crash, not written right now
+
+
+def person_thumb_id(person_id: str) -> str:
+    """Returns the id the cache knows the face thumbnail of a person by"""
+    return f"{PERSON_PREFIX}{person_id}"
+
+
+class ThumbnailCache:
+    """Two tier cache of asset thumbnails keyed by server, asset id and size. Decoded CTkImages are kept in a
+    memory LRU of max_entries, backed by small PNG icons on disk capped at max_disk_bytes, dropping the least
+    recently used first. Both tiers treat a thumbnail as fresh for ttl seconds after it was fetched. Ids made by
+    person_thumb_id look up a persons face instead of an asset."""
+    def __init__(self, client: ImmichClient, max_entries: int = 2000, max_disk_bytes: int = 64 * 1024 ** 2,
+                 ttl: float = 7 * 24 * 3600, path: Optional[str] = None, workers: int = 8):
+        self.client = client
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.path = path or os.path.join(data_dir(), "thumbnails")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # (server, asset id, size) -> (expiry time, CTkImage)
+        self._disk_files: Optional[Dict[str, Tuple[int, float]]] = None  # path -> (bytes, last use), scanned lazily
+        self._disk_bytes = 0
+        self._blanks: Dict[int, ctk.CTkImage] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="immich-thumbs")
+
+    def get(self, asset_id: Optional[str], size: int = 32) -> Optional[ctk.CTkImage]:
+        """Returns the thumbnail of an asset as a size by size CTkImage, from memory, disk or the server in that
+        order. Returns None if the server has no thumbnail for it."""
+        if not asset_id:
+            return None
+        key = (self.client.base_url, asset_id, size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+
+        file_path = self._file_path(asset_id, size)
+        image = self._read_disk(file_path)
+        if image is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            image = self._fetch(asset_id, size, file_path)
+            if image is None:
+                return None
+        thumb = ctk.CTkImage(light_image=image, size=(size, size))
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, thumb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return thumb
+
+    def peek(self, asset_id: str, size: int = 32) -> Optional[ctk.CTkImage]:
+        """Returns the thumbnail if it is already decoded in memory, without touching disk or the network, so it is
+        cheap enough for the UI thread"""
+        key = (self.client.base_url, asset_id, size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+        return None
+
+    def get_async(self, asset_id: Optional[str], size: int = 32) -> Future:
+        """Looks up a thumbnail on the caches worker pool, returning a Future of what get would return"""
+        return self._executor.submit(self.get, asset_id, size)
+
+    def get_or_blank(self, asset_id: Optional[str], size: int = 32) -> ctk.CTkImage:
+        """Returns the thumbnail of an asset, or an empty outlined square if it has none"""
+        return self.get(asset_id, size) or self.blank(size)
+
+    def blank(self, size: int = 32) -> ctk.CTkImage:
+        """Returns a shared empty outlined square for packs without a thumbnail"""
+        with self._lock:
+            if size not in self._blanks:
+                blank_image = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+                draw = ImageDraw.Draw(blank_image)
+                draw.rectangle((0, 0, size - 1, size - 1), outline="gray")
+                self._blanks[size] = ctk.CTkImage(light_image=blank_image, size=(size, size))
+            return self._blanks[size]
+
+    def stats(self):
+        """Returns the hit and miss counters of each tier along with their current size"""
+        with self._lock:
+            return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'memory_size': len(self._entries), 'disk_bytes': self._disk_bytes}
+
+    def _server_directory(self) -> str:
+        """Returns the directory holding the thumbnails of the current server, so ids of different servers
+        never collide"""
+        server = hashlib.sha1(self.client.base_url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.path, server)
+
+    def _file_path(self, asset_id: str, size: int) -> str:
+        """Returns where the icon of an asset at a size is stored"""
+        return os.path.join(self._server_directory(), f"{asset_id}_{size}.png")
+
+    def _read_disk(self, file_path: str) -> Optional[Image.Image]:
+        """Loads a fresh icon from disk, marking it as recently used. Returns None if it is missing or stale."""
+        try:
+            stat = os.stat(file_path)
+            if stat.st_mtime + self.ttl < time.time():
+                return None
+            with open(file_path, "rb") as file:
+                image = Image.open(BytesIO(file.read()))
+                image.load()
+            now = time.time()
+            os.utime(file_path, (now, stat.st_mtime))  # Access time orders eviction, modification time freshness
+        except (OSError, ValueError):
+            return None
+        self._scan_disk()
+        with self._lock:
+            if file_path in self._disk_files:
+                self._disk_files[file_path] = (self._disk_files[file_path][0], now)
+        return image
+
+    def _fetch(self, asset_id: str, size: int, file_path: str) -> Optional[Image.Image]:
+        """Downloads and decodes a thumbnail, then stores a small icon of it on disk"""
+        if asset_id.startswith(PERSON_PREFIX):
+            thumb_data = self.client.view_person(asset_id[len(PERSON_PREFIX):])
+        else:
+            thumb_data = self.client.view_asset(asset_id)
+        if thumb_data is None:
+            return None
+        try:
+            image = Image.open(thumb_data)
+            image = image.convert("RGBA").resize((size * 2, size * 2))  # Twice the size stays sharp when scaled
+        except Exception as e:
+            logger.warning(f"Could not decode thumbnail of {asset_id}: {e}")
+            return None
+        try:
+            encoded = BytesIO()
+            image.save(encoded, format="PNG", optimize=True)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            temporary_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(encoded.getvalue())
+            os.replace(temporary_path, file_path)
+            self._add_disk_file(file_path, len(encoded.getvalue()))
+        except OSError as e:
+            logger.warning(f"Could not store thumbnail of {asset_id}: {e}")
+        return image
+
+    def _scan_disk(self):
+        """Builds the index of stored icons the first time it is needed"""
+        with self._lock:
+            if self._disk_files is not None:
+                return
+        disk_files = {}
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):  # Being written by a fetch, or left behind by a crash mid-write if stale
+                    if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                        try:
+                            os.remove(file_path)
+                        except OSError:
+                            pass  # Already replaced or removed by whoever wrote it
+                    continue
+                disk_files[file_path] = (stat.st_size, stat.st_atime)
+        with self._lock:
+            if self._disk_files is None:
+                self._disk_files = disk_files
+                self._disk_bytes = sum(file_size for file_size, _ in disk_files.values())
+
+    def _add_disk_file(self, file_path: str, file_size: int):
+        """Accounts for a newly stored icon, evicting the least recently used ones while over the size cap"""
+        self._scan_disk()
+        with self._lock:
+            previous = self._disk_files.get(file_path)
+            self._disk_bytes += file_size - (previous[0] if previous else 0)
+            self._disk_files[file_path] = (file_size, time.time())
+            evicted = []
+            if self._disk_bytes > self.max_disk_bytes:
+                target = self.max_disk_bytes * 0.9  # Leave some headroom so eviction does not run on every store
+                for path, (size, _) in sorted(self._disk_files.items(), key=lambda item: item[1][1]):
+                    if self._disk_bytes <= target:
+                        break
+                    evicted.append(path)
+                    self._disk_bytes -= size
+                for path in evicted:
+                    del self._disk_files[path]
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
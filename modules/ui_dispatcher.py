@@ -0,0 +1,56 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+import customtkinter as ctk
+
+logger = logging.getLogger(__name__)
+
+
+class UiDispatcher:
+    """Carries widget updates from worker threads to the Tk main thread. Workers post callbacks and the main thread
+    runs whatever is queued rate times a second from after(), so workers never touch widgets themselves. A callback
+    posted with a key replaces the one still queued under that key, which folds a burst of progress updates into a
+    single redraw per frame."""
+    def __init__(self, root: ctk.CTk, rate: float = 25):
+        self.root = root
+        self.interval_ms = max(1, int(1000 / rate))
+        self._pending: OrderedDict = OrderedDict()  # key -> (callback, args), in the order first posted
+        self._sequence = itertools.count()  # Unique keys for callbacks that must all run
+        self._lock = threading.Lock()
+        self._running = False
+        self.coalesced = 0  # Callbacks replaced before they ran
+
+    def post(self, callback: Callable, *args, key: Optional[Hashable] = None):
+        """Queues callback(*args) to run on the main thread, from any thread. Given a key, it replaces a callback
+        still queued under the same key but keeps that ones place in the queue."""
+        with self._lock:
+            if key is None:
+                key = ("event", next(self._sequence))
+            elif key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (callback, args)
+
+    def start(self):
+        """Starts draining the queue, call once from the main thread"""
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        """Stops draining, anything still queued is dropped"""
+        self._running = False
+
+    def _drain(self):
+        """Runs everything queued since the last frame, then schedules the next frame"""
+        if not self._running:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for callback, args in pending.values():
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Unexpected error updating the UI: {e}")
+        self.root.after(self.interval_ms, self._drain)
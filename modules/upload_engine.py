@@ -0,0 +1,387 @@
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Event
+from typing import Callable, Dict, List, Optional, Tuple
+from modules.api_client import ImmichClient
+from modules.job_journal import JobJournal, JobState
+from modules.tag_registry import TagRegistry
+from modules.upload_index import UploadIndex
+from modules.worker_pool import run_bounded
+
+logger = logging.getLogger(__name__)
+
+allowed_extensions = ['.3fr', '.ari', '.arw', '.cap', '.cin', '.cr2', '.cr3', '.crw', '.dcr', '.dng', '.erf', '.fff',
+                      '.iiq', '.k25', '.kdc', '.mrw', '.nef', '.nrw', '.orf', '.ori', '.pef', '.psd', '.raf', '.raw',
+                      '.rw2', '.rwl', '.sr2', '.srf', '.srw', '.x3f', '.avif', '.bmp', '.gif', '.heic', '.heif', '.hif',
+                      '.insp', '.jpe', '.jpeg', '.jpg', '.jxl', '.png', '.svg', '.tif', '.tiff', '.webp', '.3gp',
+                      '.3gpp', '.avi', '.flv', '.insv', '.m2ts', '.m4v', '.mkv', '.mov', '.mp4', '.mpe', '.mpeg',
+                      '.mpg', '.mts', '.vob', '.webm', '.wmv']
+
+
+def list_files(paths: List[str], recursive: bool = False) -> List[str]:
+    """Return a list of the uploadable files in paths, optionally walking directories recursively."""
+    file_list = []
+    for path in paths:
+        if os.path.isdir(path):  # Check if the path is a directory
+            if recursive:  # If recursive, traverse directories using os.walk
+                for root, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        file_path = os.path.join(root, filename)
+                        if os.path.isfile(file_path):  # Only add files
+                            file_list.append(file_path)
+            else:  # Non-recursive: only list files in the current directory
+                for filename in os.listdir(path):
+                    file_path = os.path.join(path, filename)
+                    if os.path.isfile(file_path):  # Only add files
+                        file_list.append(file_path)
+        elif os.path.isfile(path):  # If it's a file, add it directly
+            file_list.append(path)
+    return [file for file in file_list if any(file.lower().endswith(ext.lower()) for ext in allowed_extensions)]
+
+
+class UploadEngine:
+    """Runs an upload job without any UI: dedupes against the local index and the server, uploads the rest on a
+    bounded worker pool and applies the album, tag and caption options. checkbox_states is the dict returned by
+    CheckboxFrame.get_states(). Progress is reported through on_status(text) and on_progress(stage, done, total)."""
+    def __init__(self, client: ImmichClient, checkbox_states: Dict, workers: int = 16,
+                 stop_flag: Optional[Event] = None, journal: Optional[JobJournal] = None,
+                 upload_index: Optional[UploadIndex] = None,
+                 on_status: Optional[Callable[[str], None]] = None,
+                 on_progress: Optional[Callable[[str, int, int], None]] = None):
+        self.client = client
+        self.checkbox_states = checkbox_states
+        self.workers = workers  # Upper bound, the clients adaptive limiter decides how many actually run
+        self.stop_flag = stop_flag or Event()
+        self.journal = journal or JobJournal("upload")
+        self.upload_index = upload_index
+        self.on_status = on_status
+        self.on_progress = on_progress
+        self.file_list: List[str] = []
+        self.total = 0
+        self.uploaded = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.metrics = client.metrics
+        self.metrics_start: Optional[Dict] = None  # Snapshot the job summary starts from, taken by scanning or run
+        self.summary: Dict = {}  # Metrics of the last run
+
+    def set_status(self, text: str):
+        """Reports a status line"""
+        if self.on_status:
+            self.on_status(text)
+
+    def set_progress(self, stage: str, done: int, total: int):
+        """Reports progress through a stage of the job"""
+        if self.on_progress:
+            self.on_progress(stage, done, total)
+
+    @contextmanager
+    def scanning(self):
+        """Times listing the files to upload as the scan stage of this job, for callers that list them before run"""
+        self.metrics_start = self.metrics.snapshot()
+        with self.metrics.stage("scan"):
+            yield
+
+    def run(self, files: List[str], resume: Optional[JobState] = None) -> bool:
+        """Uploads the files and runs the post processing the options ask for. Continues the journaled job resume
+        instead of starting over when given, in which case files is ignored. Returns True if the job ran to the
+        end, False if it was stopped."""
+        index_entries = []  # New upload index rows, written in batches
+        metrics_start = self.metrics_start or self.metrics.snapshot()
+        self.metrics_start = None
+        try:
+            self.file_list = files if resume is None else resume.items
+            total_files = len(self.file_list)  # Get total list for progress bar
+            self.total = total_files
+            if total_files == 0:
+                self.set_status("No files to upload")
+                return True
+            if resume is None:
+                self.journal.start(self.client.base_url, {'worker_count': self.workers,
+                                                          'checkbox_states': self.checkbox_states}, self.file_list)
+                journaled = {}
+            else:
+                self.journal.resume()
+                journaled = {self.file_list[index]: (data['asset_id'], data['status'])
+                             for index, data in resume.done.items()}
+                print(f"Resuming upload, {len(journaled)} of {total_files} files already transferred")
+
+            if self.upload_index is None:
+                self.upload_index = UploadIndex()
+            with self.metrics.stage("scan"):
+                file_stats = {}
+                for file in self.file_list:
+                    if file in journaled:  # Already transferred, it may have been moved since
+                        continue
+                    try:
+                        file_stats[file] = os.stat(file)
+                    except OSError as e:
+                        logger.warning(f"Could not read {file}, counting it as failed: {e}")
+                indexed = self.upload_index.lookup_many(self.client.base_url, file_stats)  # Unchanged since last run
+            indexed_ids = {file: asset_id for file, (_, asset_id, _) in indexed.items() if asset_id}
+            indexed_checksums = {file: checksum for file, (checksum, _, _) in indexed.items() if checksum}
+            print(f"{len(indexed_ids)} of {total_files} files resolved from the local upload index")
+
+            unresolved_files = [file for file in file_stats if file not in indexed_ids]
+            checksums, existing_ids = self.check_existing_files(unresolved_files, indexed_checksums)  # Server dupes
+            for file in unresolved_files:
+                if file in existing_ids:
+                    index_entries.append(UploadIndex.entry(file, file_stats[file], checksums.get(file),
+                                                           existing_ids[file], "duplicate"))
+            existing_ids.update(indexed_ids)
+            if self.stop_flag.is_set():
+                print("Upload stopped by user.")
+                self.set_status("Upload stopped")
+                return False
+
+            def upload_file(file: str):
+                """Uploads one file on a worker thread, or resolves it if the server already has it"""
+                if self.stop_flag.is_set():
+                    return None
+                if file in journaled:  # Finished before the interruption
+                    return journaled[file]
+                if file not in file_stats:  # Gone or unreadable since it was listed
+                    return None, "failed"
+                if file in existing_ids:  # Skip the transfer but keep the asset for album/tag/caption processing
+                    print(f"Skipping {file}, already on server")
+                    return existing_ids[file], "duplicate"
+                print(f"Uploading {file}")
+                return self.client.upload_asset(file, checksums.get(file)) or (None, "failed")  # The actual upload
+
+            completed_files = 0
+
+            def collect_result(index: int, result):
+                """Aggregates progress and index rows as each worker finishes, on the upload thread"""
+                nonlocal completed_files, index_entries
+                completed_files += 1
+                file = self.file_list[index]
+                if result is None or result[0] is None:
+                    self.failed += 1
+                else:  # Only files that made it count towards the files metric
+                    self.metrics.add_files("upload")
+                    if result[1] == "duplicate":
+                        self.duplicates += 1
+                    else:
+                        self.uploaded += 1
+                if result is not None and result[0] and file not in journaled:
+                    self.journal.record_done(index, asset_id=result[0], status=result[1])
+                if result is not None and file in file_stats and file not in existing_ids:
+                    asset_id, status = result
+                    index_entries.append(UploadIndex.entry(file, file_stats[file], checksums.get(file), asset_id,
+                                                           status))
+                    logger.debug(f"Status: {status} for {file}")
+                if len(index_entries) >= 1000:
+                    self.upload_index.put_many(self.client.base_url, index_entries)
+                    index_entries = []
+                self.set_progress("upload", completed_files, total_files)
+                self.set_status(f"Uploading... {completed_files}/{total_files} files "
+                                f"(limit {self.client.request_limiter.limit})")
+
+            with self.metrics.stage("upload"):
+                results = run_bounded(upload_file, self.file_list, self.workers, self.stop_flag, collect_result)
+            if self.stop_flag.is_set():
+                print("Upload stopped by user.")
+                self.set_status("Upload stopped")
+                return False
+
+            collected_ids = []  # Collect ids and captions for the captions and tags processing, in file order
+            collected_captions = []
+            for file, result in zip(self.file_list, results):
+                if result is None or result[0] is None:
+                    logger.warning(f"Not processing options for {file}, upload failed")
+                    continue
+                asset_id = result[0]
+                directory = os.path.dirname(file)  # Get variables for processing
+                immediate_dir = os.path.basename(directory)
+                collected_captions.append((file, asset_id))
+                collected_ids.append((immediate_dir, asset_id))
+            if collected_ids:
+                self.process_options(collected_ids, collected_captions,
+                                     resume.steps if resume else set())  # Process captions/tags
+            if self.stop_flag.is_set():
+                self.set_status("Upload stopped")
+                return False
+            if self.failed:  # Keep the journal so the failures are retried when the job is resumed
+                logger.warning(f"{self.failed} files failed to upload, resume the job to retry them")
+            else:
+                self.journal.complete()
+            self.set_status("Upload Complete")
+            return True
+
+        finally:
+            if index_entries:
+                self.upload_index.put_many(self.client.base_url, index_entries)  # Remember what was uploaded
+            self.journal.close()
+            self.summary = self.metrics.finish_job("upload", metrics_start)
+
+    def process_options(self, collected_ids: List[Tuple[str, str]], collected_captions: List[Tuple[str, str]],
+                        completed_steps: set):
+        """Runs the various non-upload tasks such as tagging and captioning, skipping steps a resumed job already
+        finished and journaling each one as it completes."""
+        steps = [  # Journal name, status, metrics stage, processing and its input
+            ("albums", "Processing Albums", "album", self.process_albums, collected_ids),  # Create albums
+            ("albums_by_dir", "Processing Albums", "album", self.process_albums_by_dir, collected_ids),
+            ("tags", "Processing Tags", "tag", self.process_tags, collected_ids),  # Create tags
+            ("tags_by_dir", "Processing Tags", "tag", self.process_tags_by_dir, collected_ids),
+            ("captions", "Processing Captions", "caption", self.process_captions, collected_captions),  # Captions
+            ("captions_as_tags", "Processing Captions", "caption", self.process_captions_as_tags, collected_captions)
+        ]
+        for name, status, stage, process, ids in steps:
+            if self.stop_flag.is_set():
+                return
+            if name in completed_steps:
+                print(f"Skipping {name}, finished before the upload was interrupted")
+                continue
+            self.set_status(status)
+            with self.metrics.stage(stage):
+                process(ids)
+            if not self.failed:  # Otherwise a resume runs the step again to cover the files it retries
+                self.journal.record_step(name)
+
+    def check_existing_files(self, files: List[str], known_checksums: Dict[str, str],
+                             batch_size: int = 1000) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Hashes the files that don't have a known checksum yet and asks the server in batches which files it
+        already has. Returns the checksum of every file and the existing asset id of every duplicate"""
+        checksums = {file: known_checksums[file] for file in files if file in known_checksums}
+        to_hash = [file for file in files if file not in checksums]
+        total_files = len(to_hash)
+        self.set_status("Checking for existing files...")
+        with self.metrics.stage("hash"), ThreadPoolExecutor(max_workers=4) as executor:  # I/O bound, releases GIL
+            for index, (file, checksum) in enumerate(zip(to_hash, executor.map(self.hash_file, to_hash))):
+                if self.stop_flag.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return checksums, {}
+                if checksum is not None:  # Unreadable files are left to fail in the upload stage
+                    checksums[file] = checksum
+                self.set_progress("hash", index + 1, total_files)
+                self.set_status(f"Hashing files... {index + 1}/{total_files} files")
+
+        existing_ids = {}
+        with self.metrics.stage("dedupe"):  # Asking the server which checksums it already has
+            for start in range(0, len(files), batch_size):
+                batch = {file: checksums[file] for file in files[start:start + batch_size] if file in checksums}
+                existing_ids.update(self.client.check_bulk_upload(batch))
+        print(f"{len(existing_ids)} of {len(files)} checked files are already on the server")
+        return checksums, existing_ids
+
+    def hash_file(self, file: str) -> Optional[str]:
+        """Returns the checksum of a file, or None if it could not be read"""
+        try:
+            return self.client.file_checksum(file)
+        except OSError as e:
+            logger.warning(f"Could not hash {file}: {e}")
+            return None
+
+    def process_captions(self, ids: List[Tuple[str, str]]):
+        """Process uploading caption descriptions if enabled"""
+        total_files = len(self.file_list)  # Get total amount of files to caption
+        checkbox_states = self.checkbox_states
+        if checkbox_states['import_captions']:
+            index = 0  # Start index for progress bar.
+            for file, asset_id in ids:  # Iterate over the ids
+                index = index + 1
+                txt_file = os.path.splitext(file)[0] + '.txt'  # Replace original filename extension
+                if os.path.exists(txt_file):
+                    with open(txt_file, 'r', encoding='utf-8') as f:  # Load caption from disk
+                        caption = f.read()
+                    self.client.update_asset_description(asset_id, caption)  # Upload caption to server
+                    print(f"Added caption for {file}")
+                else:
+                    print(f"No caption file found for: {file}")
+                self.set_progress("captions", index, total_files)  # Update progress bar
+                self.set_status(f"Importing Captions as descriptions... {index + 1}/{total_files} files")
+
+    def process_captions_as_tags(self, ids: List[Tuple[str, str]]):
+        """Process uploading captions as tags if enabled"""
+        total_files = len(self.file_list)  # Get total amount of files to be processed
+        checkbox_states = self.checkbox_states
+        caption_delimiters = checkbox_states['caption_delimiters']
+        delimiters_pattern = f"[{re.escape(caption_delimiters)}]"
+        if checkbox_states['captions_as_tags']:
+            tag_registry = TagRegistry(self.client)  # Loads the tag list once for the whole import
+            for index, (file, asset_id) in enumerate(ids):  # Iterate over files to caption
+                txt_file = os.path.splitext(file)[0] + '.txt'  # Replace file extension with txt
+                if os.path.exists(txt_file):
+                    with open(txt_file, 'r', encoding='utf-8') as f:
+                        caption = f.read()  # Load caption
+                    tags = [tag.strip() for tag in re.split(delimiters_pattern, caption) if tag.strip()]
+                    for tag in tags:
+                        tag_registry.add(tag, [asset_id])
+                    print(f"Collected tags from caption for {file}")
+                else:
+                    print(f"No caption file found for: {file}")
+                self.set_progress("caption_tags", index + 1, total_files)  # Update progress bar
+                self.set_status(f"Importing Captions as tags... {index + 1}/{total_files} files")
+            self.set_status("Applying caption tags...")
+            tag_registry.flush()  # Create missing tags and tag their assets in bulk
+
+    def process_albums(self, ids: List[Tuple[str, str]]):
+        """Create albums based on user options"""
+        checkbox_states = self.checkbox_states
+        existing_albums = self.client.get_all_albums()
+        all_asset_ids = [value for _, value in ids]
+        if checkbox_states['album_input_enabled']:
+            if checkbox_states['album_input'] not in existing_albums:
+                album_id = self.client.create_album(checkbox_states['album_input'])
+                self.client.add_assets_to_album(album_id, all_asset_ids)
+                print(f"Created album {checkbox_states['album_input']}, id:{album_id}")
+            else:
+                album_id = existing_albums[checkbox_states['album_input']]
+                self.client.add_assets_to_album(album_id, all_asset_ids)
+                print(f"Album {checkbox_states['album_input']} already exists, added to existing album: {album_id}")
+
+    def process_albums_by_dir(self, ids: List[Tuple[str, str]]):
+        """Create albums based on existing folder name"""
+        checkbox_states = self.checkbox_states
+        existing_albums = self.client.get_all_albums()
+        if checkbox_states['directory_names_as_albums']:
+            albums_by_directory = {}
+            for directory_name, asset_id in ids:
+                albums_by_directory.setdefault(directory_name, []).append(asset_id)
+            for directory_name, asset_ids in albums_by_directory.items():
+                #  Check if the album exists and if not, create an album for each directory
+                if directory_name not in existing_albums:
+                    album_id = self.client.create_album(directory_name)
+                    self.client.add_assets_to_album(album_id, asset_ids)
+                    print(f"Created album {directory_name}, id:{album_id}")
+                else:
+                    album_id = existing_albums[directory_name]
+                    self.client.add_assets_to_album(album_id, asset_ids)
+                    print(f"Album {directory_name} already exists, added assets to existing album: {album_id}")
+
+    def process_tags(self, ids: List[Tuple[str, str]]):
+        """Create tags based on user options"""
+        checkbox_states = self.checkbox_states
+        existing_tags = self.client.get_all_tags()
+        all_asset_ids = [value for _, value in ids]
+        if checkbox_states['tag_input_enabled']:
+            if checkbox_states['tag_input'] not in existing_tags:
+                tag_id = self.client.create_tag(checkbox_states['tag_input'])
+                self.client.tag_assets(tag_id, all_asset_ids)
+                print(f"Created tag {checkbox_states['tag_input']}, id:{tag_id}")
+            else:
+                tag_id = existing_tags[checkbox_states['tag_input']]
+                self.client.tag_assets(tag_id, all_asset_ids)
+                print(f"Tag {checkbox_states['album_input']} already exists, added to existing tag: {tag_id}")
+
+    def process_tags_by_dir(self, ids: List[Tuple[str, str]]):
+        """Create tags based on the folder name"""
+        checkbox_states = self.checkbox_states
+        existing_tags = self.client.get_all_tags()
+        if checkbox_states['directory_names_as_tags']:
+            tags_by_directory = {}
+            for directory_name, asset_id in ids:
+                tags_by_directory.setdefault(directory_name, []).append(asset_id)
+
+            for directory_name, asset_ids in tags_by_directory.items():
+                if directory_name not in existing_tags:
+                    tag_id = self.client.create_tag(directory_name)
+                    self.client.tag_assets(tag_id, asset_ids)
+                    print(f"Created tag {directory_name}, id:{tag_id}")
+                else:
+                    tag_id = existing_tags[directory_name]
+                    self.client.tag_assets(tag_id, asset_ids)
+                    print(f"Tag {directory_name} already exists, added assets to existing tag: {tag_id}")
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from modules.app_paths import data_dir
+
+# path, size, mtime_ns, inode, checksum, asset_id, status
+IndexEntry = Tuple[str, int, int, int, Optional[str], Optional[str], Optional[str]]
+
+
+class UploadIndex:
+    """On-disk SQLite index of local files gimmich has hashed or uploaded, keyed by server and absolute path and
+    validated against the files size, mtime_ns and inode. Unchanged files can be resolved on later runs without
+    reading them or touching the network."""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(data_dir(), "upload_index.sqlite3")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                server TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                checksum TEXT,
+                asset_id TEXT,
+                status TEXT,
+                PRIMARY KEY (server, path)
+            ) WITHOUT ROWID""")
+        self._connection.commit()
+
+    @staticmethod
+    def entry(path: str, stat: os.stat_result, checksum: Optional[str] = None, asset_id: Optional[str] = None,
+              status: Optional[str] = None) -> IndexEntry:
+        """Builds an index entry for a file from its stat result"""
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino, checksum, asset_id, status
+
+    def close(self):
+        """Closes the database"""
+        with self._lock:
+            self._connection.close()
+
+    def lookup_many(self, server: str, stats: Dict[str, os.stat_result],
+                    chunk_size: int = 500) -> Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]]:
+        """Takes a dict of file paths and their stat results and returns (checksum, asset_id, status) for every file
+        whose indexed size, mtime and inode still match"""
+        absolute_paths = {os.path.abspath(path): path for path in stats}
+        keys = list(absolute_paths)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT path, size, mtime_ns, inode, checksum, asset_id, status FROM files "
+                    f"WHERE server = ? AND path IN ({placeholders})", [server, *chunk])
+                for path, size, mtime_ns, inode, checksum, asset_id, status in rows:
+                    stat = stats[absolute_paths[path]]
+                    if (size, mtime_ns, inode) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                        found[absolute_paths[path]] = (checksum, asset_id, status)
+        return found
+
+    def put_many(self, server: str, entries: Iterable[IndexEntry]):
+        """Inserts or replaces many entries in a single transaction"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files (server, path, size, mtime_ns, inode, checksum, asset_id, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", ((server, *entry) for entry in entries))
@@ -0,0 +1,181 @@
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+import customtkinter as ctk
+
+_REMOVED = object()  # Marks the slot of a removed item until the model is compacted
+
+
+class ResultModel:
+    """Ordered collection of unique items with O(1) removal. A removed item leaves a hole that is compacted away the
+    next time items are read by position, so a burst of removals costs a single pass."""
+    def __init__(self, items: Iterable[Hashable] = ()):
+        self._items: List = []
+        self._slots: Dict[Hashable, int] = {}  # item -> its index in _items
+        self._holes = 0
+        self.set_items(items)
+
+    def set_items(self, items: Iterable[Hashable]):
+        """Replaces every item, dropping duplicates but keeping the order"""
+        self._items = list(dict.fromkeys(items))
+        self._slots = {item: slot for slot, item in enumerate(self._items)}
+        self._holes = 0
+
+    def extend(self, items: Iterable[Hashable]):
+        """Appends items that are not already present"""
+        for item in items:
+            if item not in self._slots:
+                self._slots[item] = len(self._items)
+                self._items.append(item)
+
+    def remove(self, item: Hashable) -> bool:
+        """Removes an item, returning False if it was not there"""
+        slot = self._slots.pop(item, None)
+        if slot is None:
+            return False
+        self._items[slot] = _REMOVED
+        self._holes += 1
+        return True
+
+    def items(self) -> List:
+        """Returns every item in order"""
+        self._compact()
+        return list(self._items)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._slots
+
+    def __getitem__(self, index: int):
+        self._compact()
+        return self._items[index]
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _compact(self):
+        """Closes the holes left by removals"""
+        if self._holes:
+            self._items = [item for item in self._items if item is not _REMOVED]
+            self._slots = {item: slot for slot, item in enumerate(self._items)}
+            self._holes = 0
+
+
+class VirtualGrid(ctk.CTkFrame):
+    """Scrollable grid of tiles that only creates widgets for the visible rows plus overscan rows either side,
+    recycling them as it scrolls. create_tile(parent) builds an empty tile and bind_tile(tile, item) shows an item
+    in it, so the widget count follows the window size rather than the number of items. Without a tile_width it is
+    a single column list whose rows stretch to the full width."""
+    def __init__(self, parent, create_tile: Callable[[ctk.CTkCanvas], ctk.CTkBaseClass],
+                 bind_tile: Callable[[ctk.CTkBaseClass, Hashable], None], tile_width: Optional[int], tile_height: int,
+                 label_text: str = "", overscan: int = 2, padding: int = 5):
+        super().__init__(parent)
+        self.model = ResultModel()
+        self.create_tile = create_tile
+        self.bind_tile = bind_tile
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.overscan = overscan
+        self.padding = padding
+        self._tiles: List[List] = []  # [tile, canvas window id, bound item] for every tile created so far
+        self._shown: Dict[Hashable, ctk.CTkBaseClass] = {}  # Visible item -> the tile showing it
+        self._redraw_pending = False
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+        self.label = ctk.CTkLabel(self, text=label_text)
+        if label_text:
+            self.label.grid(row=0, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="ew")
+        background = self.cget("fg_color") if self.cget("fg_color") != "transparent" else self.cget("bg_color")
+        self.canvas = ctk.CTkCanvas(self, highlightthickness=0, bg=self._apply_appearance_mode(background),
+                                    yscrollincrement=max(1, tile_height // 4))
+        self.canvas.grid(row=1, column=0, padx=(5, 0), pady=5, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=1, padx=(0, 5), pady=5, sticky="ns")
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):  # Shared with other scrollable frames
+            self.bind_all(sequence, self._on_mouse_wheel, add="+")
+
+    def set_items(self, items: Iterable[Hashable]):
+        """Shows a new set of items, scrolled back to the top"""
+        self.model.set_items(items)
+        for tile in self._tiles:
+            tile[2] = _REMOVED  # Forces every tile to be rebound
+        self.canvas.yview_moveto(0)
+        self.redraw()
+
+    def extend(self, items: Iterable[Hashable]):
+        """Appends items, keeping the scroll position"""
+        self.model.extend(items)
+        self.schedule_redraw()
+
+    def remove(self, item: Hashable):
+        """Removes an item, moving only the visible tiles that follow it"""
+        if self.model.remove(item):
+            self.schedule_redraw()
+
+    def items(self) -> List:
+        """Returns every item in order"""
+        return self.model.items()
+
+    def tile_for(self, item: Hashable) -> Optional[ctk.CTkBaseClass]:
+        """Returns the tile currently showing an item, or None if it is scrolled out of view"""
+        return self._shown.get(item)
+
+    def yview(self, *args):
+        """Scrolls the canvas for the scrollbar and brings the newly visible rows in"""
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def schedule_redraw(self):
+        """Redraws once the event loop is idle, folding bursts of changes into one redraw"""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self.redraw)
+
+    def redraw(self):
+        """Places a tile on every visible cell, rebinding only the tiles whose item changed"""
+        self._redraw_pending = False
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        cell_width = self.tile_width or max(1, width)
+        columns = max(1, width // cell_width)
+        rows = -(-len(self.model) // columns)
+        self.canvas.configure(scrollregion=(0, 0, width, max(rows * self.tile_height, height)))
+
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // self.tile_height) - self.overscan)
+        last_row = min(rows, int((top + height) // self.tile_height) + 1 + self.overscan)
+        visible = [self.model[index] for index in range(first_row * columns, min(len(self.model),
+                                                                                  last_row * columns))]
+        visible_items = set(visible)
+        kept = {tile[2]: tile for tile in self._tiles if tile[2] in visible_items}
+        free = [tile for tile in self._tiles if tile[2] not in kept]
+        while len(kept) + len(free) < len(visible):
+            tile = self.create_tile(self.canvas)
+            window = self.canvas.create_window(0, 0, window=tile, anchor="nw",
+                                               height=self.tile_height - self.padding * 2)
+            self._tiles.append([tile, window, _REMOVED])
+            free.append(self._tiles[-1])
+
+        self._shown = {}
+        for index, item in enumerate(visible, first_row * columns):
+            tile = kept.get(item) or free.pop()
+            if tile[2] is not item:
+                tile[2] = item
+                self.bind_tile(tile[0], item)
+            row, column = divmod(index, columns)
+            self.canvas.coords(tile[1], column * cell_width + self.padding, row * self.tile_height + self.padding)
+            self.canvas.itemconfigure(tile[1], state="normal", width=max(1, cell_width - self.padding * 2))
+            self._shown[item] = tile[0]
+        for tile in free:  # Left over tiles wait hidden for the next scroll
+            tile[2] = _REMOVED
+            self.canvas.itemconfigure(tile[1], state="hidden")
+
+    def _on_mouse_wheel(self, event):
+        """Scrolls when the wheel turns over the grid or one of its tiles"""
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.canvas.yview_scroll(-4, "units")
+        else:
+            self.canvas.yview_scroll(4, "units")
+        self.redraw()
@@ -0,0 +1,34 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Sequence
+
+
+def run_bounded(func: Callable, items: Sequence, workers: int, stop_flag: Optional[threading.Event] = None,
+                on_result: Optional[Callable] = None) -> List:
+    """Runs func over items on a pool of worker threads, keeping at most two items per worker queued so huge lists
+    don't turn into huge numbers of futures. on_result(index, result) is called on the calling thread as each item
+    finishes, which makes it a safe place to aggregate progress. Returns the results in item order, with None for
+    items that were never started because stop_flag was set."""
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gimmich-worker") as executor:
+        def fill():
+            """Tops the queue back up unless a stop was requested"""
+            while len(in_flight) < workers * 2 and not (stop_flag and stop_flag.is_set()):
+                try:
+                    index, item = next(pending)
+                except StopIteration:
+                    return
+                in_flight[executor.submit(func, item)] = index
+
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                results[index] = future.result()
+                if on_result:
+                    on_result(index, results[index])
+            fill()
+    return results
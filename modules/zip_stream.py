@@ -0,0 +1,228 @@
+import os
+import struct
+import zlib
+from typing import List, Optional
+from modules.file_writer import AtomicFileWriter
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+END_SIGNATURES = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")  # Central directory and end records
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP64_EXTRA_ID = 0x0001
+
+
+class ZipStreamError(Exception):
+    """Raised when the archive stream is malformed or uses a feature the streaming extractor can't handle"""
+
+
+class StreamingZipExtractor:
+    """Extracts a zip archive from a stream of chunks as they arrive, using only the local file headers, so the
+    archive never has to be held in memory or written to disk as a whole. Handles stored and deflated entries,
+    with or without trailing data descriptors, including zip64 sizes."""
+    def __init__(self, destination: str, durable: bool = False):
+        self.destination = destination
+        self.durable = durable
+        self.extracted: List[str] = []  # Paths of the files written so far
+        self._buffer = bytearray()
+        self._state = "header"
+        self._writer: Optional[AtomicFileWriter] = None
+        self._decompressor = None
+        self._flags = 0
+        self._zip64 = False
+        self._expected_crc = 0
+        self._remaining = 0
+        self._crc = 0
+        self._size = 0
+        self._scan_from = 0
+
+    def feed(self, data: bytes):
+        """Feeds the next chunk of the archive, extracting whatever entries it completes"""
+        if self._state == "done":
+            return
+        self._buffer += data
+        while self._step():
+            pass
+
+    def close(self):
+        """Checks the archive ended cleanly, discarding any half written entry if it didn't"""
+        if self._state not in ("header", "done") or (self._state == "header" and self._buffer):
+            self._abort_entry()
+            raise ZipStreamError("Archive stream ended in the middle of an entry")
+
+    def abort(self):
+        """Discards any half written entry and ignores the rest of the stream, for when the download failed"""
+        self._abort_entry()
+        self._state = "done"
+        self._buffer.clear()
+
+    def _safe_path(self, name: str) -> str:
+        """Maps an entry name onto the destination, refusing names that would escape it"""
+        normalized = os.path.normpath(name.replace("\\", "/"))
+        if os.path.isabs(normalized) or normalized.startswith(".."):
+            raise ZipStreamError(f"Unsafe path in archive: {name}")
+        return os.path.join(self.destination, normalized)
+
+    def _step(self) -> bool:
+        """Advances the parser as far as the buffered data allows, returning False when more data is needed"""
+        if self._state == "header":
+            return self._read_header()
+        if self._state == "stored":
+            return self._read_stored()
+        if self._state == "deflate":
+            return self._read_deflate()
+        if self._state == "stored_descriptor":
+            return self._read_stored_until_descriptor()
+        if self._state == "descriptor":
+            return self._read_descriptor()
+        return False
+
+    def _read_header(self) -> bool:
+        """Parses a local file header and opens the entry for writing"""
+        if len(self._buffer) < 4:
+            return False
+        signature = bytes(self._buffer[:4])
+        if signature in END_SIGNATURES:  # Every entry has been seen, the rest is the central directory
+            self._state = "done"
+            self._buffer.clear()
+            return False
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise ZipStreamError("Unexpected data in archive stream")
+        if len(self._buffer) < LOCAL_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, crc, compressed_size, uncompressed_size, name_length,
+         extra_length) = LOCAL_HEADER.unpack_from(self._buffer)
+        header_length = LOCAL_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_length:
+            return False
+        raw_name = bytes(self._buffer[LOCAL_HEADER.size:LOCAL_HEADER.size + name_length])
+        extra = bytes(self._buffer[LOCAL_HEADER.size + name_length:header_length])
+        del self._buffer[:header_length]
+
+        self._zip64 = False
+        offset = 0
+        while offset + 4 <= len(extra):  # Look for zip64 sizes
+            field_id, field_length = struct.unpack_from("<HH", extra, offset)
+            if field_id == ZIP64_EXTRA_ID:
+                self._zip64 = True
+                if compressed_size == 0xFFFFFFFF and field_length >= 16:
+                    uncompressed_size, compressed_size = struct.unpack_from("<QQ", extra, offset + 4)
+            offset += 4 + field_length
+
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        self._flags = flags
+        self._expected_crc = crc
+        self._crc = 0
+        self._size = 0
+        if name.endswith("/"):  # Directory entry
+            os.makedirs(self._safe_path(name), exist_ok=True)
+            self._state = "header"
+            return True
+        path = self._safe_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        has_descriptor = bool(flags & 0x08)
+        if method == zlib.DEFLATED:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._state = "deflate"
+        elif method == 0 and not has_descriptor:
+            self._remaining = compressed_size
+            self._state = "stored"
+        elif method == 0:
+            self._scan_from = 0
+            self._state = "stored_descriptor"
+        else:
+            raise ZipStreamError(f"Unsupported compression method {method} for {name}")
+        self._writer = AtomicFileWriter(path, size=None if has_descriptor else uncompressed_size,
+                                        durable=self.durable)
+        return True
+
+    def _write(self, data: bytes):
+        """Writes entry data and keeps the running checksum"""
+        if data:
+            self._writer.write(data)
+            self._crc = zlib.crc32(data, self._crc)
+            self._size += len(data)
+
+    def _read_stored(self) -> bool:
+        """Copies a stored entry whose size is in the header"""
+        take = min(self._remaining, len(self._buffer))
+        self._write(bytes(self._buffer[:take]))
+        del self._buffer[:take]
+        self._remaining -= take
+        if self._remaining:
+            return False
+        self._finish_entry(self._expected_crc)
+        return True
+
+    def _read_deflate(self) -> bool:
+        """Inflates a deflated entry until the end of its compressed stream"""
+        if not self._buffer:
+            return False
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._write(self._decompressor.decompress(data))
+        if not self._decompressor.eof:
+            return False
+        self._buffer += self._decompressor.unused_data
+        self._decompressor = None
+        if self._flags & 0x08:
+            self._state = "descriptor"
+        else:
+            self._finish_entry(self._expected_crc)
+        return True
+
+    def _read_descriptor(self) -> bool:
+        """Consumes the data descriptor that follows an entry of unknown size"""
+        has_signature = self._buffer[:4] == DATA_DESCRIPTOR_SIGNATURE
+        start = 4 if has_signature else 0
+        length = start + (20 if self._zip64 else 12)
+        if len(self._buffer) < length:
+            return False
+        crc = struct.unpack_from("<I", self._buffer, start)[0]
+        del self._buffer[:length]
+        self._finish_entry(crc)
+        return True
+
+    def _read_stored_until_descriptor(self) -> bool:
+        """Copies a stored entry of unknown size. The end is found by looking for a data descriptor whose checksum
+        and sizes match the bytes copied so far, so file contents that happen to contain the signature are safe."""
+        while True:
+            index = self._buffer.find(DATA_DESCRIPTOR_SIGNATURE, self._scan_from)
+            if index < 0:
+                flush = len(self._buffer) - (len(DATA_DESCRIPTOR_SIGNATURE) - 1)  # Keep a possible partial signature
+                if flush > 0:
+                    self._write(bytes(self._buffer[:flush]))
+                    del self._buffer[:flush]
+                self._scan_from = 0
+                return False
+            if index:  # Everything before the candidate is entry data
+                self._write(bytes(self._buffer[:index]))
+                del self._buffer[:index]
+            if self._zip64:  # Zip64 entries carry 8 byte sizes in their descriptor
+                descriptor_format, descriptor_length = "<IQQ", 24
+            else:
+                descriptor_format, descriptor_length = "<III", 16
+            if len(self._buffer) < descriptor_length:
+                self._scan_from = 0
+                return False
+            crc, compressed_size, uncompressed_size = struct.unpack_from(descriptor_format, self._buffer, 4)
+            if crc == self._crc and compressed_size == uncompressed_size == self._size:
+                del self._buffer[:descriptor_length]
+                self._finish_entry(crc)
+                return True
+            self._scan_from = 1  # False alarm, the signature bytes are part of the file
+
+    def _finish_entry(self, expected_crc: int):
+        """Verifies the checksum and moves the finished file into place"""
+        if self._crc != expected_crc:
+            self._abort_entry()
+            raise ZipStreamError("Checksum mismatch in archive entry")
+        self._writer.commit()
+        self.extracted.append(self._writer.path)
+        self._writer = None
+        self._state = "header"
+
+    def _abort_entry(self):
+        """Discards the entry being written"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
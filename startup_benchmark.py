@@ -0,0 +1,82 @@
+import time
+start = time.perf_counter()  # Taken before any other import so import time is counted
+import argparse
+import socket
+import sys
+import threading
+
+
+def stalled_server():
+    """Listens on a local port and accepts connections but never answers, like an overloaded or hung server.
+    Returns its URL."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(64)
+    connections = []
+
+    def accept():
+        while True:
+            connection, _ = listener.accept()
+            connections.append(connection)  # Held open so the client waits for the read timeout
+
+    threading.Thread(target=accept, daemon=True).start()
+    return f"http://127.0.0.1:{listener.getsockname()[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long the gimmich window takes to appear and how "
+                                                 "responsive it stays while the login is checked")
+    parser.add_argument("--target", type=float, default=1.5, help="Most seconds allowed until the window is drawn")
+    parser.add_argument("--max-stall", type=float, default=0.25,
+                        help="Longest seconds the event loop may go without running after the window is drawn")
+    parser.add_argument("--watch", type=float, default=3.0, help="Seconds to watch the event loop for")
+    parser.add_argument("--saved-login", action="store_true",
+                        help="Use the login saved in the keyring instead of a server that never answers")
+    args = parser.parse_args()
+
+    from modules.api_client import ImmichClient
+    if not args.saved_login:
+        url = stalled_server()
+
+        def load_credentials(client):
+            """Stands in for the saved login, pointing the client at the stalled server"""
+            client.base_url = url
+            client.token = "benchmark"
+            client.logged_in = True
+
+        ImmichClient.load_credentials = load_credentials
+    import customtkinter as ctk
+    from gimmich import GimmichApp
+    imported = time.perf_counter()
+
+    ctk.set_appearance_mode("Dark")
+    ctk.set_default_color_theme("dark-blue")
+    app = GimmichApp()
+    app.update()  # Maps and draws the window
+    drawn = time.perf_counter()
+
+    ticks = [drawn]
+
+    def tick():
+        """Records when the event loop got to run"""
+        ticks.append(time.perf_counter())
+        if ticks[-1] - drawn < args.watch:
+            app.after(10, tick)
+        else:
+            app.quit()
+
+    app.after(10, tick)
+    app.mainloop()
+    app.on_closing()
+    stall = max(later - earlier for earlier, later in zip(ticks, ticks[1:]))
+
+    print(f"Imports: {imported - start:.3f}s")
+    print(f"Window drawn: {drawn - start:.3f}s (target {args.target:.3f}s)")
+    print(f"Longest event loop stall: {stall:.3f}s (target {args.max_stall:.3f}s)")
+    passed = drawn - start <= args.target and stall <= args.max_stall
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())